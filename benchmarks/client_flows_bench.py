@@ -0,0 +1,205 @@
+"""Benchmark CALPADSClient flows end to end against a local fake CALPADS server
+
+Usage: python benchmarks/client_flows_bench.py --iterations 20 --concurrency 4 --latency 0.02
+
+Starts a FakeCALPADSServer (see tests/fake_calpads.py) on a free local port and runs each flow
+--iterations times on --concurrency threads, each thread with its own logged in client. The clients
+share one CALPADSTransport, like a CALPADSClientPool does, with the rate limit raised to --rate so the
+throttle only matters when asked to. For every flow it reports the throughput and the p50/p90/p99
+latency; --steps adds the per-step timings the clients record for their multi-step operations, and
+--json writes everything, including the per-endpoint request metrics, to a file.
+
+Flows:
+    login             a fresh client walks the whole login dance
+    select_lea        switch the session to another LEA
+    download_report   report page, SSRS form, form POST, and streamed export (--schools, --report-bytes)
+    request_extract   extract form, listing, and request POST
+    download_extract  wait on a requested extract and stream it (--extract-bytes)
+    upload_file       upload page and multipart upload of a --upload-bytes file
+    post_file         submission status, detail page, and post
+    histories         one student enrollment history lookup
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from calpads.client import CALPADSClient  # noqa: E402
+from calpads.metrics import MetricsRegistry  # noqa: E402
+from calpads.transport import CALPADSTransport  # noqa: E402
+from tests.fake_calpads import FakeCALPADSServer  # noqa: E402
+
+FLOWS = ('login', 'select_lea', 'download_report', 'request_extract', 'download_extract', 'upload_file',
+         'post_file', 'histories')
+
+
+class NullSink:
+    """A writable binary file-like object that discards what is written, so disk speed isn't measured"""
+
+    def write(self, data):
+        return len(data)
+
+
+class FlowRunner:
+
+    def __init__(self, server, transport, metrics, upload_path, chunk_size):
+        """Runs single iterations of each flow with a client per thread"""
+        self.server = server
+        self.transport = transport
+        self.metrics = metrics
+        self.upload_path = upload_path
+        self.chunk_size = chunk_size
+        self.lea_code = server.lea_codes[0]
+        # ExtractRequest handles from request_extract, consumed by download_extract
+        self.extract_requests = queue.Queue()
+        self._local = threading.local()
+
+    def new_client(self):
+        return CALPADSClient(self.server.username, self.server.password, transport=self.transport,
+                             metrics=self.metrics, host=self.server.url)
+
+    @property
+    def client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.new_client()
+            client._ensure_logged_in()
+        return client
+
+    def login(self, i):
+        client = self.new_client()
+        client._ensure_logged_in()
+        client.session.close()
+
+    def select_lea(self, i):
+        lea_codes = self.server.lea_codes
+        client = self.client
+        current = lea_codes.index(client._selected_lea) if client._selected_lea in lea_codes else -1
+        client._select_lea(lea_codes[(current + 1) % len(lea_codes)])
+
+    def download_report(self, i):
+        if not self.client.download_report(self.lea_code, '1.1', file_name=NullSink(),
+                                           form_data={'AcademicYear': '2019-2020'}, chunk_size=self.chunk_size):
+            raise RuntimeError("The report wasn't downloaded")
+
+    def request_extract(self, i):
+        extract_request = self.client.request_extract(self.lea_code, 'SENR',
+                                                      form_data=[('EffectiveStartDate', '08/15/2019')])
+        if not extract_request:
+            raise RuntimeError("The extract wasn't requested")
+        self.extract_requests.put(extract_request)
+
+    def download_extract(self, i):
+        try:
+            extract_request = self.extract_requests.get_nowait()
+        except queue.Empty:
+            extract_request = None
+        if not self.client.download_extract(self.lea_code, file_name=NullSink(), poll=1, chunk_size=self.chunk_size,
+                                            extract_request=extract_request):
+            raise RuntimeError("The extract wasn't downloaded")
+
+    def upload_file(self, i):
+        if not self.client.upload_file(self.lea_code, self.upload_path, form_data=[('FileType', 'SENR')]):
+            raise RuntimeError("The file wasn't uploaded")
+
+    def post_file(self, i):
+        posted, errors = self.client.post_file(self.lea_code)
+        if not posted:
+            raise RuntimeError("The file wasn't posted")
+
+    def histories(self, i):
+        self.client.get_enrollment_history('{:010d}'.format(1000000000 + i))
+
+
+def run_flow(runner, flow_name, iterations, concurrency, timings):
+    """Run flow_name iterations times on concurrency threads. Returns the wall time in seconds."""
+    step = getattr(runner, flow_name)
+
+    def timed(i):
+        try:
+            with timings.flow(flow_name):
+                step(i)
+        except Exception as e:
+            logging.getLogger(__name__).warning("{} failed: {!r}".format(flow_name, e))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, range(iterations)))
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--flows', default=','.join(FLOWS), help='comma separated, from: ' + ' '.join(FLOWS))
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the server waits before each response')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--schools', type=int, default=50, help='options in the report and extract forms')
+    parser.add_argument('--report-bytes', type=int, default=1024 * 1024)
+    parser.add_argument('--extract-bytes', type=int, default=1024 * 1024)
+    parser.add_argument('--upload-bytes', type=int, default=256 * 1024)
+    parser.add_argument('--chunk-size', type=int, default=1024 * 1024)
+    parser.add_argument('--rate', type=float, default=1000.0, help='requests per second the transport allows')
+    parser.add_argument('--steps', action='store_true', help='also print the per-step timings')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+    flow_names = [name.strip() for name in args.flows.split(',') if name.strip()]
+    unknown = [name for name in flow_names if name not in FLOWS]
+    if unknown:
+        parser.error("Unknown flows: {}".format(', '.join(unknown)))
+    logging.getLogger('calpads').setLevel(logging.WARNING)
+
+    server = FakeCALPADSServer(latency=args.latency, jitter=args.jitter, schools=args.schools,
+                               report_bytes=args.report_bytes, extract_bytes=args.extract_bytes)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    transport = CALPADSTransport(host_rates=dict(), default_rate=(args.rate, max(1, int(args.rate))),
+                                 initial_concurrency=args.concurrency, max_concurrency=max(32, args.concurrency))
+    metrics = MetricsRegistry()
+    timings = MetricsRegistry()
+    wall_times = dict()
+    with TemporaryDirectory() as tmp_dir:
+        upload_path = os.path.join(tmp_dir, 'upload.txt')
+        with open(upload_path, 'wb') as f:
+            f.write(server.payload('SENR', args.upload_bytes))
+        runner = FlowRunner(server, transport, metrics, upload_path, args.chunk_size)
+        # Log every worker's client in up front so the first iterations of each flow aren't charged for it
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(lambda _: runner.client, range(args.concurrency)))
+        for flow_name in flow_names:
+            wall_times[flow_name] = run_flow(runner, flow_name, args.iterations, args.concurrency, timings)
+    server.shutdown()
+    server.server_close()
+
+    results = {flow['flow']: dict(flow, throughput=flow['count'] / wall_times[flow['flow']])
+               for flow in timings.to_json()['flows']}
+    print("{} iterations per flow on {} threads, {:.0f} ms latency, {} byte reports, {} byte extracts"
+          .format(args.iterations, args.concurrency, args.latency * 1000, args.report_bytes, args.extract_bytes))
+    print("{:<18}{:>6}{:>8}{:>10}{:>10}{:>10}{:>10}".format('flow', 'ok', 'errors', 'per sec', 'p50 ms',
+                                                           'p90 ms', 'p99 ms'))
+    for flow_name in flow_names:
+        result = results[flow_name]
+        print("{:<18}{:>6}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+            flow_name, result['ok'], result['error'], result['throughput'], result['p50'] * 1000,
+            result['p90'] * 1000, result['p99'] * 1000))
+    client_metrics = metrics.to_json()
+    if args.steps:
+        print("\n{:<18}{:<16}{:>8}{:>10}{:>10}".format('flow', 'step', 'count', 'p50 ms', 'p99 ms'))
+        for step in client_metrics['steps']:
+            print("{:<18}{:<16}{:>8}{:>10.1f}{:>10.1f}".format(step['flow'], step['step'], step['count'],
+                                                              step['p50'] * 1000, step['p99'] * 1000))
+    if args.json:
+        with open(args.json, 'w', encoding='utf8') as f:
+            json.dump({'arguments': vars(args), 'flows': results, 'client': client_metrics}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""Serve the fake CALPADS that the offline tests use on a local port
+
+Usage: python benchmarks/fake_calpads_server.py --port 8080 --latency 0.05
+
+The FakeCALPADSServer (see tests/fake_calpads.py) answers everything CALPADSClient walks through with
+sanitized pages. Each response is delayed by latency (plus up to jitter) seconds, and the report form,
+report, and extract sizes are configurable, so client-side parsing and streaming costs can be measured
+with and without simulated network time.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from tests.fake_calpads import FakeCALPADSServer  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--username', default='bench')
+    parser.add_argument('--password', default='bench')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--schools', type=int, default=50)
+    parser.add_argument('--report-bytes', type=int, default=1024 * 1024)
+    parser.add_argument('--extract-bytes', type=int, default=1024 * 1024)
+    args = parser.parse_args()
+
+    server = FakeCALPADSServer((args.host, args.port), args.username, args.password, args.latency, args.jitter,
+                               schools=args.schools, report_bytes=args.report_bytes,
+                               extract_bytes=args.extract_bytes)
+    print("Serving a fake CALPADS at {}".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Benchmark parsing a large synthetic SENR extract on one core and on a process pool
+
+Usage: python benchmarks/parallel_parser_bench.py --megabytes 200 --workers 1,2,4,8 --output numpy
+
+Writes --megabytes of caret-delimited SENR rows to a temporary file, then times the single core
+iter_extract_columns() and iter_parallel_batches() for each worker count, reporting rows per second
+and the speedup over the single core parser.
+"""
+import argparse
+import os
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from calpads.extract_parser import iter_extract_columns  # noqa: E402
+from calpads.parallel_parser import DEFAULT_RANGE_SIZE, iter_parallel_batches  # noqa: E402
+from tests.fake_calpads import SENR_ROW  # noqa: E402
+
+
+def write_extract(path, megabytes):
+    """Writes about megabytes of SENR rows to path. Returns the row count."""
+    rows_per_block = 10000
+    size = megabytes * 1024 * 1024
+    written = rows = 0
+    with open(path, 'wb') as f:
+        while written < size:
+            block = ''.join(SENR_ROW.format(ssid=1000000000 + rows + i) for i in range(rows_per_block)).encode('utf8')
+            f.write(block)
+            written += len(block)
+            rows += rows_per_block
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--megabytes', type=int, default=100)
+    parser.add_argument('--workers', default=','.join(str(2 ** i) for i in range(4) if 2 ** i <= os.cpu_count()))
+    parser.add_argument('--output', choices=('numpy', 'arrow'), default='numpy')
+    parser.add_argument('--range-size', type=int, default=DEFAULT_RANGE_SIZE)
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'senr.txt')
+        rows = write_extract(path, args.megabytes)
+        print("{} rows, {} MB, {} output, {} byte ranges, {} CPUs".format(rows, args.megabytes, args.output,
+                                                                          args.range_size, os.cpu_count()))
+        started = time.perf_counter()
+        parsed = sum(len(batch['ssid']) for batch in iter_extract_columns(path, batch_size=100000))
+        baseline = time.perf_counter() - started
+        print("{:<12}{:>12}{:>14}{:>10}".format('workers', 'seconds', 'rows/sec', 'speedup'))
+        print("{:<12}{:>12.2f}{:>14.0f}{:>10.2f}".format('streaming', baseline, parsed / baseline, 1.0))
+        for workers in [int(w) for w in args.workers.split(',') if w.strip()]:
+            started = time.perf_counter()
+            parsed = sum(batch.num_rows if args.output == 'arrow' else len(batch['ssid'])
+                         for batch in iter_parallel_batches(path, output=args.output, max_workers=workers,
+                                                            range_size=args.range_size, ordered=False))
+            elapsed = time.perf_counter() - started
+            print("{:<12}{:>12.2f}{:>14.0f}{:>10.2f}".format(workers, elapsed, parsed / elapsed, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
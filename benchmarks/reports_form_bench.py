@@ -0,0 +1,132 @@
+"""Benchmark ReportsForm parsing and filling on a synthetic SSRS report form
+
+Usage: python benchmarks/reports_form_bench.py --schools 500 --repeat 5
+
+The synthetic form mimics the report viewer markup CALPADS serves: a couple of select parameters,
+a text parameter, and a multi-select School dropdown whose labels and hidden input live in a separate
+div. The same form is parsed and filled with the current ReportsForm and with LegacyReportsForm, a
+copy of the per-parameter/per-option XPath approach it replaced, so the two can be compared directly.
+"""
+import argparse
+import os
+import sys
+import time
+import unicodedata
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from calpads.reports_form import ReportsForm  # noqa: E402
+from tests.fake_calpads import build_report_form  # noqa: E402
+
+
+class LegacyReportsForm(ReportsForm):
+    """The previous ReportsForm parse/fill, which ran XPath over the whole document per parameter and per option"""
+
+    def parse_the_form(self):
+        all_form_elements = self.root.xpath("//*[@data-parametername]")
+        params_dict = dict.fromkeys([tag.attrib['data-parametername'] for tag in all_form_elements])
+        for element in all_form_elements:
+            tag_combos = []
+            key = element.attrib['data-parametername']
+            for child in element.xpath('.//*'):
+                tag_combos.append(child.tag)
+                if 'calendar' in child.attrib.get('class', ''):
+                    tag_combos = tag_combos[:-2]
+            params_dict[key] = [tuple(tag_combos)]
+        for parametername, param_values in params_dict.items():
+            if param_values[0][0] == 'select':
+                select = self.root.xpath("//*[@data-parametername='{}']//select".format(parametername))[0]
+                param_values.append(('select',
+                                     tuple((unicodedata.normalize('NFKC', option.text), select.attrib.get('name'),
+                                            unicodedata.normalize('NFKC', option.attrib.get('value')))
+                                           for option in select.xpath('.//*')
+                                           if unicodedata.normalize('NFKC', option.text) != '<Select a Value>')))
+            elif param_values[0][-1] == 'input':
+                param_values.append(('textbox', ('plain text',
+                                                 self.root.xpath("//*[@data-parametername='{}']"
+                                                                 .format(parametername))[0]
+                                                 .xpath(".//input")[0].get('name'))))
+            elif param_values[0][-1] == 'label':
+                param_values.append(('textbox_defaultnull', ('plain text', '')))
+            else:
+                form_input_div = self.root.xpath("//*[@data-parametername='{}']".format(parametername))[0]
+                div_id = form_input_div.attrib['id'] + '_divDropDown'
+                all_input_labels = self.root.xpath('//*[contains(@for, "{}")]'.format(div_id))
+                all_input_labels_txt = [unicodedata.normalize('NFKC', label.text) for label in all_input_labels
+                                        if unicodedata.normalize('NFKC', label.text) != '(Select All)']
+                dict_opts = dict.fromkeys(all_input_labels_txt)
+                for idx, item in enumerate(all_input_labels_txt):
+                    dict_opts[item] = ((True, False),
+                                       self.root.xpath('//input[@type="hidden" and contains(@id, "{}")]'
+                                                       .format(div_id))[0].attrib.get('name'),
+                                       str(idx))
+                param_values.append(('dropdown', dict_opts))
+        return params_dict
+
+    def fill_form(self, form_data):
+        to_submit = dict()
+        for paramname, paramvalue in form_data.items():
+            parsed = self.complete_parse.get(paramname)
+            if not parsed:
+                continue
+            if parsed[1][0] == 'select':
+                formname = parsed[1][1][0][1]
+                formval = None
+                for val_tuple in parsed[1][1]:
+                    if val_tuple[0].lower() == paramvalue.lower():
+                        formval = val_tuple[2]
+                if formval is not None:
+                    to_submit[formname] = formval
+            elif parsed[1][0] == 'dropdown':
+                valid_dict = parsed[1][1]
+                formname = valid_dict[list(valid_dict.keys())[0]][1]
+                formval = ''
+                for checkbox, checked in paramvalue.items():
+                    if checkbox in valid_dict.keys() and checked:
+                        formval = ','.join([formval, valid_dict[checkbox][2]]) if formval else valid_dict[checkbox][2]
+                if formval:
+                    to_submit[formname] = formval
+            elif parsed[1][0] in ('textbox', 'textbox_defaultnull'):
+                to_submit[parsed[1][1]] = paramvalue
+        return to_submit
+
+
+def time_form(form_cls, page_source, form_data, repeat):
+    """Returns the best (parse seconds, fill seconds) over repeat runs, and the filled form data"""
+    best_parse = best_fill = float('inf')
+    filled = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        form = form_cls(page_source)
+        parsed = time.perf_counter()
+        filled = form.get_final_form_data(form_data)
+        done = time.perf_counter()
+        best_parse = min(best_parse, parsed - start)
+        best_fill = min(best_fill, done - parsed)
+    return best_parse, best_fill, filled
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--schools', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    page_source = build_report_form(args.schools)
+    form_data = {'AcademicYear': '2019-2020', 'Status': 'revised uncertified',
+                 'School': {'School {0:04d} (19{0:05d})'.format(i + 2): True for i in range(0, args.schools, 2)}}
+
+    legacy = time_form(LegacyReportsForm, page_source, form_data, args.repeat)
+    current = time_form(ReportsForm, page_source, form_data, args.repeat)
+    if legacy[2] != current[2]:
+        raise SystemExit("The parsers disagree on the filled form data")
+
+    print("ReportsForm with {} schools (best of {})".format(args.schools, args.repeat))
+    print("{:<10}{:>14}{:>14}".format('', 'parse (ms)', 'fill (ms)'))
+    for name, (parse_s, fill_s, _) in (('legacy', legacy), ('current', current)):
+        print("{:<10}{:>14.2f}{:>14.3f}".format(name, parse_s * 1000, fill_s * 1000))
+    print("speedup   {:>13.1f}x{:>13.1f}x".format(legacy[0] / current[0], legacy[1] / current[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,684 @@
+"""Asyncio counterpart to the CALPADSClient
+
+The CALPADSClient is built on a blocking requests.Session, which ties up a thread per in-flight
+request. The AsyncCALPADSClient exposes the same methods as coroutines on top of aiohttp so that
+hundreds of lookups and long-running polls can share a single event loop.
+
+The login flow is handled iteratively after each response instead of inside a response hook, and
+every poll loop awaits asyncio.sleep() instead of time.sleep().
+
+Requires the optional aiohttp dependency: pip install calpads[async]
+"""
+import asyncio
+import json
+import logging
+import time
+from json import JSONDecodeError
+from urllib.parse import urlsplit, urljoin
+from lxml import etree
+from .reports_form import ReportsForm, REPORTS_DL_FORMAT
+from .extracts_form import ExtractsForm
+from .files_upload_form import FilesUploadForm
+from .downloads import DownloadCounter, open_sink
+from .reports_catalog import ReportCatalog, ODS_LISTING_PATH, SNAPSHOT_LISTING_PATH
+from .exceptions import ReportNotFound, SessionExpired
+from .auth import LoginFlow, LOGIN_PATHS, is_login_page
+from .form_schema_cache import FormSchemaCache
+from .extract_requests import ExtractRequest, ExtractIdRegistry, is_extract_complete, is_extract_failed, backoff_delays
+from .client import (extract_page_path, choose_extract_form, fill_extract_form, is_extract_request_success,
+                     parse_org_change_form, find_org_value, get_report_iframe_url,
+                     get_report_export_url, extract_schema_name, report_schema_name, SUBMISSION_EXTRACTS,
+                     IDEMPOTENT_METHODS, DEFAULT_HOST, check_extract_request_lea)
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncPage:
+    """The parts of a fully read aiohttp response that the client needs"""
+
+    def __init__(self, url, status_code, content, encoding=None):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding or 'utf-8'
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors='replace')
+
+    def json(self):
+        try:
+            return json.loads(self.content)
+        except JSONDecodeError:
+            return {}
+
+
+class AsyncCALPADSClient:
+
+    def __init__(self, username, password, max_connections=100, chunk_size=64 * 1024, report_catalog=None,
+                 schema_cache=None, host=DEFAULT_HOST):
+        """Async CALPADS client. Use it as an async context manager, which opens the session and logs in:
+
+            async with AsyncCALPADSClient(username, password) as client:
+                history = await client.get_enrollment_history(ssid)
+
+        Args:
+            username (str): CALPADS username
+            password (str): CALPADS password
+            max_connections (int): the most simultaneous connections the underlying session will open
+            chunk_size (int): the size of the chunks used when streaming downloads to disk
+            report_catalog (ReportCatalog, optional): the index used to look up report URLs.
+                Defaults to an in-memory catalog with a 12 hour TTL.
+            schema_cache (FormSchemaCache, optional): where parsed form schemas are cached for dry runs.
+                Defaults to an in-memory cache.
+            host (str, optional): the root URL of the CALPADS site, e.g. a local stand-in server for offline testing and
+                benchmarks. Defaults to https://www.calpads.org/.
+        """
+        if aiohttp is None:
+            raise ImportError("The AsyncCALPADSClient requires aiohttp. Try: pip install calpads[async]")
+        # urljoin() and the post-login URL check expect the trailing slash
+        self.host = host.rstrip('/') + '/'
+        self.username = username
+        self.password = password
+        self.credentials = {'Username': self.username,
+                            'Password': self.password}
+        self.max_connections = max_connections
+        self.chunk_size = chunk_size
+        self.session = None
+        # DownloadStats for the most recent streamed download
+        self.last_download = None
+        self.report_catalog = report_catalog or ReportCatalog()
+        self.schema_cache = schema_cache or FormSchemaCache()
+        self._extract_ids = ExtractIdRegistry()
+        self.headers = {'User-Agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 \
+        (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36"}
+        self._lea_lock = None
+        self._login_lock = None
+        # The selected LEA is server-side session state; track it to skip redundant switches
+        self._selected_lea = None
+        self._org_change_form = None
+        self._auth_generation = 0
+        self.__connection_status = False
+        # The LoginFlow of the most recent login, with its step timings
+        self.last_login = None
+        self.log = logging.getLogger(__name__)
+
+    async def __aenter__(self):
+        await self.open()
+        try:
+            await self._login()
+        except Exception:
+            await self.close()
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        """Creates the aiohttp session. Called by __aenter__, or lazily on the first request."""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(headers=self.headers,
+                                                 cookie_jar=aiohttp.CookieJar(unsafe=True),
+                                                 connector=aiohttp.TCPConnector(limit=self.max_connections))
+        if self._lea_lock is None:
+            # The selected LEA is server-side session state, so LEA-scoped operations must not interleave
+            self._lea_lock = asyncio.Lock()
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def _login(self):
+        """Login method which generally doesn't need to be called except when opening the client."""
+        page = await self._send('GET', self.host)
+        self.__connection_status = page.status_code == 200 and page.url == self.host
+        return self.__connection_status
+
+    @property
+    def is_connected(self):
+        """User exposed attribute to check whether the client successfully connected. Might return false positives."""
+        return self.__connection_status
+
+    async def _fetch(self, method, url, **kwargs):
+        """Make a single request (following redirects) and read the whole body"""
+        await self.open()
+        async with self.session.request(method, url, **kwargs) as response:
+            content = await response.read()
+            return AsyncPage(str(response.url), response.status, content, response.get_encoding())
+
+    async def _send(self, method, url, **kwargs):
+        """Make a request, completing the OAuth/OpenID dance if CALPADS interrupts it with a login page.
+
+        CALPADS redirects back to the original URL once the dance is over, so the returned page is the one
+        that was asked for. If the session expired while working within an LEA, the LEA is selected again and an
+        idempotent request is replayed once; anything else raises SessionExpired, like CALPADSClient._request.
+        """
+        selected_lea = self._selected_lea
+        auth_generation = self._auth_generation
+        replayable = selected_lea is None or method.upper() in IDEMPOTENT_METHODS
+        page = await self._fetch_logged_in(method, url, auth_generation, replayable, **kwargs)
+        if selected_lea is None or auth_generation == self._auth_generation:
+            return page
+        if not replayable:
+            raise SessionExpired("The session expired during {} {}. Logged in again, but did not replay it."
+                                 .format(method.upper(), url))
+        self.log.info("The session expired; logged in again and replaying {} {}".format(method.upper(), url))
+        await self._select_lea(selected_lea)
+        return await self._fetch_logged_in(method, url, self._auth_generation, True, **kwargs)
+
+    async def _fetch_logged_in(self, method, url, auth_generation, replayable, **kwargs):
+        """_fetch, walking the login dance if CALPADS answers with a login page
+
+        Only one coroutine walks the dance at a time. The others wait for it and then retry on the session it
+        logged in, unless the request can't be replayed, in which case its login page is returned as is and
+        _send raises SessionExpired.
+        """
+        page = await self._fetch(method, url, **kwargs)
+        if not is_login_page(page.url, page.status_code):
+            return page
+        async with self._login_lock:
+            if auth_generation != self._auth_generation:
+                if not replayable:
+                    return page
+                self.log.debug("Another request logged in while this one waited; retrying {} {}"
+                               .format(method.upper(), url))
+                page = await self._fetch(method, url, **kwargs)
+            return await self._complete_login(page)
+
+    async def _complete_login(self, page):
+        """Walk the login dance if page is a login page, returning the page CALPADS redirects back to
+
+        Shares LoginFlow with CALPADSClient, so it raises AuthenticationError after a bounded number of steps.
+        """
+        flow = LoginFlow(self.credentials, self.host)
+        step = flow.next_step(page.url, page.status_code, page.text)
+        if step is None:
+            return page
+        while step is not None:
+            self.log.debug("Handling {} with a {} step".format(urlsplit(page.url).path, step.state))
+            if step.state == 'credentials':
+                # A fresh login starts a fresh server-side session, so forget the LEA context
+                self._auth_generation += 1
+                self._selected_lea = None
+                self._org_change_form = None
+            page = await self._fetch(step.method, step.url, data=step.data)
+            flow.record(page.url, page.status_code)
+            step = flow.next_step(page.url, page.status_code, page.text)
+        self.last_login = flow
+        self.log.info("Logged in with {} requests in {:.2f} seconds".format(flow.steps, flow.total_seconds))
+        return page
+
+    async def _get_json(self, path):
+        page = await self._send('GET', urljoin(self.host, path))
+        return page.json()
+
+    async def _stream_to_file(self, url, sink, checksum=None):
+        """Stream the body at url to sink (a path or writable file-like) chunk by chunk. Returns True on success."""
+        await self.open()
+        for _ in range(2):
+            async with self.session.get(url) as response:
+                if urlsplit(str(response.url)).path not in LOGIN_PATHS:
+                    counter = DownloadCounter(checksum)
+                    with open_sink(sink) as f:
+                        async for chunk in response.content.iter_chunked(self.chunk_size):
+                            f.write(chunk)
+                            counter.update(chunk)
+                    self.last_download = counter.stats(str(response.url))
+                    return True
+            # The session expired mid-flow; log back in and try once more
+            await self._send('GET', self.host)
+        return False
+
+    async def get_leas(self):
+        """Async counterpart of CALPADSClient.get_leas"""
+        return await self._get_json('Leas?format=JSON')
+
+    async def get_all_schools(self, lea_code):
+        """Async counterpart of CALPADSClient.get_all_schools"""
+        return await self._get_json(f"/SchoolListingAll?lea={lea_code}&format=JSON")
+
+    async def get_submitter_names(self, lea_code):
+        """Async counterpart of CALPADSClient.get_submitter_names"""
+        return await self._get_json(f"/GetSubmitterNames?leaCdsCode={lea_code}&format=JSON")
+
+    async def get_user_orgs(self, lea_code, email):
+        """Async counterpart of CALPADSClient.get_user_orgs"""
+        async with self._lea_scope(lea_code):
+            page = await self._send('GET', urljoin(self.host, f"/GetUserOrgs/{email}?format=JSON"))
+        if page.status_code == 200:
+            return page.json()
+        else:
+            return json.loads('{"Data": [],"Total Count": 0}')
+
+    async def get_homepage_important_messages(self):
+        """Async counterpart of CALPADSClient.get_homepage_important_messages"""
+        return await self._get_json('/HomepageImportantMessages?format=JSON&skip=0&take=5&undefined=0')
+
+    async def get_homepage_anomaly_status(self):
+        """Async counterpart of CALPADSClient.get_homepage_anomaly_status"""
+        return await self._get_json('/HomepageAnomalyStatus?format=JSON')
+
+    async def get_homepage_certification_status(self):
+        """Async counterpart of CALPADSClient.get_homepage_certification_status"""
+        return await self._get_json('/HomepageCertificationStatus?format=JSON')
+
+    async def get_homepage_submission_status(self):
+        """Async counterpart of CALPADSClient.get_homepage_submission_status"""
+        return await self._get_json('/HomepageSubmissions?format=JSON')
+
+    async def get_homepage_extract_status(self):
+        """Async counterpart of CALPADSClient.get_homepage_extract_status"""
+        return await self._get_json('/HomepageNotifications?format=JSON')
+
+    async def get_enrollment_history(self, ssid):
+        """Async counterpart of CALPADSClient.get_enrollment_history"""
+        return await self._get_json(f'/Student/{ssid}/Enrollment?format=JSON')
+
+    async def get_demographics_history(self, ssid):
+        """Async counterpart of CALPADSClient.get_demographics_history"""
+        return await self._get_json(f'/Student/{ssid}/Demographics?format=JSON')
+
+    async def get_address_history(self, ssid):
+        """Async counterpart of CALPADSClient.get_address_history"""
+        return await self._get_json(f'/Student/{ssid}/Address?format=JSON')
+
+    async def get_elas_history(self, ssid):
+        """Async counterpart of CALPADSClient.get_elas_history"""
+        return await self._get_json(f'/Student/{ssid}/EnglishLanguageAcquisition?format=JSON')
+
+    async def get_program_history(self, ssid):
+        """Async counterpart of CALPADSClient.get_program_history"""
+        return await self._get_json(f'/Student/{ssid}/Program?format=JSON')
+
+    async def get_student_course_section_history(self, ssid):
+        """Async counterpart of CALPADSClient.get_student_course_section_history"""
+        return await self._get_json(f'/Student/{ssid}/StudentCourseSection?format=JSON')
+
+    async def get_cte_history(self, ssid):
+        """Async counterpart of CALPADSClient.get_cte_history"""
+        return await self._get_json(f'/Student/{ssid}/CareerTechnicalEducation?format=JSON')
+
+    async def get_stas_history(self, ssid):
+        """Async counterpart of CALPADSClient.get_stas_history"""
+        return await self._get_json(f'/Student/{ssid}/StudentAbsenceSummary?format=JSON')
+
+    async def get_sirs_history(self, ssid):
+        """Async counterpart of CALPADSClient.get_sirs_history"""
+        return await self._get_json(f'/Student/{ssid}/StudentIncidentResult?format=JSON')
+
+    async def get_soff_history(self, ssid):
+        """Async counterpart of CALPADSClient.get_soff_history"""
+        return await self._get_json(f'/Student/{ssid}/Offense?format=JSON')
+
+    async def get_assessment_history(self, ssid):
+        """Async counterpart of CALPADSClient.get_assessment_history"""
+        return await self._get_json(f'/Student/{ssid}/Assessment?format=JSON')
+
+    async def get_sped_history(self, ssid):
+        """Async counterpart of CALPADSClient.get_sped_history"""
+        return await self._get_json(f'/Student/{ssid}/SPED?format=JSON')
+
+    async def get_ssrv_history(self, ssid):
+        """Async counterpart of CALPADSClient.get_ssrv_history"""
+        return await self._get_json(f'/Student/{ssid}/SSRV?format=JSON')
+
+    async def get_psts_history(self, ssid):
+        """Async counterpart of CALPADSClient.get_psts_history"""
+        return await self._get_json(f'/Student/{ssid}/PSTS?format=JSON')
+
+    async def get_requested_extracts(self, lea_code):
+        """Async counterpart of CALPADSClient.get_requested_extracts"""
+        return await self._get_json(f'/Extract?SelectedLEA={lea_code}&format=JSON')
+
+    async def get_staff_demographics_history(self, seid):
+        """Async counterpart of CALPADSClient.get_staff_demographics_history"""
+        return await self._get_json(f'/Staff/{seid}/StaffDemographics?format=JSON')
+
+    async def get_staff_assignments_history(self, seid):
+        """Async counterpart of CALPADSClient.get_staff_assignments_history"""
+        return await self._get_json(f'/Staff/{seid}/StaffAssignments?format=JSON')
+
+    async def get_staff_courses_history(self, seid):
+        """Async counterpart of CALPADSClient.get_staff_courses_history"""
+        return await self._get_json(f'/Staff/{seid}/StaffCourses?format=JSON')
+
+    async def download_report(self, lea_code, report_code, file_name=None, is_snapshot=False,
+                              download_format='CSV', form_data=None, dry_run=False, url_override=None,
+                              checksum=None):
+        """Async counterpart of CALPADSClient.download_report; the arguments and return values are the same.
+        The chunk size for streaming is set on the client."""
+        if not REPORTS_DL_FORMAT.get(download_format.upper()):
+            self.log.info('{} is not a supported reports download format. Try: {}'
+                          .format(download_format, ' '.join(REPORTS_DL_FORMAT.keys())))
+            raise Exception('Bad download format')
+        if not file_name:
+            file_name = 'data'
+        schema_name = report_schema_name(report_code, is_snapshot, url_override)
+        if dry_run:
+            cached_schema = self.schema_cache.get('report', lea_code, schema_name)
+            if cached_schema is not None:
+                return cached_schema
+        async with self._lea_scope(lea_code):
+            if url_override is None:
+                report_url = await self._get_report_link(report_code.lower(), is_snapshot)
+            else:
+                report_url = url_override
+            if not report_url:
+                raise ReportNotFound("Report Not Found")
+            page = await self._send('GET', report_url)
+            page = await self._send('GET', get_report_iframe_url(page.text))
+            form = ReportsForm(page.text)
+            self.schema_cache.put('report', lea_code, schema_name, form.filtered_parse)
+            if dry_run:
+                return form.filtered_parse
+
+            if not form_data:
+                self.log.warning("Most report forms require at least some input, especially for Select form fields.")
+            formatted_form_data = form.get_final_form_data(form_data or dict())
+            submitted_form_data = {k: v for k, v in formatted_form_data.items() if v != ''}
+            page = await self._send('POST', page.url, data=submitted_form_data)
+
+            # ExportUrlBase is relative to the report server that rendered the form
+            report_dl_url = get_report_export_url(page.text, download_format, reports_host=page.url)
+            if report_dl_url and await self._stream_to_file(report_dl_url, file_name, checksum):
+                self.log.info("Fetched the report bytes.")
+                return True
+
+            self.log.info("Failed to download the report.")
+            return False
+
+    async def request_extract(self, lea_code, extract_name, form_data=None, by_date_range=False,
+                              by_as_of_date=False, dry_run=False):
+        """Async counterpart of CALPADSClient.request_extract; the arguments and return values are the same."""
+        if dry_run:
+            cached_schema = self.schema_cache.get('extract', lea_code,
+                                                  extract_schema_name(extract_name, by_date_range, by_as_of_date))
+            if cached_schema is not None:
+                return cached_schema
+        async with self._lea_scope(lea_code):
+            return await self._request_extract(lea_code, extract_name, form_data, by_date_range,
+                                               by_as_of_date, dry_run)
+
+    async def wait_for_extract(self, extract_request, timeout=600, poll=2, max_poll=60):
+        """Async counterpart of CALPADSClient.wait_for_extract"""
+        deadline = time.time() + timeout
+        delays = backoff_delays(poll, max_poll)
+        while True:
+            rows = (await self.get_requested_extracts(extract_request.lea_code)).get('Data') or []
+            row = self._extract_ids.resolve(extract_request, rows)
+            if row is not None and is_extract_complete(row):
+                return row
+            if row is not None and is_extract_failed(row):
+                self.log.info("Extract request {} failed with status {}"
+                              .format(extract_request.request_id, row.get('ExtractStatus')))
+                return None
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                self.log.info("Timed out waiting on {}".format(extract_request))
+                return None
+            await asyncio.sleep(min(next(delays), remaining))
+
+    async def download_extract(self, lea_code, file_name=None, timeout=60, poll=10, return_bytes=False,
+                               checksum=None, extract_request=None, max_poll=60):
+        """Async counterpart of CALPADSClient.download_extract; the arguments and return values are the same,
+        but polling awaits instead of blocking. The chunk size for streaming is set on the client."""
+        check_extract_request_lea(lea_code, extract_request)
+        async with self._lea_scope(lea_code):
+            return await self._download_extract(lea_code, file_name, timeout, poll, return_bytes, checksum,
+                                                extract_request, max_poll)
+
+    async def upload_file(self, lea_code, file_path=None, form_data=None, dry_run=False):
+        """Async counterpart of CALPADSClient.upload_file; the arguments and return values are the same."""
+        if not dry_run:
+            assert file_path and form_data, "File Path and Form Data are required inputs."
+        async with self._lea_scope(lea_code):
+            page = await self._send('GET', urljoin(self.host, '/FileSubmission/FileUpload'))
+            root = etree.fromstring(page.text, etree.HTMLParser(encoding='utf8'))
+            root_form = root.xpath("//div[@id='fileUpload']//form")[0]
+            upload_form = FilesUploadForm(root_form)
+            if dry_run:
+                return upload_form.get_parsed_form_fields()
+            prefilled_form = upload_form.prefilled_fields.copy()
+            prefilled_form.extend(form_data)
+            prefilled_dict = dict(prefilled_form)
+            cleaned_filled_form = {k: v for k, v in prefilled_dict.items() if v != '' and v is not None}
+            with open(file_path, 'rb') as f:
+                multipart = aiohttp.FormData()
+                for key, value in cleaned_filled_form.items():
+                    multipart.add_field(key, str(value))
+                multipart.add_field('FilesUploaded[0].FileName', f)
+                page = await self._send('POST', urljoin(page.url, root_form.attrib['action']), data=multipart)
+                self.log.info("Attempted to upload the file.")
+            response = etree.fromstring(page.text, etree.HTMLParser(encoding='utf8'))
+            return bool(response.xpath('//*[contains(@class, "alert alert-success")]'))
+
+    async def post_file(self, lea_code, ignore_rejections=False, get_errors=False,
+                        submitter_email=None, timeout=180, poll=30):
+        """Async counterpart of CALPADSClient.post_file; the arguments and return values are the same,
+        but polling awaits instead of blocking."""
+        if poll < 10:
+            poll = 10
+        errors = b''
+        loop = asyncio.get_event_loop()
+        async with self._lea_scope(lea_code):
+            start_time = loop.time()
+            while (loop.time() - start_time) < timeout:
+                get_job_status = (await self.get_homepage_submission_status()).get('Data')[-1]
+                if get_job_status['SubmissionStatus'] != 'Ready for Review':
+                    await asyncio.sleep(poll)
+                    continue
+                if get_job_status['Rejected'] != '0':
+                    if get_errors:
+                        errors = await self._get_file_submission_rejections(lea_code,
+                                                                            get_job_status['FileTypeCode'] + 'ERR',
+                                                                            submitter_email, get_job_status['JobID'],
+                                                                            timeout, poll)
+                    if not ignore_rejections:
+                        self.log.info("Unable to post the latest job because some records were rejected")
+                        return False, errors
+                    self.log.info("There were rejections, but ignoring those rejections.")
+                page = await self._send('GET', urljoin(self.host,
+                                                       f"/FileSubmission/Detail/{get_job_status['JobID']}"))
+                if (await self._post_file_post_action(page)).xpath('//*[contains(@class, "alert alert-success")]'):
+                    self.log.info("Successfully posted the file.")
+                    return True, errors
+                else:
+                    self.log.info("Attempted and failed to post the file.")
+                    return False, errors
+            self.log.info("Unable to post the latest job, timed out.")
+            return False, errors
+
+    async def _request_extract(self, lea_code, extract_name, form_data, by_date_range, by_as_of_date, dry_run):
+        extract_name = extract_name.upper()
+        if not form_data:
+            form_data = list()
+        page = await self._send('GET', urljoin(self.host, extract_page_path(extract_name)))
+        root = etree.fromstring(page.text, etree.HTMLParser(encoding='utf8'))
+        chosen_form = choose_extract_form(root, extract_name, by_date_range, by_as_of_date)
+        extracts_form = ExtractsForm(chosen_form)
+        parsed_fields = extracts_form.get_parsed_form_fields()
+        self.schema_cache.put('extract', lea_code, extract_schema_name(extract_name, by_date_range, by_as_of_date),
+                              parsed_fields)
+        if dry_run:
+            return parsed_fields
+
+        filled_fields = fill_extract_form(extracts_form, form_data, lea_code)
+        if extract_name in SUBMISSION_EXTRACTS:
+            check_submitter = [field for field in filled_fields if field[0] == 'Submitter' and field[1] is not None]
+            if not check_submitter:
+                #If no submitter field is provided, default to the current user
+                filled_fields.append(('Submitter', await self._get_submitter_id(lea_code, self.username)))
+            check_jobid = [field for field in filled_fields if field[0] == 'JobID' and field[1] is not None]
+            if not check_jobid:
+                #If no jobid is provided, default to the latest job's job id
+                latest_jobs = (await self.get_homepage_submission_status()).get('Data')
+                filled_fields.append(('JobID', latest_jobs[-1]['JobID']))
+
+        # aiohttp won't encode None, whereas requests drops those fields
+        filled_fields = [(key, value) for key, value in filled_fields if value is not None]
+        prior_ids = frozenset(row.get('ExtractRequestID')
+                              for row in (await self.get_requested_extracts(lea_code)).get('Data') or [])
+        requested_at = time.time()
+        page = await self._send('POST', urljoin(self.host, chosen_form.attrib['action']), data=filled_fields)
+        self.log.info("Attempted to request the extract.")
+        if not is_extract_request_success(page.text):
+            return False
+        extract_request = ExtractRequest(lea_code, extract_name, requested_at, prior_ids)
+        self._extract_ids.resolve(extract_request, (await self.get_requested_extracts(lea_code)).get('Data') or [])
+        return extract_request
+
+    async def _download_extract(self, lea_code, file_name, timeout, poll, return_bytes, checksum=None,
+                                extract_request=None, max_poll=60):
+        if poll < 1:
+            poll = 1
+        if not file_name:
+            file_name = 'data'
+        loop = asyncio.get_event_loop()
+        time_start = loop.time()
+        extract_request_id = None
+        if extract_request is not None:
+            completed = await self.wait_for_extract(extract_request, timeout, poll, max_poll)
+            extract_request_id = completed['ExtractRequestID'] if completed else None
+        while extract_request is None and (loop.time() - time_start) < timeout:
+            result = (await self.get_requested_extracts(lea_code)).get('Data')
+            #Currently only pulling the first result to check against, assuming it's the latest
+            if result[0]['ExtractStatus'] == 'Complete':
+                extract_request_id = result[0]['ExtractRequestID']
+                self.log.info("Found an extract request ID")
+                break
+            #Take a breather without blocking the event loop
+            await asyncio.sleep(poll)
+        if not extract_request_id:
+            self.log.info("Download request timed out. The download might have taken too long.")
+            return False
+        extract_url = urljoin(self.host, f'/Extract/DownloadLink?ExtractRequestID={extract_request_id}')
+        if return_bytes:
+            return (await self._send('GET', extract_url)).content
+        return await self._stream_to_file(extract_url, file_name, checksum)
+
+    async def _get_file_submission_rejections(self, lea_code, record_type, submitter_email,
+                                              job_id, timeout, poll):
+        """Helper for getting the latest file submission's rejected records"""
+        self.log.info("Attempting to fetch the latest submission's rejected records.")
+        if submitter_email:
+            submitter_id = await self._get_submitter_id(lea_code, submitter_email)
+        else:
+            submitter_id = None
+        submitted_fields = [('LEA', lea_code), ('RecordType', record_type),
+                            ('JobID', job_id), ('Submitter', submitter_id),
+                            ('School', 'All')]
+        extract_request = await self._request_extract(lea_code, 'REJECTEDRECORDS', submitted_fields,
+                                                      False, False, False)
+        if extract_request:
+            self.log.info("Successfully requested the rejected records. Attempting download.")
+            return (await self._download_extract(lea_code, None, timeout, poll, True,
+                                                 extract_request=extract_request)
+                    or b'Failed dowloading extract errors')
+        else:
+            self.log.info("Failed to request the rejected records.")
+            return b'Failed requesting extract errors'
+
+    async def _get_submitter_id(self, lea_code, submitter_email):
+        """Tries to return a submitter ID. If it fails, returns the email."""
+        submitter_names = await self.get_submitter_names(lea_code)
+        try:
+            return [submitter['Value'] for submitter in submitter_names
+                    if submitter['Text'] == submitter_email][0]
+        except IndexError:
+            self.log.debug("Could not find the id for the submitter email; will use the email as is.")
+            return submitter_email
+
+    async def _post_file_post_action(self, page):
+        """Helper to officially post a file."""
+        root = etree.fromstring(page.text, etree.HTMLParser(encoding='utf8'))
+        form_root = root.xpath('//form[@action="/FileSubmission/Post"]')[0]
+        inputs = FilesUploadForm(form_root).prefilled_fields + [('command', 'Post All')]
+        input_dict = {k: v for k, v in dict(inputs).items() if v is not None}
+        page = await self._send('POST', urljoin(self.host, '/FileSubmission/Post'), data=input_dict)
+        self.log.info("Attempted to post all for this submission job.")
+        return etree.fromstring(page.text, etree.HTMLParser(encoding='utf8'))
+
+    def _lea_scope(self, lea_code):
+        return _LEAScope(self, lea_code)
+
+    async def _select_lea(self, lea_code):
+        """Async counterpart of CALPADSClient._select_lea. Callers should hold the LEA lock."""
+        if lea_code == self._selected_lea:
+            return
+        for refresh in (self._org_change_form is None, True):
+            if refresh:
+                page = await self._send('GET', self.host)
+                self._org_change_form = parse_org_change_form(page.text)
+            action, org_options, request_token = self._org_change_form
+            try:
+                org_form_val = find_org_value(org_options, lea_code)
+            except IndexError:
+                if refresh:
+                    self.log.info("The provided lea_code, {}, does not appear to exist for you."
+                                  .format(lea_code))
+                    raise Exception("Unable to switch to the provided LEA Code")
+                continue
+            auth_generation = self._auth_generation
+            try:
+                page = await self._send('POST', urljoin(self.host, action),
+                                        data={'selectedItem': org_form_val,
+                                              '__RequestVerificationToken': request_token})
+            except SessionExpired:
+                continue
+            if page.status_code == 200 and auth_generation == self._auth_generation:
+                self._selected_lea = lea_code
+                return
+        self.log.info("Failed to switch to the provided lea_code, {}.".format(lea_code))
+        raise Exception("Unable to switch to the provided LEA Code")
+
+    async def list_reports(self, is_snapshot=None, refresh=False):
+        """Async counterpart of CALPADSClient.list_reports"""
+        if refresh or self.report_catalog.is_stale:
+            await self._refresh_report_catalog()
+        return self.report_catalog.entries(is_snapshot)
+
+    async def _refresh_report_catalog(self):
+        ods_page, snapshot_page = await asyncio.gather(self._send('GET', urljoin(self.host, ODS_LISTING_PATH)),
+                                                       self._send('GET', urljoin(self.host, SNAPSHOT_LISTING_PATH)))
+        self.report_catalog.load_listings(ods_page.text, snapshot_page.text, self.host)
+
+    async def _get_report_link(self, report_code, is_snapshot=False):
+        """Return the URL associated with the report_code, using the report catalog"""
+        refreshed = self.report_catalog.is_stale
+        if refreshed:
+            await self._refresh_report_catalog()
+        report = self.report_catalog.get(report_code, is_snapshot)
+        if report is None and not refreshed:
+            await self._refresh_report_catalog()
+            report = self.report_catalog.get(report_code, is_snapshot)
+        if report is None:
+            self.log.info("Failed to find the provided report code.")
+            return None
+        return report.url
+
+
+class _LEAScope:
+    """Async context manager holding the client's LEA lock while working within lea_code"""
+
+    def __init__(self, client, lea_code):
+        self.client = client
+        self.lea_code = lea_code
+
+    async def __aenter__(self):
+        await self.client.open()
+        await self.client._lea_lock.acquire()
+        try:
+            await self.client._select_lea(self.lea_code)
+        except BaseException:
+            self.client._lea_lock.release()
+            raise
+        return self.client
+
+    async def __aexit__(self, *exc):
+        self.client._lea_lock.release()
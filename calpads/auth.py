@@ -0,0 +1,110 @@
+"""The CALPADS login dance as a bounded, iterative state machine
+
+Logging in walks /Account/Login (post the credentials), then /connect/authorize/callback (post the
+OpenID interstitial form), after which CALPADS redirects back to the page that was originally asked for.
+LoginFlow only decides what to send next given the page just received, so the sync and async clients
+drive the same logic with their own HTTP libraries. It gives up with an AuthenticationError after a
+handful of steps or as soon as the login page comes back after the credentials were posted, rather than
+looping until the recursion limit.
+"""
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit, urljoin
+from lxml import etree
+from .exceptions import AuthenticationError
+
+# Pages that are part of the login dance rather than what was asked for
+LOGIN_PATHS = ('/Account/Login', '/connect/authorize/callback', '/connect/authorize')
+
+# A normal login takes two steps; more than this means CALPADS is sending us in circles
+MAX_LOGIN_STEPS = 6
+
+LoginStep = namedtuple('LoginStep', ['state', 'method', 'url', 'data'])
+LoginStep.__doc__ = """The next request of the login dance. state is 'credentials' or 'openid'."""
+
+StepTiming = namedtuple('StepTiming', ['state', 'url', 'status_code', 'seconds'])
+
+
+def is_login_page(url, status_code=200):
+    return status_code == 200 and urlsplit(url).path in LOGIN_PATHS
+
+
+class LoginFlow:
+
+    def __init__(self, credentials, host, max_steps=MAX_LOGIN_STEPS):
+        """Decides each request of one login dance and records how long each took
+
+        Args:
+            credentials (dict): the Username and Password form fields
+            host (str): used to resolve relative form actions
+            max_steps (int, optional): the most requests to make before raising AuthenticationError
+        """
+        self.credentials = credentials
+        self.host = host
+        self.max_steps = max_steps
+        self.timings = []
+        self.credentials_posted = False
+        self._started = time.perf_counter()
+        self._pending = None
+
+    def next_step(self, url, status_code, text):
+        """Returns the LoginStep to send after receiving this page, or None once the dance is over
+
+        Raises:
+            AuthenticationError: when the credentials were rejected, a login page couldn't be parsed, or the dance
+                didn't finish within max_steps requests
+        """
+        if not is_login_page(url, status_code):
+            return None
+        if len(self.timings) >= self.max_steps:
+            raise AuthenticationError("Unable to log in to CALPADS within {} steps".format(self.max_steps))
+        path = urlsplit(url).path
+        try:
+            if path == '/Account/Login':
+                if self.credentials_posted:
+                    raise AuthenticationError("CALPADS rejected the credentials. Confirm the username and password.")
+                self.credentials_posted = True
+                return self._start(LoginStep('credentials', 'POST', url, login_form_data(text, self.credentials)))
+            action_url, form_data = openid_form(text, self.host)
+            return self._start(LoginStep('openid', 'POST', action_url, form_data))
+        except (IndexError, KeyError, ValueError, etree.ParserError) as e:
+            raise AuthenticationError("Unable to parse the login page at {}: {!r}".format(path, e))
+
+    def record(self, url, status_code):
+        """Record how long the step started by the last next_step() took, now that its response arrived"""
+        state, started = self._pending
+        self.timings.append(StepTiming(state, url, status_code, time.perf_counter() - started))
+
+    @property
+    def steps(self):
+        return len(self.timings)
+
+    @property
+    def total_seconds(self):
+        return sum(timing.seconds for timing in self.timings)
+
+    def _start(self, step):
+        self._pending = (step.state, time.perf_counter())
+        return step
+
+
+def login_form_data(page_text, credentials):
+    """The form data to post to /Account/Login: the credentials plus the page's token and ReturnUrl"""
+    root = etree.fromstring(page_text, parser=etree.HTMLParser(encoding='utf8'))
+    form_data = dict(credentials)
+    form_data['__RequestVerificationToken'] = root.xpath("//input[@name='__RequestVerificationToken']")[0].get('value')
+    form_data['ReturnUrl'] = root.xpath("//input[@id='ReturnUrl']")[0].get('value')
+    form_data['AgreementConfirmed'] = "True"
+    return form_data
+
+
+def openid_form(page_text, host):
+    """The action URL and form data of the OpenID interstitial page"""
+    root = etree.fromstring(page_text, parser=etree.HTMLParser(encoding='utf8'))
+    form_data = {input_.attrib.get('name'): input_.attrib.get("value")
+                 for input_ in root.xpath('//input') if input_.attrib.get('name')}
+    action_url = root.xpath('//form')[0].attrib.get('action')
+    scheme, netloc, path, query, frag = urlsplit(action_url)
+    if not scheme and not netloc:
+        action_url = urljoin(host, action_url)
+    return action_url, form_data
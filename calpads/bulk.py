@@ -0,0 +1,148 @@
+"""Bulk fetching of the per-SSID and per-SEID history endpoints
+
+The `get_*_history` methods on the CALPADSClient each issue a single blocking request. When
+pulling thousands of students, the time spent is almost entirely round-trip latency, so this module
+spreads the work over a bounded pool of worker threads, each with its own authenticated client.
+Results are streamed back as they complete and failures are reported per item instead of
+aborting the whole batch.
+"""
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .exceptions import CALPADSError
+
+# Short endpoint names mapped to the CALPADSClient method that fetches them
+STUDENT_HISTORY_ENDPOINTS = {'enrollment': 'get_enrollment_history',
+                             'demographics': 'get_demographics_history',
+                             'address': 'get_address_history',
+                             'elas': 'get_elas_history',
+                             'program': 'get_program_history',
+                             'course_section': 'get_student_course_section_history',
+                             'cte': 'get_cte_history',
+                             'stas': 'get_stas_history',
+                             'sirs': 'get_sirs_history',
+                             'soff': 'get_soff_history',
+                             'assessment': 'get_assessment_history',
+                             'sped': 'get_sped_history',
+                             'ssrv': 'get_ssrv_history',
+                             'psts': 'get_psts_history'}
+
+STAFF_HISTORY_ENDPOINTS = {'staff_demographics': 'get_staff_demographics_history',
+                           'staff_assignments': 'get_staff_assignments_history',
+                           'staff_courses': 'get_staff_courses_history'}
+
+HISTORY_ENDPOINTS = dict(STUDENT_HISTORY_ENDPOINTS, **STAFF_HISTORY_ENDPOINTS)
+
+BulkResult = namedtuple('BulkResult', ['identifier', 'endpoint', 'data', 'error'])
+BulkResult.__doc__ = """The outcome of one identifier/endpoint lookup. Exactly one of data or error is not None."""
+
+
+class HistoryLookupFailed(CALPADSError):
+    """A history endpoint answered without a Data list, e.g. with an error or login page instead of JSON"""
+
+
+class BulkHistoryFetcher:
+
+    def __init__(self, client_factory, max_workers=8, max_pending=None):
+        """Fetch many history endpoints for many SSIDs/SEIDs concurrently
+
+        Args:
+            client_factory (callable): a zero-argument callable returning a new, authenticated CALPADSClient.
+                It is called at most once per worker thread so every worker owns its own session.
+                e.g. lambda: CALPADSClient(username, password)
+            max_workers (int): the number of worker threads, and so the number of concurrent sessions.
+            max_pending (int, optional): the most lookups allowed to be queued or in flight at once. Keeps memory
+                bounded when the input iterable is large. Defaults to 4 times max_workers.
+        """
+        self.client_factory = client_factory
+        self.max_workers = max_workers
+        self.max_pending = max_pending or max_workers * 4
+        self._local = threading.local()
+        self._clients = []
+        self._clients_lock = threading.Lock()
+        self.log = logging.getLogger(__name__)
+
+    def fetch(self, identifiers, endpoints=None):
+        """Yield a BulkResult for every (identifier, endpoint) pair as soon as it completes
+
+        Args:
+            identifiers (iterable): SSIDs and/or SEIDs. It is consumed lazily, so generators are fine.
+            endpoints (iterable of str, optional): names from HISTORY_ENDPOINTS, e.g. ['enrollment', 'sped'].
+                Defaults to all of the student endpoints.
+
+        Returns:
+            a generator of BulkResult namedtuples, in completion order rather than input order
+        """
+        if endpoints is None:
+            endpoints = tuple(STUDENT_HISTORY_ENDPOINTS.keys())
+        else:
+            endpoints = tuple(endpoints)
+        unknown = [endpoint for endpoint in endpoints if endpoint not in HISTORY_ENDPOINTS]
+        if unknown:
+            raise ValueError("Unknown history endpoint(s): {}. Try: {}"
+                             .format(', '.join(unknown), ' '.join(HISTORY_ENDPOINTS.keys())))
+
+        # Not itertools.product, which reads every identifier into memory before yielding the first pair
+        work = ((identifier, endpoint) for identifier in identifiers for endpoint in endpoints)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {}
+            for identifier, endpoint in work:
+                if len(pending) >= self.max_pending:
+                    yield from self._drain(pending, FIRST_COMPLETED)
+                future = executor.submit(self._fetch_one, identifier, endpoint)
+                pending[future] = (identifier, endpoint)
+            while pending:
+                yield from self._drain(pending, FIRST_COMPLETED)
+
+    def fetch_all(self, identifiers, endpoints=None):
+        """Convenience wrapper around fetch() returning {identifier: {endpoint: data}} and a list of failures"""
+        results = dict()
+        failures = []
+        for result in self.fetch(identifiers, endpoints):
+            if result.error is not None:
+                failures.append(result)
+            else:
+                results.setdefault(result.identifier, dict())[result.endpoint] = result.data
+        return results, failures
+
+    def close(self):
+        """Close every session opened by the workers"""
+        with self._clients_lock:
+            for client in self._clients:
+                client.session.close()
+            self._clients = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _drain(self, pending, return_when):
+        done, _ = wait(pending, return_when=return_when)
+        for future in done:
+            identifier, endpoint = pending.pop(future)
+            try:
+                yield BulkResult(identifier, endpoint, future.result(), None)
+            except Exception as e:
+                self.log.info("Failed fetching {} for {}: {}".format(endpoint, identifier, e))
+                yield BulkResult(identifier, endpoint, None, e)
+
+    def _worker_client(self):
+        """Returns the calling thread's client, creating it on first use"""
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self.client_factory()
+            self._local.client = client
+            with self._clients_lock:
+                self._clients.append(client)
+        return client
+
+    def _fetch_one(self, identifier, endpoint):
+        data = getattr(self._worker_client(), HISTORY_ENDPOINTS[endpoint])(identifier)
+        # The getters return {} for any response that isn't JSON, which must not pass for an empty history
+        if not isinstance(data, dict) or 'Data' not in data:
+            raise HistoryLookupFailed("The {} history of {} didn't come back as JSON with a Data list"
+                                      .format(endpoint, identifier))
+        return data
@@ -0,0 +1,139 @@
+"""TTL cache for the near-static reference JSON endpoints
+
+The LEA list, school listings, submitter names, and user orgs rarely change, yet they are looked up
+constantly, e.g. _get_submitter_id() fetches the submitter names for every rejected-records download.
+ResponseCache keeps their parsed JSON in an in-memory LRU with a TTL per endpoint, optionally backed
+by a JSON file shared between runs. Concurrent lookups of the same key share a single request.
+"""
+import copy
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds each endpoint's data is reused for
+DEFAULT_TTLS = {'leas': 12 * 60 * 60,
+                'schools': 12 * 60 * 60,
+                'submitter_names': 60 * 60,
+                'user_orgs': 60 * 60}
+
+# Bump when the cached data changes shape so stale disk caches are ignored
+CACHE_VERSION = 1
+
+
+class _Flight:
+    """A lookup in progress that other threads asking for the same key wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+
+    def __init__(self, ttls=None, max_entries=1024, path=None):
+        """In-memory LRU of parsed JSON responses, optionally persisted to a JSON file
+
+        Args:
+            ttls (dict, optional): {endpoint: seconds}, merged over DEFAULT_TTLS. A TTL of 0 disables caching for the
+                endpoint.
+            max_entries (int, optional): the most entries kept in memory. The least recently used are evicted first.
+            path (str, optional): a JSON file used to persist entries between runs
+        """
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or dict()))
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._flights = dict()
+        self._lock = threading.Lock()
+        self.log = logging.getLogger(__name__)
+        if path:
+            self._load_from_disk()
+
+    def get_or_fetch(self, endpoint, key, fetch):
+        """Returns the cached data for (endpoint, key), calling fetch() on a miss
+
+        Empty and None results aren't cached, since they usually mean the request failed.
+
+        Args:
+            endpoint (str): a name from DEFAULT_TTLS, which picks the TTL
+            key (tuple of str): the rest of the cache key, e.g. (username, lea_code)
+            fetch (callable): takes no arguments and returns the JSON data to cache
+
+        Returns:
+            a copy of the cached data, so callers are free to modify it
+        """
+        ttl = self.ttls.get(endpoint, 0)
+        if not ttl:
+            return fetch()
+        cache_key = '|'.join((endpoint,) + tuple(str(part) for part in key))
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and time.time() - entry['cached_at'] <= ttl:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return copy.deepcopy(entry['data'])
+            self.misses += 1
+            flight = self._flights.get(cache_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[cache_key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.value)
+        try:
+            flight.value = fetch()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[cache_key]
+                if flight.error is None and flight.value:
+                    self._store(cache_key, flight.value)
+            flight.done.set()
+        return copy.deepcopy(flight.value)
+
+    def invalidate(self, endpoint=None, key=None):
+        """Drop the entries for endpoint (and key, when given). With no arguments, drops everything."""
+        prefix = '' if endpoint is None else '|'.join((endpoint,) + tuple(str(part) for part in key or ()))
+        with self._lock:
+            for cache_key in list(self._entries):
+                if not prefix or cache_key == prefix or cache_key.startswith(prefix + '|'):
+                    del self._entries[cache_key]
+            if self.path:
+                self._save_to_disk()
+
+    def _store(self, cache_key, data):
+        """Needs the lock"""
+        self._entries[cache_key] = {'cached_at': time.time(), 'data': data}
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        if self.path:
+            self._save_to_disk()
+
+    def _save_to_disk(self):
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump({'version': CACHE_VERSION, 'entries': list(self._entries.items())}, f)
+        os.replace(tmp_path, self.path)
+
+    def _load_from_disk(self):
+        try:
+            with open(self.path, 'r', encoding='utf8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            self.log.debug("No usable response cache at {}".format(self.path))
+            return
+        if cached.get('version') != CACHE_VERSION:
+            self.log.info("Ignoring a response cache written by a different version")
+            return
+        self._entries = OrderedDict((key, entry) for key, entry in cached.get('entries', []))
@@ -0,0 +1,446 @@
+"""Record every CALPADS request and response to a cassette file, and replay them without CALPADS
+
+RecordingTransport and ReplayTransport are transport adapters for CALPADSClient's transport argument:
+
+    with RecordingTransport('enrollment.cassette') as transport:
+        client = CALPADSClient(username, password, transport=transport)
+        client.download_extract(...)
+
+    client = CALPADSClient(username, password, transport=ReplayTransport('enrollment.cassette'))
+
+A cassette is one file: a header, then an entry per response (its metadata as JSON followed by the
+zlib-compressed body), then an index of {request key: [entry offsets]} and a fixed-size trailer pointing
+at the index. Replaying loads only the index, looks each request up by its key in O(1), and streams the
+body of the matching entry straight from disk. A cassette whose recording was cut short, and so has no
+index, is indexed by scanning its entries instead.
+
+Request keys are built by request_key() from the method, the URL with its query sorted, and a digest of
+the form data without the fields that differ between sessions (anti-forgery tokens, view state, OpenID
+codes, and the credentials), so a replay with a fresh session finds what the recording saw. Requests
+themselves are only stored as their key. Responses are stored without cookies, and the secrets on the
+login pages are scrubbed from their bodies.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import zlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import requests
+from lxml import etree
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from .auth import LOGIN_PATHS
+from .exceptions import CALPADSError
+
+MAGIC = b'CALPADS\x01'
+TRAILER_MAGIC = b'CIDX'
+# (meta length, compressed body length)
+ENTRY_HEADER = struct.Struct('>IQ')
+# (index offset, index length, magic)
+TRAILER = struct.Struct('>QI4s')
+
+# Form fields that change from one session to the next, or hold credentials. They are left out of request keys.
+VOLATILE_FIELDS = frozenset(('__RequestVerificationToken', '__VIEWSTATE', '__VIEWSTATEGENERATOR', '__EVENTVALIDATION',
+                             'code', 'id_token', 'access_token', 'scope', 'state', 'session_state',
+                             'Username', 'Password'))
+
+# Hidden inputs on the login pages whose values are secrets
+SECRET_FIELDS = ('code', 'id_token', 'access_token', 'state', 'session_state', 'Password')
+
+# Response headers worth replaying. Everything else, including Set-Cookie, is dropped.
+KEPT_HEADERS = ('Content-Type', 'Content-Disposition', 'Location', 'Retry-After')
+
+_COPY_CHUNK_SIZE = 64 * 1024
+# Bodies bigger than this are spooled to a temporary file while recording
+_SPOOL_SIZE = 8 * 1024 * 1024
+_BOUNDARY = re.compile(r'boundary="?([^";]+)"?')
+_PART_NAME = re.compile(rb'name="([^"]*)"')
+
+
+class CassetteMiss(CALPADSError):
+    """A replayed request wasn't recorded in the cassette"""
+
+
+def request_key(method, url, body=None, content_type=None):
+    """The normalized key a request is recorded and looked up under
+
+    Args:
+        method (str): the HTTP method
+        url (str): the full URL
+        body (bytes or str, optional): the request body
+        content_type (str, optional): the request's Content-Type header, used to parse form and multipart bodies
+
+    Returns:
+        str: e.g. 'POST https://www.calpads.org/Extract/ODSExtract 3f2a...', where the last part is a digest of the
+            body without its VOLATILE_FIELDS
+    """
+    scheme, netloc, path, query, frag = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+    key = '{} {}'.format(method.upper(), urlunsplit((scheme, netloc.lower(), path, query, '')))
+    if not body:
+        return key
+    if isinstance(body, str):
+        body = body.encode('utf8')
+    content_type = content_type or ''
+    if content_type.startswith('application/x-www-form-urlencoded'):
+        fields = [(name, value) for name, value in parse_qsl(body.decode('utf8'), keep_blank_values=True)
+                  if name not in VOLATILE_FIELDS]
+        normalized = urlencode(sorted(fields)).encode('utf8')
+    elif content_type.startswith('multipart/form-data') and _BOUNDARY.search(content_type):
+        normalized = _normalize_multipart(body, _BOUNDARY.search(content_type).group(1).encode('utf8'))
+    else:
+        normalized = body
+    return '{} {}'.format(key, hashlib.sha256(normalized).hexdigest()[:16])
+
+
+def _normalize_multipart(body, boundary):
+    """The parts of a multipart body in order, without the random boundary and without any VOLATILE_FIELDS"""
+    kept = []
+    for part in body.split(b'--' + boundary):
+        headers, _, content = part.partition(b'\r\n\r\n')
+        name = _PART_NAME.search(headers)
+        if name is not None and name.group(1).decode('utf8', 'replace') in VOLATILE_FIELDS:
+            continue
+        kept.append(headers.strip() + b'\n' + content.rstrip(b'\r\n'))
+    return b'\0'.join(kept)
+
+
+def scrub_login_page(text):
+    """Blank the values of the SECRET_FIELDS inputs on a login page, e.g. the OpenID code and id_token"""
+    if not text.strip():
+        return text
+    root = etree.fromstring(text, parser=etree.HTMLParser(encoding='utf8'))
+    if root is None:
+        return text
+    for input_ in root.xpath('//input[@name]'):
+        if input_.attrib['name'] in SECRET_FIELDS and input_.attrib.get('value'):
+            input_.attrib['value'] = 'REDACTED'
+    return etree.tostring(root, method='html', encoding='utf8')
+
+
+class Cassette:
+
+    def __init__(self, path, record=False):
+        """An indexed file of recorded responses. Thread-safe.
+
+        Args:
+            path (str): the cassette file
+            record (bool, optional): open it for appending, creating it if needed. Otherwise it is opened read-only
+                and must exist.
+        """
+        self.path = path
+        self.record = record
+        # {request key: [entry offsets]}, in recording order
+        self.index = dict()
+        self._cursors = dict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.log = logging.getLogger(__name__)
+        if record and not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(MAGIC)
+        with open(path, 'rb') as f:
+            self._data_end = self._load_index(f)
+        self._file = None
+        if record:
+            self._file = open(path, 'r+b')
+            # New entries overwrite the old index, which is written again on flush()
+            self._file.truncate(self._data_end)
+            self._dirty = True
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(offsets) for offsets in self.index.values())
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def append(self, key, meta, body):
+        """Write an entry for the response to the request with key
+
+        Args:
+            key (str): from request_key()
+            meta (dict): JSON-serializable response metadata, e.g. the status code and headers
+            body (file-like): the response body, read from its current position to the end
+        """
+        # Compress outside of the lock so concurrent downloads aren't serialized
+        with tempfile.TemporaryFile() as compressed:
+            compressor = zlib.compressobj()
+            for chunk in iter(lambda: body.read(_COPY_CHUNK_SIZE), b''):
+                compressed.write(compressor.compress(chunk))
+            compressed.write(compressor.flush())
+            body_length = compressed.tell()
+            compressed.seek(0)
+            meta_bytes = json.dumps(dict(meta, key=key), separators=(',', ':')).encode('utf8')
+            with self._lock:
+                offset = self._data_end
+                self._file.seek(offset)
+                self._file.write(ENTRY_HEADER.pack(len(meta_bytes), body_length))
+                self._file.write(meta_bytes)
+                shutil.copyfileobj(compressed, self._file, _COPY_CHUNK_SIZE)
+                self._data_end = self._file.tell()
+                self.index.setdefault(key, []).append(offset)
+                self._dirty = True
+
+    def next_entry(self, key):
+        """Returns the (meta, body offset, body length) of the next recorded response for key
+
+        Responses recorded for the same key are served in the order they were recorded, and the last one is repeated
+        once they run out, e.g. for polling the extract listing.
+
+        Raises:
+            CassetteMiss: when nothing was recorded for key
+        """
+        with self._lock:
+            offsets = self.index.get(key)
+            if not offsets:
+                raise CassetteMiss("No recorded response for {}".format(key))
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+        with open(self.path, 'rb') as f:
+            return self._read_entry(f, offsets[min(cursor, len(offsets) - 1)])
+
+    def open_body(self, offset, length):
+        """A file-like object that decompresses the body stored at offset as it is read"""
+        return _InflatingReader(self.path, offset, length)
+
+    def rewind(self):
+        """Serve every key's responses from the first one again"""
+        with self._lock:
+            self._cursors = dict()
+
+    def flush(self):
+        """Write the index and trailer after the entries, so the cassette can be opened without a scan"""
+        with self._lock:
+            if self._file is None or not self._dirty:
+                return
+            index = zlib.compress(json.dumps(self.index, separators=(',', ':')).encode('utf8'))
+            self._file.seek(self._data_end)
+            self._file.write(index)
+            self._file.write(TRAILER.pack(self._data_end, len(index), TRAILER_MAGIC))
+            self._file.truncate()
+            self._file.flush()
+            self._dirty = False
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _load_index(self, f):
+        """Loads the index, scanning the entries when there isn't one. Returns the offset the entries end at."""
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a cassette".format(self.path))
+        size = f.seek(0, os.SEEK_END)
+        if size >= len(MAGIC) + TRAILER.size:
+            f.seek(size - TRAILER.size)
+            index_offset, index_length, magic = TRAILER.unpack(f.read(TRAILER.size))
+            if magic == TRAILER_MAGIC and index_offset + index_length + TRAILER.size == size:
+                f.seek(index_offset)
+                self.index = json.loads(zlib.decompress(f.read(index_length)))
+                return index_offset
+        self.log.info("{} has no index; scanning its entries".format(self.path))
+        offset = len(MAGIC)
+        while offset + ENTRY_HEADER.size <= size:
+            try:
+                meta, body_offset, body_length = self._read_entry(f, offset)
+            except (ValueError, struct.error):
+                break
+            if body_offset + body_length > size:
+                break
+            self.index.setdefault(meta['key'], []).append(offset)
+            offset = body_offset + body_length
+        self._dirty = True
+        return offset
+
+    @staticmethod
+    def _read_entry(f, offset):
+        f.seek(offset)
+        meta_length, body_length = ENTRY_HEADER.unpack(f.read(ENTRY_HEADER.size))
+        meta = json.loads(f.read(meta_length))
+        return meta, offset + ENTRY_HEADER.size + meta_length, body_length
+
+
+class _InflatingReader(io.RawIOBase):
+    """Reads and decompresses one entry's body from the cassette file"""
+
+    def __init__(self, path, offset, length):
+        super().__init__()
+        self._file = open(path, 'rb')
+        self._file.seek(offset)
+        self._remaining = length
+        self._decompressor = zlib.decompressobj()
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while (size is None or size < 0 or len(self._buffer) < size) and not self._decompressor.eof:
+            chunk = self._file.read(min(_COPY_CHUNK_SIZE, self._remaining))
+            self._remaining -= len(chunk)
+            self._buffer += self._decompressor.decompress(chunk) if chunk else self._decompressor.flush()
+            if not chunk:
+                break
+        if size is None or size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+class _RecordedBody(io.RawIOBase):
+    """The body of a recorded response, handed to the caller in place of the consumed connection
+
+    Keeps the original urllib3 response around so requests still picks up its cookies.
+    """
+
+    def __init__(self, spool, original_raw):
+        super().__init__()
+        self._spool = spool
+        self._original_response = getattr(original_raw, '_original_response', None)
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._spool.read(size)
+
+    def readinto(self, b):
+        data = self._spool.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._spool.close()
+        super().close()
+
+
+class RecordingTransport(BaseAdapter):
+
+    def __init__(self, cassette, transport=None):
+        """A transport adapter that sends requests through another transport and records the responses
+
+        Args:
+            cassette (str or Cassette): the cassette file, or a Cassette opened with record=True. New recordings are
+                appended to an existing file.
+            transport (requests.adapters.BaseAdapter, optional): what actually sends the requests. Defaults to a new
+                CALPADSTransport.
+        """
+        super().__init__()
+        if transport is None:
+            from .transport import CALPADSTransport
+            transport = CALPADSTransport()
+        self.cassette = cassette if isinstance(cassette, Cassette) else Cassette(cassette, record=True)
+        self.transport = transport
+        self.log = logging.getLogger(__name__)
+
+    def send(self, request, stream=False, **kwargs):
+        response = self.transport.send(request, stream=stream, **kwargs)
+        key = request_key(request.method, request.url, request.body, request.headers.get('Content-Type'))
+        spool = tempfile.SpooledTemporaryFile(max_size=_SPOOL_SIZE)
+        # Always read the body here, decoding any gzip, so it can be recorded; the caller reads it from the spool
+        for chunk in (response.iter_content(_COPY_CHUNK_SIZE) if stream else (response.content,)):
+            spool.write(chunk)
+        if urlsplit(response.url).path in LOGIN_PATHS:
+            spool.seek(0)
+            scrubbed = scrub_login_page(spool.read()) if response.status_code == 200 else b''
+            spool.seek(0)
+            spool.truncate()
+            spool.write(scrubbed)
+        length = spool.tell()
+        spool.seek(0)
+        self.cassette.append(key, {'status_code': response.status_code, 'reason': response.reason,
+                                   'url': response.url, 'length': length,
+                                   'headers': _kept_headers(response.headers)}, spool)
+        self.log.debug("Recorded {}".format(key))
+        spool.seek(0)
+        recorded = requests.Response()
+        recorded.status_code = response.status_code
+        recorded.reason = response.reason
+        recorded.headers = response.headers
+        recorded.headers.pop('Content-Encoding', None)
+        recorded.headers['Content-Length'] = str(length)
+        recorded.url = response.url
+        recorded.encoding = response.encoding
+        recorded.cookies = response.cookies
+        recorded.request = request
+        recorded.connection = self
+        recorded.raw = _RecordedBody(spool, response.raw)
+        return recorded
+
+    def close(self):
+        """Write the cassette's index. Sessions close their adapters often, so the cassette is left open."""
+        self.cassette.flush()
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cassette.close()
+        self.transport.close()
+
+
+class ReplayTransport(BaseAdapter):
+
+    def __init__(self, cassette, fallback=None):
+        """A transport adapter that answers requests from a cassette instead of CALPADS
+
+        Args:
+            cassette (str or Cassette): the cassette file, or an open Cassette
+            fallback (requests.adapters.BaseAdapter, optional): sends the requests that weren't recorded, e.g. a
+                RecordingTransport to fill in the gaps. Defaults to raising CassetteMiss.
+        """
+        super().__init__()
+        self.cassette = cassette if isinstance(cassette, Cassette) else Cassette(cassette)
+        self.fallback = fallback
+        self.log = logging.getLogger(__name__)
+
+    def send(self, request, **kwargs):
+        key = request_key(request.method, request.url, request.body, request.headers.get('Content-Type'))
+        try:
+            meta, body_offset, body_length = self.cassette.next_entry(key)
+        except CassetteMiss:
+            if self.fallback is None:
+                raise
+            self.log.info("Sending {}, which wasn't recorded".format(key))
+            return self.fallback.send(request, **kwargs)
+        response = requests.Response()
+        response.status_code = meta['status_code']
+        response.reason = meta['reason']
+        response.headers = CaseInsensitiveDict(meta['headers'])
+        response.headers['Content-Length'] = str(meta['length'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.raw = self.cassette.open_body(body_offset, body_length)
+        return response
+
+    def close(self):
+        if self.fallback is not None:
+            self.fallback.close()
+
+
+def _kept_headers(headers):
+    return {name: headers[name] for name in KEPT_HEADERS if name in headers}
@@ -2,6 +2,7 @@ import requests
 import logging
 import json
 import re
+import threading
 import time
 from urllib.parse import urlencode, urlsplit, urlunsplit, parse_qsl, urljoin
 from collections import deque
@@ -10,12 +11,52 @@ from lxml import etree
 from .reports_form import ReportsForm, REPORTS_DL_FORMAT
 from .extracts_form import ExtractsForm
 from .files_upload_form import FilesUploadForm
+from .bulk import BulkHistoryFetcher
+from .downloads import stream_response, DEFAULT_CHUNK_SIZE
+from .reports_catalog import ReportCatalog, ODS_LISTING_PATH, SNAPSHOT_LISTING_PATH
+from .exceptions import ReportNotFound, SessionExpired, AuthenticationError
+from .auth import LoginFlow, LOGIN_PATHS
+from .transport import CALPADSTransport, IDEMPOTENT_METHODS
+from .cache import ResponseCache
+from .metrics import default_registry
+from .form_schema_cache import FormSchemaCache, validate_extract_form_data, validate_report_form_data
+from .extract_requests import (ExtractRequest, ExtractIdRegistry, is_extract_complete, is_extract_failed,
+                               backoff_delays, sleep_until_next_poll)
+from .extract_batch import iter_extract_downloads, default_extract_file_name, ExtractFailed
+from .extract_parser import iter_extract_records
+from .session_store import session_key, dump_cookies, load_cookies
+
+DEFAULT_HOST = "https://www.calpads.org/"
 
 
 class CALPADSClient:
 
-    def __init__(self, username, password):
-        self.host = "https://www.calpads.org/"
+    def __init__(self, username, password, report_catalog=None, schema_cache=None, session_store=None,
+                 transport=None, response_cache=None, metrics=None, host=DEFAULT_HOST):
+        """
+        Args:
+            username (str): CALPADS username
+            password (str): CALPADS password
+            report_catalog (ReportCatalog, optional): the index used to look up report URLs. Pass one with a
+                cache_path to share it between runs. Defaults to an in-memory catalog with a 12 hour TTL.
+            schema_cache (FormSchemaCache, optional): where parsed extract and report form schemas are cached for
+                dry runs and validation. Pass one with a path to share it between runs. Defaults to an in-memory cache.
+            session_store (SessionStore, optional): where the authenticated session's cookies are saved and reused
+                from, e.g. a FileSessionStore to skip the login dance in new processes while the session is valid.
+                Defaults to None, logging in from scratch.
+            transport (CALPADSTransport, optional): the adapter every request goes through for rate limiting,
+                retries, and timeouts. Pass the same one to several clients to share its limits and connections, and
+                call its shutdown() once they're done. Defaults to a new CALPADSTransport with the default limits.
+            response_cache (ResponseCache, optional): where the LEA, school, submitter, and user org lookups are
+                cached. Pass one with a path to share it between runs. Defaults to an in-memory cache with the
+                DEFAULT_TTLS.
+            metrics (MetricsRegistry, optional): where the latency, status, and size of every request and the step
+                timings of multi-step operations are recorded. Defaults to calpads.metrics.default_registry.
+            host (str, optional): the root URL of the CALPADS site, e.g. a local stand-in server for offline testing and
+                benchmarks. Defaults to https://www.calpads.org/.
+        """
+        # urljoin() and the post-login URL check expect the trailing slash
+        self.host = host.rstrip('/') + '/'
         self.username = username
         self.password = password
         self.credentials = {'Username': self.username,
@@ -25,37 +66,197 @@ class CALPADSClient:
         self.session.headers.update({'User-Agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 \
         (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36"})
         self.session.hooks['response'].append(self._handle_event_hooks)
+        self.transport = transport or CALPADSTransport()
+        self.metrics = metrics or default_registry
+        self.session.hooks['response'].append(self.metrics.response_hook)
+        self.session.mount('https://', self.transport)
+        self.session.mount('http://', self.transport)
+        # The selected LEA is server-side session state; track it to skip redundant switches
+        self._selected_lea = None
+        self._org_change_form = None
+        self._auth_generation = 0
+        # DownloadStats for the most recent streamed download
+        self.last_download = None
+        self.report_catalog = report_catalog or ReportCatalog()
+        self.schema_cache = schema_cache or FormSchemaCache()
+        self.response_cache = response_cache or ResponseCache()
+        # ExtractRequestIDs already matched to an ExtractRequest handle
+        self._extract_ids = ExtractIdRegistry()
+        self.session_store = session_store
+        # The LoginFlow of the most recent login, with its step timings
+        self.last_login = None
 
         self.log = logging.getLogger(__name__)
         log_fmt = f'%(levelname)s: %(asctime)s {self.__class__.__name__}.%(funcName)s: %(message)s'
         logging.basicConfig(format=log_fmt, level=logging.INFO) # Use level=logging.INFO or level=logging.DEBUG
 
-        try:
-            self.__connection_status = self._login()
-        except RecursionError:
-            self.log.info("Looks like the provided credentials might be incorrect. Confirm credentials.")
+        # Logging in is deferred to the first request; see _ensure_logged_in
+        self.__connection_status = None
+        self._login_lock = threading.Lock()
 
     def _login(self):
-        """Login method which generally doesn't need to be called except when initializing the client."""
+        """Login method which generally doesn't need to be called except when initializing the client.
+
+        Raises:
+            AuthenticationError: when CALPADS rejects the credentials or the login doesn't complete
+        """
         #Dance the OAuth Dance
-        self.session.get(self.host)
-        # self.log.debug(homepage_response.url)
-        # self.log.debug(self.session.cookies)
-        # self.log.debug(self.session.get(self.host + 'Leas?format=JSON').content) # Easy check if logging in happened
-        return self.visit_history[-1].status_code == 200 and self.visit_history[-1].url == self.host
+        response = self._complete_login(self.session.get(self.host))
+        return response.status_code == 200 and response.url == self.host
+
+    def _complete_login(self, response):
+        """Walk the login dance if response is a login page, returning the page CALPADS finally redirects to
+
+        Each step is a plain request made here rather than from the response hook, and LoginFlow bounds the number
+        of steps, so bad credentials fail after a few requests. Timings for each step are kept in self.last_login.
+
+        Raises:
+            AuthenticationError: when CALPADS rejects the credentials or the login doesn't complete
+        """
+        flow = LoginFlow(self.credentials, self.host)
+        step = flow.next_step(response.url, response.status_code, response.text)
+        if step is None:
+            return response
+        while step is not None:
+            self.log.debug("Handling {} with a {} step".format(urlsplit(response.url).path, step.state))
+            if step.state == 'credentials':
+                # A fresh login starts a fresh server-side session, so forget the LEA context
+                self._auth_generation += 1
+                self._selected_lea = None
+                self._org_change_form = None
+            response = self.session.request(step.method, step.url, data=step.data)
+            flow.record(response.url, response.status_code)
+            step = flow.next_step(response.url, response.status_code, response.text)
+        self.last_login = flow
+        self.log.info("Logged in with {} requests in {:.2f} seconds".format(flow.steps, flow.total_seconds))
+        if self.session_store is not None:
+            self._save_session()
+        return response
+
+    def _login_from_store(self):
+        """Restore the saved session, if any, and otherwise log in and save the new session
+
+        Restored cookies are trusted without a round trip. If CALPADS no longer honors them, the first request is
+        bounced to the login page and _request() logs in again and replays it.
+        """
+        key = session_key(self.host, self.username)
+        # Holding the lock means only one client at a time logs in; the rest pick up its session
+        with self.session_store.lock(key):
+            state = self.session_store.load(key)
+            if state is not None:
+                load_cookies(self.session.cookies, state['cookies'])
+                # The session is shared, and so is the LEA it's working within
+                self._selected_lea = state.get('selected_lea')
+                self.log.debug("Restored a saved session")
+                return True
+            return self._login()
+
+    def _save_session(self):
+        self.session_store.save(session_key(self.host, self.username), dump_cookies(self.session.cookies),
+                                self._selected_lea)
+        self.log.debug("Saved the authenticated session")
+
+    def _is_shared_lea(self, lea_code):
+        """Whether the session store, if any, agrees that the session is still working within lea_code
+
+        Other clients restored from the store share the server-side session and may have switched LEAs since.
+        """
+        if self.session_store is None:
+            return True
+        key = session_key(self.host, self.username)
+        with self.session_store.lock(key):
+            state = self.session_store.load(key)
+        return state is not None and state.get('selected_lea') == lea_code
+
+    def _ensure_logged_in(self):
+        """Log in on first use. Thread-safe, and a no-op once the client has logged in.
+
+        Raises:
+            AuthenticationError: when CALPADS rejects the credentials or the login doesn't complete
+        """
+        if self.__connection_status is not None:
+            return
+        with self._login_lock:
+            if self.__connection_status is not None:
+                return
+            try:
+                if self.session_store is not None:
+                    self.__connection_status = self._login_from_store()
+                else:
+                    self.__connection_status = self._login()
+            except AuthenticationError as e:
+                self.__connection_status = False
+                self.log.info("Looks like the provided credentials might be incorrect. Confirm credentials.")
+                raise e
+
+    def _request(self, method, url, **kwargs):
+        """Send a request, logging in first if needed, and return the response to it
+
+        If the session expired and the request was bounced to the login page, this logs in again. An idempotent
+        request (GET, HEAD, OPTIONS) is then replayed once, within the LEA it was working in. Anything else raises
+        SessionExpired rather than silently returning the page CALPADS redirected to, since its form data carries a
+        token from the old session.
+
+        Args:
+            method (str): the HTTP method
+            url (str): the URL to request
+            kwargs: passed on to requests.Session.request, e.g. data or stream
+
+        Returns:
+            requests.Response
+
+        Raises:
+            SessionExpired: when a non-idempotent request was interrupted by a login, or a replay was bounced again
+            AuthenticationError: when logging in (again) fails
+        """
+        self._ensure_logged_in()
+        selected_lea = self._selected_lea
+        auth_generation = self._auth_generation
+        response = self.session.request(method, url, **kwargs)
+        if not is_auth_page(response):
+            return response
+        with self._login_lock:
+            # Another thread may have logged in again while this one waited, and its login page is stale now
+            if auth_generation == self._auth_generation:
+                self._complete_login(response)
+        if method.upper() not in IDEMPOTENT_METHODS:
+            raise SessionExpired("The session expired during {} {}. Logged in again, but did not replay it."
+                                 .format(method.upper(), url))
+        self.log.info("The session expired; logged in again and replaying {} {}".format(method.upper(), url))
+        if selected_lea is not None:
+            # The new server-side session starts in the default LEA
+            self._select_lea(selected_lea)
+        response = self.session.request(method, url, **kwargs)
+        if is_auth_page(response):
+            raise SessionExpired("Logging in again did not restore the session for {}".format(url))
+        return response
+
+    def _get(self, url, **kwargs):
+        return self._request('GET', url, **kwargs)
+
+    def _post(self, url, **kwargs):
+        return self._request('POST', url, **kwargs)
 
     @property
     def is_connected(self):
-        """User exposed attribute to check whether the client successfully connected. Might return false positives."""
+        """User exposed attribute to check whether the client successfully connected. Might return false positives.
+
+        Logs in if the client hasn't made any requests yet.
+        """
+        try:
+            self._ensure_logged_in()
+        except AuthenticationError:
+            return False
         return self.__connection_status #Unclear, but there is a chance this returns a false positive
 
     def get_leas(self):
-        """Returns the list of LEAs provided by CALPADS
+        """Returns the list of LEAs provided by CALPADS. Cached in the client's response_cache.
         Returns:
             list of LEA dictionaries with the keys Disabled, Group, Selected, Text, Value
         """
-        response = self.session.get(urljoin(self.host, 'Leas?format=JSON'))
-        return safe_json_load(response)
+        return self.response_cache.get_or_fetch(
+            'leas', (self.username,),
+            lambda: safe_json_load(self._get(urljoin(self.host, 'Leas?format=JSON'))))
 
     def get_all_schools(self, lea_code):
         """Returns the list of schools for the provided lea_code
@@ -65,10 +266,12 @@ class CALPADSClient:
                 this is the CD part of the County-District-School (CDS) code. For independently reporting charters, it's the S.
 
         Returns:
-            list of School dictionaries with the keys Disabled, Group, Selected, Text, Value
+            list of School dictionaries with the keys Disabled, Group, Selected, Text, Value. Cached in the client's
+            response_cache.
         """
-        response = self.session.get(urljoin(self.host, f"/SchoolListingAll?lea={lea_code}&format=JSON"))
-        return safe_json_load(response)
+        return self.response_cache.get_or_fetch(
+            'schools', (lea_code,),
+            lambda: safe_json_load(self._get(urljoin(self.host, f"/SchoolListingAll?lea={lea_code}&format=JSON"))))
 
     def get_submitter_names(self, lea_code):
         """Returns the list of users who might have ever submitted data for the provided lea_code
@@ -78,10 +281,13 @@ class CALPADSClient:
                 this is the CD part of the County-District-School (CDS) code. For independently reporting charters, it's the S.
 
         Returns:
-            list of users dictionaries with the keys Disabled, Group, Selected, Text, Value
+            list of users dictionaries with the keys Disabled, Group, Selected, Text, Value. Cached in the client's
+            response_cache.
         """
-        response = self.session.get(urljoin(self.host, f"/GetSubmitterNames?leaCdsCode={lea_code}&format=JSON"))
-        return safe_json_load(response)
+        return self.response_cache.get_or_fetch(
+            'submitter_names', (lea_code,),
+            lambda: safe_json_load(self._get(urljoin(self.host,
+                                                     f"/GetSubmitterNames?leaCdsCode={lea_code}&format=JSON"))))
 
     def get_user_orgs(self, lea_code, email):
         """Returns a user's organization and their different roles. Can be used to reliably fetch UserOrgId.
@@ -92,14 +298,23 @@ class CALPADSClient:
             email (str): an email of the user to lookup
 
         Returns:
-            a dictionary with a Data key which lists the user's available organizations
+            a dictionary with a Data key which lists the user's available organizations. Cached in the client's
+            response_cache.
         """
+        user_orgs = self.response_cache.get_or_fetch('user_orgs', (self.username, lea_code, email.casefold()),
+                                                     lambda: self._fetch_user_orgs(lea_code, email))
+        if user_orgs is not None:
+            return user_orgs
+        else:
+            return json.loads('{"Data": [],"Total Count": 0}')
+
+    def _fetch_user_orgs(self, lea_code, email):
+        """Returns the user orgs JSON, or None when the lookup failed so the failure isn't cached"""
         self._select_lea(lea_code)
-        response = self.session.get(urljoin(self.host, f"/GetUserOrgs/{email}?format=JSON"))
+        response = self._get(urljoin(self.host, f"/GetUserOrgs/{email}?format=JSON"))
         if response.status_code == 200:
             return safe_json_load(response)
-        else:
-            return json.loads('{"Data": [],"Total Count": 0}')
+        return None
 
     def get_homepage_important_messages(self):
         """Returns the CALPADS' Homepage Important Messages section in JSON
@@ -107,7 +322,7 @@ class CALPADSClient:
             a dict with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, '/HomepageImportantMessages?format=JSON&skip=0&take=5&undefined=0'))
+        response = self._get(urljoin(self.host, '/HomepageImportantMessages?format=JSON&skip=0&take=5&undefined=0'))
         self.log.debug(safe_json_load(response).get('Data'))
         return safe_json_load(response)
 
@@ -117,7 +332,7 @@ class CALPADSClient:
             a dict with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, '/HomepageAnomalyStatus?format=JSON'))
+        response = self._get(urljoin(self.host, '/HomepageAnomalyStatus?format=JSON'))
         return safe_json_load(response)
 
     def get_homepage_certification_status(self):
@@ -126,7 +341,7 @@ class CALPADSClient:
             a dict with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, '/HomepageCertificationStatus?format=JSON'))
+        response = self._get(urljoin(self.host, '/HomepageCertificationStatus?format=JSON'))
         return safe_json_load(response)
 
     def get_homepage_submission_status(self):
@@ -135,7 +350,7 @@ class CALPADSClient:
             a dict with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, '/HomepageSubmissions?format=JSON'))
+        response = self._get(urljoin(self.host, '/HomepageSubmissions?format=JSON'))
         return safe_json_load(response)
 
     def get_homepage_extract_status(self):
@@ -144,7 +359,7 @@ class CALPADSClient:
             a dict with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, '/HomepageNotifications?format=JSON'))
+        response = self._get(urljoin(self.host, '/HomepageNotifications?format=JSON'))
         return safe_json_load(response)
 
     def get_enrollment_history(self, ssid):
@@ -157,7 +372,7 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Student/{ssid}/Enrollment?format=JSON'))
+        response = self._get(urljoin(self.host, f'/Student/{ssid}/Enrollment?format=JSON'))
         return safe_json_load(response)
 
     def get_demographics_history(self, ssid):
@@ -170,7 +385,7 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Student/{ssid}/Demographics?format=JSON'))
+        response = self._get(urljoin(self.host, f'/Student/{ssid}/Demographics?format=JSON'))
         return safe_json_load(response)
 
     def get_address_history(self, ssid):
@@ -183,7 +398,7 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Student/{ssid}/Address?format=JSON'))
+        response = self._get(urljoin(self.host, f'/Student/{ssid}/Address?format=JSON'))
         return safe_json_load(response)
 
     def get_elas_history(self, ssid):
@@ -196,7 +411,7 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Student/{ssid}/EnglishLanguageAcquisition?format=JSON'))
+        response = self._get(urljoin(self.host, f'/Student/{ssid}/EnglishLanguageAcquisition?format=JSON'))
         return safe_json_load(response)
 
     def get_program_history(self, ssid):
@@ -209,7 +424,7 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Student/{ssid}/Program?format=JSON'))
+        response = self._get(urljoin(self.host, f'/Student/{ssid}/Program?format=JSON'))
         return safe_json_load(response)
 
     def get_student_course_section_history(self, ssid):
@@ -222,7 +437,7 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Student/{ssid}/StudentCourseSection?format=JSON'))
+        response = self._get(urljoin(self.host, f'/Student/{ssid}/StudentCourseSection?format=JSON'))
         return safe_json_load(response)
 
     def get_cte_history(self, ssid):
@@ -235,7 +450,7 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Student/{ssid}/CareerTechnicalEducation?format=JSON'))
+        response = self._get(urljoin(self.host, f'/Student/{ssid}/CareerTechnicalEducation?format=JSON'))
         return safe_json_load(response)
 
     def get_stas_history(self, ssid):
@@ -248,7 +463,7 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Student/{ssid}/StudentAbsenceSummary?format=JSON'))
+        response = self._get(urljoin(self.host, f'/Student/{ssid}/StudentAbsenceSummary?format=JSON'))
         return safe_json_load(response)
 
     def get_sirs_history(self, ssid):
@@ -261,7 +476,7 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Student/{ssid}/StudentIncidentResult?format=JSON'))
+        response = self._get(urljoin(self.host, f'/Student/{ssid}/StudentIncidentResult?format=JSON'))
         return safe_json_load(response)
 
     def get_soff_history(self, ssid):
@@ -274,7 +489,7 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Student/{ssid}/Offense?format=JSON'))
+        response = self._get(urljoin(self.host, f'/Student/{ssid}/Offense?format=JSON'))
         return safe_json_load(response)
 
     def get_assessment_history(self, ssid):
@@ -287,7 +502,7 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Student/{ssid}/Assessment?format=JSON'))
+        response = self._get(urljoin(self.host, f'/Student/{ssid}/Assessment?format=JSON'))
         return safe_json_load(response)
 
     def get_sped_history(self, ssid):
@@ -300,7 +515,7 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Student/{ssid}/SPED?format=JSON'))
+        response = self._get(urljoin(self.host, f'/Student/{ssid}/SPED?format=JSON'))
         return safe_json_load(response)
 
     def get_ssrv_history(self, ssid):
@@ -313,7 +528,7 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Student/{ssid}/SSRV?format=JSON'))
+        response = self._get(urljoin(self.host, f'/Student/{ssid}/SSRV?format=JSON'))
         return safe_json_load(response)
 
     def get_psts_history(self, ssid):
@@ -326,7 +541,7 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary).
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Student/{ssid}/PSTS?format=JSON'))
+        response = self._get(urljoin(self.host, f'/Student/{ssid}/PSTS?format=JSON'))
         return safe_json_load(response)
 
     def get_requested_extracts(self, lea_code):
@@ -340,7 +555,7 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary)
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Extract?SelectedLEA={lea_code}&format=JSON'))
+        response = self._get(urljoin(self.host, f'/Extract?SelectedLEA={lea_code}&format=JSON'))
         return safe_json_load(response)
 
     def get_staff_demographics_history(self, seid):
@@ -352,7 +567,7 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary)
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Staff/{seid}/StaffDemographics?format=JSON'))
+        response = self._get(urljoin(self.host, f'/Staff/{seid}/StaffDemographics?format=JSON'))
         return safe_json_load(response)
 
     def get_staff_assignments_history(self, seid):
@@ -364,7 +579,7 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary)
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Staff/{seid}/StaffAssignments?format=JSON'))
+        response = self._get(urljoin(self.host, f'/Staff/{seid}/StaffAssignments?format=JSON'))
         return safe_json_load(response)
 
     def get_staff_courses_history(self, seid):
@@ -376,11 +591,32 @@ class CALPADSClient:
             a JSON object with a Data key and a total record count key (the name of this key can vary)
             Expected data is under Data as a List where each item is a "row" of data
         """
-        response = self.session.get(urljoin(self.host, f'/Staff/{seid}/StaffCourses?format=JSON'))
+        response = self._get(urljoin(self.host, f'/Staff/{seid}/StaffCourses?format=JSON'))
         return safe_json_load(response)
 
+    def fetch_histories(self, identifiers, endpoints=None, max_workers=8):
+        """Concurrently fetch history endpoints for many SSIDs/SEIDs, streaming results as they complete
+
+        Each worker thread logs in with its own session using this client's credentials, so this client's
+        session and LEA context are left untouched. The workers share this client's transport and so its rate limits.
+
+        Args:
+            identifiers (iterable): SSIDs and/or SEIDs to look up
+            endpoints (iterable of str, optional): names from calpads.bulk.HISTORY_ENDPOINTS, e.g. ['enrollment', 'sped'].
+                Defaults to all of the student history endpoints.
+            max_workers (int): the number of concurrent sessions to use. Defaults to 8.
+
+        Returns:
+            a generator of calpads.bulk.BulkResult namedtuples with identifier, endpoint, data, and error
+        """
+        with BulkHistoryFetcher(lambda: self.__class__(self.username, self.password, transport=self.transport,
+                                                       metrics=self.metrics, host=self.host),
+                                max_workers=max_workers) as fetcher:
+            yield from fetcher.fetch(identifiers, endpoints)
+
     def download_report(self, lea_code, report_code, file_name=None, is_snapshot=False,
-                        download_format='CSV', form_data=None, dry_run=False, url_override=None):
+                        download_format='CSV', form_data=None, dry_run=False, url_override=None,
+                        chunk_size=DEFAULT_CHUNK_SIZE, checksum=None):
         """Download CALPADS ODS or Snapshot Reports
 
         Args:
@@ -389,17 +625,23 @@ class CALPADSClient:
             report_code (str): Currently supports all known reports. Expected format is a string e.g. '8.1', '1.17', and '1.18'.
                 For reports that have letters in them, for example the 8.1 EOY3, expected input is '8.1eoy3' OR '8.1EOY3'.
                 No spaces, all one word.
-            file_name (str): the name of the file to pass to open(file_name, 'wb'). Assumes any subdirectories
-                parent directories referenced in the file name already exist.
+            file_name (str or file-like): the name of the file to pass to open(file_name, 'wb'). Assumes any subdirectories
+                parent directories referenced in the file name already exist. Any writable binary file-like object
+                can be passed instead, in which case it is written to but left open.
             is_snapshot (bool): when True downloads the Snapshot Report. When False, downloads the ODS Report.
             download_format (str): The format in which you want the download for the report.
                 Currently supports: csv, excel, pdf, word, powerpoint, tiff, mhtml, xml, datafeed
             form_data (dict): the data that should be sent with the form request. Usually, all select fields for the
                 form need to be provided. To see list of valid values, set dry_run=True.
             dry_run (bool): when False, it downloads the report. When True, it doesn't download the report and instead
-                returns a dict with the form fields and their expected inputs.
+                returns a dict with the form fields and their expected inputs. Served from the client's schema_cache
+                without any requests when the form has been parsed before.
             url_override (str): optional parameter to override _get_report_link() method with hardcoded url. Used for
                 when a report url is not included on the ODS webpage.
+            chunk_size (int, optional): the report is streamed to file_name in chunks of this many bytes.
+                Defaults to 1 MiB.
+            checksum (str, optional): the name of a hashlib algorithm, e.g. 'sha256', to compute while streaming.
+                The byte count and checksum of the download are available in client.last_download.
 
         Returns:
             bool: True for a successful download of report, else False.
@@ -412,22 +654,31 @@ class CALPADSClient:
             raise Exception('Bad download format')
         if not file_name:
             file_name = 'data'
-        with self.session as session:
+        schema_name = report_schema_name(report_code, is_snapshot, url_override)
+        if dry_run:
+            cached_schema = self.schema_cache.get('report', lea_code, schema_name)
+            if cached_schema is not None:
+                self.log.debug("Using the cached form schema for report {}".format(schema_name))
+                return cached_schema
+        with self.session, self.metrics.flow('download_report', report=report_code) as flow:
             self._select_lea(lea_code)
+            flow.mark('select_lea')
             if url_override is None:
                 report_url = self._get_report_link(report_code.lower(), is_snapshot)
             else:
                 report_url = url_override
+            flow.mark('report_link')
             if report_url:
-                session.get(report_url)
+                report_page = self._get(report_url)
             else:
-                # TODO: Write a ReportNotFound exception in an exceptions.py module
-                raise Exception("Report Not Found")
-            report_page_root = etree.fromstring(self.visit_history[-1].text, parser=etree.HTMLParser(encoding='utf8'))
-            iframe_url = report_page_root.xpath("//iframe[@src and not(contains(@src, 'KeepAlive'))]")[0].attrib['src']
+                raise ReportNotFound("Report Not Found")
+            flow.mark('report_page')
+            iframe_url = get_report_iframe_url(report_page.text)
             #self.log.debug(iframe_url)
-            session.get(iframe_url)
-            form = ReportsForm(self.visit_history[-1].text)
+            form_page = self._get(iframe_url)
+            form = ReportsForm(form_page.text)
+            flow.mark('iframe')
+            self.schema_cache.put('report', lea_code, schema_name, form.filtered_parse)
             if dry_run:
                 return form.filtered_parse
 
@@ -442,36 +693,21 @@ class CALPADSClient:
 
             self.log.debug('The form data about to be submitted: \n{}\n'.format(submitted_form_data))
             self.log.debug('These are the data keys about to be submitted: \n{}\n'.format(submitted_form_data.keys()))
-            session.post(self.visit_history[-1].url, data=submitted_form_data)
-
-            # Regex for grabbing the base, direct download URL for the report
-            regex = re.compile('(?<="ExportUrlBase":")[^"]+(?=")')  # Look for text sandwiched between the lookbehind and
-            # the lookahead, but EXCLUDE the double quotes (i.e. find the first double quotes as the upper limit of the text)
-
-            split_query = None
-            if regex.search(self.visit_history[-1].text):
-                self.log.debug('Found ExportUrlBase in the URL')
-                export_url_base = regex.search(self.visit_history[-1].text).group(0)
-                scheme, netloc, path, query, frag = urlsplit(urljoin("https://reports.calpads.org",
-                                                                     export_url_base)
-                                                             .replace('\\u0026', '&')
-                                                             .replace('%3a', ':')
-                                                             .replace('%2f', '/'))
-                split_query = parse_qsl(query)
-
-            if split_query:
-                self.log.info("Adding Format parameter to the URL")
-                split_query.append(('Format', REPORTS_DL_FORMAT[download_format.upper()]))
-                self.log.info("Rejoining the query elements again")
-                report_dl_url = urlunsplit([scheme, netloc, path, urlencode(split_query), frag])
-                session.get(report_dl_url)
-                self.log.info("Fetched the report bytes.")
+            report_page = self._post(form_page.url, data=submitted_form_data)
+            flow.mark('form_post')
+
+            # ExportUrlBase is relative to the report server that rendered the form
+            report_dl_url = get_report_export_url(report_page.text, download_format, reports_host=report_page.url)
+            if report_dl_url:
+                self.log.info("Found the report's export URL")
+                response = self._get(report_dl_url, stream=True)
                 # Cautionary Tale here if the content is compressed:
                 # https://stackoverflow.com/a/50825553
-                # Might need to revisit later
-                with open(file_name, 'wb') as f:
-                    f.write(self.visit_history[-1].content)
-                    return True
+                # iter_content decodes gzip/deflate, so bytes_written is the decoded size
+                self.last_download = stream_response(response, file_name, chunk_size, checksum)
+                flow.mark('export')
+                self.log.info("Streamed {} bytes of the report.".format(self.last_download.bytes_written))
+                return True
 
             #If you made it this far, something went wrong.
             self.log.info("Failed to download the report.")
@@ -509,79 +745,43 @@ class CALPADSClient:
             by_as_of_date (bool, optional): used only in CENR to fill out the As of Date form. If by_date_range is True,
                 this is ignored.
             dry_run (bool): when False, it downloads the report. When True, it doesn't download the report and instead
-                returns a dict with the form fields and their expected inputs.
+                returns a dict with the form fields and their expected inputs. Served from the client's schema_cache
+                without any requests when the form has been parsed before.
         Returns:
-            bool: True if extract request was successful, False if it was not successful.
+            ExtractRequest: a truthy handle with the lea_code, extract_name, requested_at time, and (once CALPADS lists
+                it) the request_id when the extract request was successful. Pass it to download_extract() or
+                wait_for_extract() to wait on this exact request.
+            bool: False if it was not successful.
             dict: when dry_run=True, it returns a dict of the form fields and their expected inputs for report manipulation
         """
         extract_name = extract_name.upper()
         if not form_data:
             form_data = list()
-        with self.session as session:
+        schema_name = extract_schema_name(extract_name, by_date_range, by_as_of_date)
+        if dry_run:
+            cached_schema = self.schema_cache.get('extract', lea_code, schema_name)
+            if cached_schema is not None:
+                self.log.debug("Using the cached form schema for extract {}".format(schema_name))
+                return cached_schema
+        with self.session, self.metrics.flow('request_extract', extract=extract_name) as flow:
             self._select_lea(lea_code)
+            flow.mark('select_lea')
             # Direct URL access for each extract request with a few exceptions for atypical extracts
             # navigate to extract page
-            if extract_name == 'SSID':
-                session.get('https://www.calpads.org/Extract/SSIDExtract')
-            elif extract_name == 'DIRECTCERTIFICATION':
-                session.get('https://www.calpads.org/Extract/DirectCertificationExtract')
-            elif extract_name == 'REJECTEDRECORDS':
-                session.get('https://www.calpads.org/Extract/RejectedRecords')
-            elif extract_name == 'CANDIDATELIST':
-                session.get('https://www.calpads.org/Extract/CandidateList')
-            elif extract_name == 'REPLACEMENTSSID':
-                session.get('https://www.calpads.org/Extract/ReplacementSSID')
-            elif extract_name == 'SPEDDISCREPANCYEXTRACT':
-                session.get('https://www.calpads.org/Extract/SPEDDiscrepancyExtract')
-            elif extract_name == 'DSEAEXTRACT':
-                session.get('https://www.calpads.org/Extract/DSEAExtract')
-            else:
-                #TODO: Let's add some more validation layers here. Maybe through a separate extract module like reports or
-                #a config file
-                session.get('https://www.calpads.org/Extract/ODSExtract?RecordType={}'.format(extract_name))
-            root = etree.fromstring(self.visit_history[-1].text, etree.HTMLParser(encoding='utf8'))
-
-            #In the past, for SPED and SSRV extracts, CALPADS showed SELPA and NonSELPA form options.
-            #They have either removed or only show by permission levels, so we won't add that extra layer, for now.
-            if by_date_range:
-                try:
-                    if extract_name != 'CENR':
-                        chosen_form = root.xpath('//form[contains(@action, "Extract") and contains(@action, "Date")]')[0]
-                    else:
-                        chosen_form = root.xpath('//form[contains(@action, "Extract") and contains(@action, "DateRange")]')[0]
-                except IndexError:
-                    self.log.info("There is no By Date Range request option. Falling back to the default form option.")
-                    chosen_form = root.xpath('//form[contains(@action, "Extract") and not(contains(@action, "Date"))]')[0]
-            elif extract_name == 'CENR' and by_as_of_date:
-                chosen_form = root.xpath('//form[contains(@action, "Extract") and contains(@action, "AsofDate")]')[0]
-            else:
-                chosen_form = root.xpath('//form[contains(@action, "Extract") and not(contains(@action, "Date"))]')[0]
+            extract_page = self._get(urljoin(self.host, extract_page_path(extract_name)))
+            root = etree.fromstring(extract_page.text, etree.HTMLParser(encoding='utf8'))
 
+            chosen_form = choose_extract_form(root, extract_name, by_date_range, by_as_of_date)
             extracts_form = ExtractsForm(chosen_form)
+            parsed_fields = extracts_form.get_parsed_form_fields()
+            flow.mark('extract_form')
+            self.schema_cache.put('extract', lea_code, schema_name, parsed_fields)
             if dry_run:
-                return extracts_form.get_parsed_form_fields()
-
-            default_filled_fields = extracts_form.prefilled_fields.copy() #Safe to do shallow copy; list contents are immutable
-            # print('default_filled_fields:', default_filled_fields)
-
-            # Remove any tuples in the default_filled_fields whose keys appear in the user-provided form_data list
-            if form_data is not None and dry_run == False:
-                keys_in_form_data = {key for key, _ in form_data}
-                keys_in_form_data.add('ReportingLEA') # This will be added below based on lea_code
-                # print('keys_in_form_data:', keys_in_form_data)
-                filtered_filled_fields = [item for item in default_filled_fields if item[0] not in keys_in_form_data]
-                # print('filtered_filled_fields:', filtered_filled_fields)
-            else:
-                filtered_filled_fields = default_filled_fields
+                return parsed_fields
 
-            filtered_filled_fields.extend(form_data + [('ReportingLEA', lea_code)])
-            filled_fields = filtered_filled_fields
-
-            # Text inputs are not able to submit multiple key values, particularly a problem for Date Range
-            filled_fields = extracts_form._filter_text_input_fields(filled_fields)
+            filled_fields = fill_extract_form(extracts_form, form_data, lea_code)
             #self.log.debug('The submitted form data: {}'.format(filled_fields))
-            if extract_name in ['REJECTEDRECORDS', 'CANDIDATELIST',
-                                'SPEDDISCREPANCYEXTRACT', 'SSID']:
+            if extract_name in SUBMISSION_EXTRACTS:
                 check_submitter = [field for field in filled_fields if field[0] == 'Submitter' and field[1] is not None]
                 if not check_submitter:
                     #If no submitter field is provided, default to the current user
@@ -593,52 +793,142 @@ class CALPADSClient:
 
             # print('filled_fields:', filled_fields)
 
+            # Remember which requests already exist so the new one can be told apart from them
+            prior_ids = frozenset(row.get('ExtractRequestID')
+                                  for row in self.get_requested_extracts(lea_code).get('Data') or [])
+            flow.mark('prior_extracts')
+            requested_at = time.time()
             #self.log.debug('Posting extract request to: {}'.format(urljoin(self.host, chosen_form.attrib['action'])))
-            session.post(urljoin(self.host, chosen_form.attrib['action']),
-                         data=filled_fields)
+            response = self._post(urljoin(self.host, chosen_form.attrib['action']),
+                                  data=filled_fields)
             self.log.info("Attempted to request the extract.")
-            success_text = 'Extract request made successfully.  Please check back later for download.'
-            request_response = etree.fromstring(self.visit_history[-1].text, parser=etree.HTMLParser(encoding='utf8'))
-            try:
-                #self.log.debug(request_response.xpath('//p')[0].text)
-                success = (success_text == request_response.xpath('//p')[0].text)
-            except IndexError:
-                #self.log.debug('Was not able to find a paragraph tag')
-                success = False
+            flow.mark('request_post')
+            if not is_extract_request_success(response.text):
+                return False
+            extract_request = ExtractRequest(lea_code, extract_name, requested_at, prior_ids)
+            self._extract_ids.resolve(extract_request, self.get_requested_extracts(lea_code).get('Data') or [])
+            flow.mark('resolve_id')
+            self.log.debug("Requested extract {}".format(extract_request))
+            return extract_request
+
+    def validate_extract_form(self, lea_code, extract_name, form_data, by_date_range=False, by_as_of_date=False):
+        """Check form_data for request_extract against the extract form, without requesting the extract
+
+        Uses the cached form schema when there is one, so this usually doesn't make any requests.
+
+        Args:
+            lea_code (str): the LEA the extract would be requested for
+            extract_name (str): see request_extract
+            form_data (list of iterables): the (key, value) pairs that would be passed to request_extract
+            by_date_range (bool, optional): see request_extract
+            by_as_of_date (bool, optional): see request_extract
+
+        Returns:
+            list of str describing each problem found. An empty list means the form data looks valid.
+        """
+        schema = self.request_extract(lea_code, extract_name, by_date_range=by_date_range,
+                                      by_as_of_date=by_as_of_date, dry_run=True)
+        return validate_extract_form_data(schema, form_data)
+
+    def validate_report_form(self, lea_code, report_code, form_data, is_snapshot=False, url_override=None):
+        """Check form_data for download_report against the report form, without downloading the report
 
-            return success
+        Uses the cached form schema when there is one, so this usually doesn't make any requests.
 
-    def download_extract(self, lea_code, file_name=None, timeout=60, poll=10, return_bytes=False):
+        Args:
+            lea_code (str): the LEA the report would be downloaded for
+            report_code (str): see download_report
+            form_data (dict): the data that would be passed to download_report
+            is_snapshot (bool, optional): see download_report
+            url_override (str, optional): see download_report
+
+        Returns:
+            list of str describing each problem found. An empty list means the form data looks valid.
+        """
+        schema = self.download_report(lea_code, report_code, is_snapshot=is_snapshot, dry_run=True,
+                                      url_override=url_override)
+        return validate_report_form_data(schema, form_data)
+
+    def wait_for_extract(self, extract_request, timeout=600, poll=2, max_poll=60):
+        """Wait until the extract behind an ExtractRequest handle is complete
+
+        Polls the extract listing with exponential backoff and jitter, starting at poll seconds and growing up to
+        max_poll seconds between checks, and gives up once timeout seconds have passed.
+
+        Args:
+            extract_request (ExtractRequest): the handle returned by request_extract()
+            timeout (float, optional): the overall deadline in seconds. Defaults to 600.
+            poll (float, optional): the first delay between polls in seconds. Defaults to 2.
+            max_poll (float, optional): the longest delay between polls in seconds. Defaults to 60.
+
+        Returns:
+            dict: the extract's row from the listing once it is complete, or None if it failed or timed out
+        """
+        deadline = time.time() + timeout
+        delays = backoff_delays(poll, max_poll)
+        while True:
+            rows = self.get_requested_extracts(extract_request.lea_code).get('Data') or []
+            row = self._extract_ids.resolve(extract_request, rows)
+            if row is not None and is_extract_complete(row):
+                self.log.info("Extract request {} is complete".format(extract_request.request_id))
+                return row
+            if row is not None and is_extract_failed(row):
+                self.log.info("Extract request {} failed with status {}"
+                              .format(extract_request.request_id, row.get('ExtractStatus')))
+                return None
+            if not sleep_until_next_poll(delays, deadline):
+                self.log.info("Timed out waiting on {}".format(extract_request))
+                return None
+
+    def download_extract(self, lea_code, file_name=None, timeout=60, poll=10, return_bytes=False,
+                         chunk_size=DEFAULT_CHUNK_SIZE, checksum=None, extract_request=None, max_poll=60):
         """
         Download the file and give it the provided file_name.
 
         Args:
             lea_code (str): string of the seven digit number found next to your LEA name in the org select menu. For most LEAs,
                 this is the CD part of the County-District-School (CDS) code. For independently reporting charters, it's the S.
-            file_name (str): the name of the file to pass to open(file_name, 'wb'). Assumes any subdirectories
-                parent directories referenced in the file name already exist.
+            file_name (str or file-like): the name of the file to pass to open(file_name, 'wb'). Assumes any subdirectories
+                parent directories referenced in the file name already exist. Any writable binary file-like object
+                can be passed instead, in which case it is written to but left open.
             timeout (int, optional): how long to wait for a completed extract request.
                 Defaults to 60 seconds.
             poll (float, optional): this is how long to wait between polls to the API to check if the request is
                 complete. This parameter is used in time.sleep(). Defaults to 10 seconds to respect the server, and
                 enforces a minimum of 1 second.
             return_bytes (bool, optional): instead of writing to file and returning True,
-                this will return bytes if a download would have been successful.
+                this will return bytes if a download would have been successful. This buffers the whole extract in memory.
+            chunk_size (int, optional): the extract is streamed to file_name in chunks of this many bytes.
+                Defaults to 1 MiB.
+            checksum (str, optional): the name of a hashlib algorithm, e.g. 'sha256', to compute while streaming.
+                The byte count and checksum of the download are available in client.last_download.
+            extract_request (ExtractRequest, optional): the handle returned by request_extract(). When provided, this
+                downloads exactly that extract and polls with exponential backoff starting at poll and capped at
+                max_poll seconds. Otherwise, the most recent extract in the listing is downloaded. Its lea_code must
+                match lea_code.
+            max_poll (float, optional): the longest delay between polls when waiting on an extract_request.
 
         Returns:
             bool: True for a successful download of report, else False.
             bytes: Bytes of a successful download of the report if return_bytes=True
+
+        Raises:
+            ValueError: when extract_request was made for an LEA other than lea_code
         """
+        check_extract_request_lea(lea_code, extract_request)
         if poll < 1:
             poll = 1
         if not file_name:
             file_name = 'data'
-        #TODO: Check also for type and download date, all that good stuff
-        with self.session as session:
+        with self.session, self.metrics.flow('download_extract') as flow:
             self._select_lea(lea_code)
+            flow.mark('select_lea')
             time_start = time.time()
             extract_request_id = None
-            while (time.time() - time_start) < timeout:
+            if extract_request is not None:
+                completed = self.wait_for_extract(extract_request, timeout, poll, max_poll)
+                extract_request_id = completed['ExtractRequestID'] if completed else None
+            while extract_request is None and (time.time() - time_start) < timeout:
                 result = self.get_requested_extracts(lea_code).get('Data')
                 # self.log.debug(result)
                 #Currently only pulling the first result to check against, assuming it's the latest
@@ -648,16 +938,108 @@ class CALPADSClient:
                     break
                 #Take a breather
                 time.sleep(poll)
+            flow.mark('wait')
             if extract_request_id and not return_bytes:
-                with open(file_name, 'wb') as f:
-                    f.write(self._get_extract_bytes(extract_request_id))
-                    return True
+                self.last_download = self._stream_extract(extract_request_id, file_name, chunk_size, checksum)
+                flow.mark('download')
+                return True
             elif extract_request_id and return_bytes:
-                return self._get_extract_bytes(extract_request_id)
+                extract_bytes = self._get_extract_bytes(extract_request_id)
+                flow.mark('download')
+                return extract_bytes
             else:
                 self.log.info("Download request timed out. The download might have taken too long.")
                 return False
 
+    def request_extracts(self, lea_code, extract_specs):
+        """Request several extracts for an LEA up front, so CALPADS can generate them in parallel
+
+        Args:
+            lea_code (str): string of the seven digit number found next to your LEA name in the org select menu.
+            extract_specs (list): each item is either an extract name, e.g. 'SENR', or a dict of keyword arguments
+                for request_extract(), e.g. {'extract_name': 'SENR', 'form_data': [...], 'by_date_range': True}
+
+        Returns:
+            list: the ExtractRequest handle (or False for a failed request) for each spec, in the same order.
+                Pass them to download_extracts().
+        """
+        extract_requests = []
+        for spec in extract_specs:
+            kwargs = {'extract_name': spec} if isinstance(spec, str) else dict(spec)
+            extract_requests.append(self.request_extract(lea_code, **kwargs))
+        return extract_requests
+
+    def download_extracts(self, extract_requests, directory='.', file_name=None, timeout=1800, poll=5, max_poll=60,
+                          max_workers=4, chunk_size=DEFAULT_CHUNK_SIZE, checksum=None):
+        """Wait on many requested extracts in one poll loop and download each as soon as it is complete
+
+        The extract listing of each LEA is polled once per loop for all of the pending extracts, and completed
+        extracts are streamed concurrently on up to max_workers threads, so the wall time is roughly that of the
+        slowest extract rather than the sum of all of them.
+
+        Args:
+            extract_requests (list of ExtractRequest): the handles returned by request_extract() or
+                request_extracts(). Failed (False) requests are skipped.
+            directory (str, optional): where to write the extracts as {lea_code}_{extract_name}_{request_id}.txt.
+                Assumes the directory already exists. Ignored when file_name is provided.
+            file_name (callable, optional): takes an ExtractRequest and returns the path or writable binary file-like
+                object to stream that extract to
+            timeout (float, optional): the overall deadline in seconds for every extract. Defaults to 1800.
+            poll (float, optional): the first delay between polls in seconds. It backs off up to max_poll and resets
+                whenever an extract completes. Defaults to 5.
+            max_poll (float, optional): the longest delay between polls in seconds. Defaults to 60.
+            max_workers (int, optional): the most extracts downloaded at the same time. Defaults to 4.
+            chunk_size (int, optional): the extracts are streamed in chunks of this many bytes. Defaults to 1 MiB.
+            checksum (str, optional): the name of a hashlib algorithm, e.g. 'sha256', to compute for each download
+
+        Returns:
+            a generator of ExtractDownload namedtuples (extract_request, sink, stats, error) in the order the
+            downloads finish. error is None for a successful download, otherwise the exception explaining why the
+            extract failed, timed out, or couldn't be downloaded.
+        """
+        if file_name is None:
+            def file_name(extract_request):
+                return default_extract_file_name(extract_request, directory)
+        return iter_extract_downloads(self, extract_requests, file_name, timeout=timeout, poll=max(poll, 1),
+                                      max_poll=max_poll, max_workers=max_workers, chunk_size=chunk_size,
+                                      checksum=checksum)
+
+    def stream_extract_records(self, extract_request, record_type=None, timeout=600, poll=2, max_poll=60,
+                               chunk_size=DEFAULT_CHUNK_SIZE, encoding='utf-8'):
+        """Wait on a requested extract and parse its records straight from the streaming download
+
+        Nothing is written to disk and only a chunk of the extract is held in memory at a time. The waiting and the
+        download start on the first iteration.
+
+        Args:
+            extract_request (ExtractRequest): the handle returned by request_extract()
+            record_type (str or ExtractLayout, optional): the layout to parse the records with, e.g. 'SENR'.
+                Defaults to the record type code in the extract's first row.
+            timeout (float, optional): the overall deadline in seconds to wait for the extract. Defaults to 600.
+            poll (float, optional): the first delay between polls in seconds. Defaults to 2.
+            max_poll (float, optional): the longest delay between polls in seconds. Defaults to 60.
+            chunk_size (int, optional): the extract is read in chunks of this many bytes. Defaults to 1 MiB.
+            encoding (str, optional): the text encoding of the extract
+
+        Returns:
+            a generator of the namedtuple records of calpads.extract_parser
+
+        Raises:
+            ExtractFailed: when the extract failed or didn't complete within timeout seconds
+            ExtractParseError: when the extract doesn't match its layout
+        """
+        self._select_lea(extract_request.lea_code)
+        completed = self.wait_for_extract(extract_request, timeout, poll, max_poll)
+        if completed is None:
+            raise ExtractFailed("{} failed or didn't complete in time".format(extract_request))
+        extract_request_id = completed['ExtractRequestID']
+        response = self._get(urljoin(self.host, f'/Extract/DownloadLink?ExtractRequestID={extract_request_id}'),
+                             stream=True)
+        try:
+            yield from iter_extract_records(response.iter_content(chunk_size), record_type, encoding=encoding)
+        finally:
+            response.close()
+
     def upload_file(self, lea_code, file_path=None, form_data=None, dry_run=False):
         """
         Upload the file at file_path to CALPADS.
@@ -678,10 +1060,10 @@ class CALPADSClient:
         """
         if not dry_run:
             assert file_path and form_data, "File Path and Form Data are required inputs."
-        with self.session as session:
+        with self.session:
             self._select_lea(lea_code)
-            session.get("https://www.calpads.org/FileSubmission/FileUpload")
-            root = etree.fromstring(self.visit_history[-1].text,
+            upload_page = self._get(urljoin(self.host, "/FileSubmission/FileUpload"))
+            root = etree.fromstring(upload_page.text,
                                     etree.HTMLParser(encoding='utf8'))
             root_form = root.xpath("//div[@id='fileUpload']//form")[0]
             upload_form = FilesUploadForm(root_form)
@@ -693,11 +1075,11 @@ class CALPADSClient:
             cleaned_filled_form = {k: v for k,v in prefilled_dict.items() if v != '' and v is not None}
             with open(file_path, 'rb') as f:
                 file_input = {'FilesUploaded[0].FileName': f}
-                session.post(urljoin(self.visit_history[-1].url, root_form.attrib['action']),
-                             files=file_input,
-                             data=cleaned_filled_form)
+                upload_response = self._post(urljoin(upload_page.url, root_form.attrib['action']),
+                                             files=file_input,
+                                             data=cleaned_filled_form)
                 self.log.info("Attempted to upload the file.")
-            response = etree.fromstring(self.visit_history[-1].text,
+            response = etree.fromstring(upload_response.text,
                                         etree.HTMLParser(encoding='utf8'))
             if response.xpath('//*[contains(@class, "alert alert-success")]'):
                 return True
@@ -736,18 +1118,23 @@ class CALPADSClient:
         if poll < 10:
             poll = 10
         errors = b''
-        with self.session as session:
+        with self.session, self.metrics.flow('post_file') as flow:
             self._select_lea(lea_code)
+            flow.mark('select_lea')
             start_time = time.time()
             while (time.time()-start_time) < timeout:
                 #TODO: Need to check that this references the correct data and not stale data
                 #Maybe 'Ready for Review' ensures the date is never stale?
                 get_job_status = self.get_homepage_submission_status().get('Data')[-1]
+                flow.mark('poll')
                 if get_job_status['SubmissionStatus'] == 'Ready for Review':
                     if get_job_status['Rejected'] == '0':
                         #safe to post
-                        session.get(f"https://www.calpads.org/FileSubmission/Detail/{get_job_status['JobID']}")
-                        if self._post_file_post_action().xpath('//*[contains(@class, "alert alert-success")]'):
+                        detail_page = self._get(urljoin(self.host,
+                                                        f"/FileSubmission/Detail/{get_job_status['JobID']}"))
+                        posted = self._post_file_post_action(detail_page)
+                        flow.mark('post')
+                        if posted.xpath('//*[contains(@class, "alert alert-success")]'):
                             self.log.info("Successfully posted the file.")
                             return True, errors
                         else:
@@ -761,8 +1148,12 @@ class CALPADSClient:
                                                                           get_job_status['FileTypeCode']+'ERR',
                                                                           submitter_email, get_job_status['JobID'],
                                                                           timeout, poll)
-                        session.get(f"https://www.calpads.org/FileSubmission/Detail/{get_job_status['JobID']}")
-                        if self._post_file_post_action().xpath('//*[contains(@class, "alert alert-success")]'):
+                            flow.mark('rejections')
+                        detail_page = self._get(urljoin(self.host,
+                                                        f"/FileSubmission/Detail/{get_job_status['JobID']}"))
+                        posted = self._post_file_post_action(detail_page)
+                        flow.mark('post')
+                        if posted.xpath('//*[contains(@class, "alert alert-success")]'):
                             self.log.info("Successfully posted the file.")
                             return True, errors
                         else:
@@ -774,10 +1165,12 @@ class CALPADSClient:
                                                                           get_job_status['FileTypeCode']+'ERR',
                                                                           submitter_email, get_job_status['JobID'],
                                                                           timeout, poll)
+                            flow.mark('rejections')
                         self.log.info("Unable to post the latest job because some records were rejected")
                         return False, errors
                 else:
                     time.sleep(poll)
+                    flow.mark('sleep')
             self.log.info("Unable to post the latest job, timed out.")
             return False, errors
 
@@ -793,10 +1186,12 @@ class CALPADSClient:
         submitted_fields = [('LEA', lea_code), ('RecordType', record_type),
                             ('JobID', job_id), ('Submitter', submitter_id),
                             ('School', 'All')]
-        success = self.request_extract(lea_code, 'REJECTEDRECORDS', submitted_fields)
-        if success:
+        extract_request = self.request_extract(lea_code, 'REJECTEDRECORDS', submitted_fields)
+        if extract_request:
             self.log.info("Successfully requested the rejected records. Attempting download.")
-            return self.download_extract(lea_code, timeout=timeout, poll=poll, return_bytes=True) or b'Failed dowloading extract errors'
+            return (self.download_extract(lea_code, timeout=timeout, poll=poll, return_bytes=True,
+                                          extract_request=extract_request)
+                    or b'Failed dowloading extract errors')
         else:
             self.log.info("Failed to request the rejected records.")
             return b'Failed requesting extract errors'
@@ -811,26 +1206,42 @@ class CALPADSClient:
             self.log.debug("Could not find the id for the submitter email; will use the email as is.")
             return submitter_email
 
-    def _post_file_post_action(self):
-        """Helper to officially post a file."""
-        root = etree.fromstring(self.visit_history[-1].text,
+    def _post_file_post_action(self, page):
+        """Helper to officially post a file from its FileSubmission/Detail page."""
+        root = etree.fromstring(page.text,
                                 etree.HTMLParser(encoding='utf8'))
         form_root = root.xpath('//form[@action="/FileSubmission/Post"]')[0]
         inputs = FilesUploadForm(form_root).prefilled_fields + [('command', 'Post All')]
         input_dict = dict(inputs)
-        self.session.post(urljoin(self.host, '/FileSubmission/Post'),
-                       data=input_dict)
+        response = self._post(urljoin(self.host, '/FileSubmission/Post'),
+                              data=input_dict)
         self.log.info("Attempted to post all for this submission job.")
-        response_root = etree.fromstring(self.visit_history[-1].text,
+        response_root = etree.fromstring(response.text,
                                     etree.HTMLParser(encoding='utf8'))
         return response_root
     def _get_extract_bytes(self, extract_request_id):
         """Get the extract bytes by extract_request_id. Returns bytes."""
-        self.session.get(urljoin(self.host, f'/Extract/DownloadLink?ExtractRequestID={extract_request_id}'))
-        return self.visit_history[-1].content
+        return self._get(urljoin(self.host, f'/Extract/DownloadLink?ExtractRequestID={extract_request_id}')).content
+
+    def _stream_extract(self, extract_request_id, sink, chunk_size=DEFAULT_CHUNK_SIZE, checksum=None):
+        """Stream the extract by extract_request_id to sink without buffering it. Returns DownloadStats.
+
+        Safe to call from several threads at once, e.g. by download_extracts().
+        """
+        response = self._get(urljoin(self.host, f'/Extract/DownloadLink?ExtractRequestID={extract_request_id}'),
+                             stream=True)
+        stats = stream_response(response, sink, chunk_size, checksum)
+        self.log.info("Streamed {} bytes of the extract.".format(stats.bytes_written))
+        return stats
 
     def _select_lea(self, lea_code):
         """Specifies the context of the requests to the provided lea_code.
+
+        The selected LEA is tracked, so this is free when the session is already working within lea_code. With a
+        session_store, the LEA is recorded with the shared session and only trusted while the store still agrees.
+        The homepage's org change form is cached too, so switching LEAs only costs the UserOrgChange POST unless the
+        cached request token has gone stale.
+
         Args:
             lea_code (str): string of the seven digit number found next to your LEA name in the org select menu. For most LEAs,
             this is the CD part of the County-District-School (CDS) code. For independently reporting charters, it's the S.
@@ -838,99 +1249,240 @@ class CALPADSClient:
         Returns:
             None
         """
-        with self.session as session:
-            session.get(self.host)
-            page_root = etree.fromstring(self.visit_history[-1].text, parser=etree.HTMLParser(encoding='utf8'))
-            orgchange_form = page_root.xpath("//form[contains(@action, 'UserOrgChange')]")[0]
-            try:
-                org_form_val = (orgchange_form
-                                .xpath("//select/option[contains(text(), '{}')]".format(lea_code))[0]
-                                .attrib.get('value'))
-            except IndexError:
-                self.log.info("The provided lea_code, {}, does not appear to exist for you."
-                              .format(lea_code))
-                raise Exception("Unable to switch to the provided LEA Code")
+        # Restoring a shared session also restores the LEA it's working within
+        self._ensure_logged_in()
+        if lea_code == self._selected_lea and self._is_shared_lea(lea_code):
+            self.log.debug("Already working within LEA {}".format(lea_code))
+            return
+        with self.session:
+            # Use the cached form first; on a miss or a failed switch, refresh it from the homepage and try once more
+            for refresh in (self._org_change_form is None, True):
+                if refresh:
+                    self._org_change_form = parse_org_change_form(self._get(self.host).text)
+                action, org_options, request_token = self._org_change_form
+                try:
+                    org_form_val = find_org_value(org_options, lea_code)
+                except IndexError:
+                    if refresh:
+                        self.log.info("The provided lea_code, {}, does not appear to exist for you."
+                                      .format(lea_code))
+                        raise Exception("Unable to switch to the provided LEA Code")
+                    continue
+                try:
+                    response = self._post(urljoin(self.host, action),
+                                          data={'selectedItem': org_form_val,
+                                                '__RequestVerificationToken': request_token})
+                except SessionExpired:
+                    # The server-side session was reset along with the token, so refresh the form and try again
+                    continue
+                if response.status_code == 200:
+                    self._selected_lea = lea_code
+                    if self.session_store is not None:
+                        with self.session_store.lock(session_key(self.host, self.username)):
+                            self._save_session()
+                    return
+            self.log.info("Failed to switch to the provided lea_code, {}.".format(lea_code))
+            raise Exception("Unable to switch to the provided LEA Code")
+
+    def list_reports(self, is_snapshot=None, refresh=False):
+        """Returns the reports listed on the ODS and Snapshot report pages
+
+        The listings are fetched once and then served from the client's report catalog until its TTL expires.
+
+        Args:
+            is_snapshot (bool, optional): True for only Snapshot reports, False for only ODS reports.
+                Defaults to None, which returns both.
+            refresh (bool, optional): fetch the listings again even if the catalog is still fresh
 
-            request_token = orgchange_form.xpath("//input[@name='__RequestVerificationToken']")[0].get('value')
+        Returns:
+            list of ReportEntry namedtuples with the keys code, title, url, is_snapshot
+        """
+        if refresh or self.report_catalog.is_stale:
+            self._refresh_report_catalog()
+        return self.report_catalog.entries(is_snapshot)
 
-            session.post(urljoin(self.host, orgchange_form.attrib['action']),
-                         data={'selectedItem': org_form_val,
-                               '__RequestVerificationToken': request_token})
+    def _refresh_report_catalog(self):
+        """Fetch both report listings and re-index them"""
+        with self.session:
+            ods_page_text = self._get(urljoin(self.host, ODS_LISTING_PATH)).text
+            snapshot_page_text = self._get(urljoin(self.host, SNAPSHOT_LISTING_PATH)).text
+            self.report_catalog.load_listings(ods_page_text, snapshot_page_text, self.host)
 
     def _get_report_link(self, report_code, is_snapshot=False):
-        """Fetch and return the URL associated with the report_code"""
-        with self.session as session:
-            if is_snapshot:
-                session.get('https://www.calpads.org/Report/Snapshot')
-            else:
-                session.get('https://www.calpads.org/Report/ODS')
-            response = self.visit_history[-1]
-            if report_code == '8.1eoy3' and is_snapshot:
-                return 'https://www.calpads.org/Report/Snapshot/8_1_StudentProfileList_EOY3_'
-            else:
-                root = etree.fromstring(response.text, parser=etree.HTMLParser(encoding='utf8'))
-                elements = root.xpath("//*[@class='num-wrap-in']")
-                for element in elements:
-                    if report_code == element.text.lower():
-                        return urljoin(self.host, element.xpath('./../../a')[0].attrib['href'])
-                self.log.info("Failed to find the provided report code.")
+        """Return the URL associated with the report_code, using the report catalog"""
+        refreshed = self.report_catalog.is_stale
+        if refreshed:
+            self._refresh_report_catalog()
+        report = self.report_catalog.get(report_code, is_snapshot)
+        if report is None and not refreshed:
+            # The listing might have changed since the catalog was built
+            self._refresh_report_catalog()
+            report = self.report_catalog.get(report_code, is_snapshot)
+        if report is None:
+            self.log.info("Failed to find the provided report code.")
+            return None
+        return report.url
 
     def _handle_event_hooks(self, r, *args, **kwargs):
-        """This hook is executed with every HTPP request, primarily used to handle instances of OAuth Dance."""
+        """This hook is executed with every HTPP request. Pages other than the login dance's are kept in visit_history.
+
+        Logging in is driven by _complete_login rather than from here, so the hook never makes requests itself.
+        """
         self.log.debug(("Response STATUS CODE: {}\nChecking hooks for: \n{}\n"
                         .format(r.status_code, r.url)
                         )
                        )
-        scheme, netloc, path, query, frag = urlsplit(r.url)
-        if path == '/Account/Login' and r.status_code == 200:
-            self.log.debug("Handling /Account/Login")
-            self.session.cookies.update(r.cookies.get_dict()) #Update the cookies for future requests
-            init_root = etree.fromstring(r.text, parser=etree.HTMLParser(encoding='utf8'))
-            # Filling the login form
-            self.credentials['__RequestVerificationToken'] = (init_root
-                                                              .xpath("//input[@name='__RequestVerificationToken']")[0]
-                                                              .get('value'))
-
-            self.credentials['ReturnUrl'] = (init_root
-                                              .xpath("//input[@id='ReturnUrl']")[0]
-                                              .get('value'))
-
-            self.credentials['AgreementConfirmed'] = "True"
-
-            # self.log.debug(self.credentials)
-            # Was helpful in debugging bad username & password, but that should probably not hang out on the console :)
-            self.session.post(r.url,
-                              data=self.credentials
-                              )
-
-        elif path in ['/connect/authorize/callback', '/connect/authorize'] and r.status_code == 200:
-            self.log.debug("Handling /connect/authorize/callback")
-            self.session.cookies.update(r.cookies.get_dict()) #Update the cookies for future requests
-            login_root = etree.fromstring(r.text, parser=etree.HTMLParser(encoding='utf8'))
-
-            # Interstitial OpenID Page
-            openid_form_data = {input_.attrib.get('name'): input_.attrib.get("value") for input_ in login_root.xpath('//input')}
-            action_url = login_root.xpath('//form')[0].attrib.get('action')
-
-            #A check for the when to try to join on self.host
-            scheme, netloc, path, query, frag = urlsplit(action_url)
-            if (not scheme and not netloc):
-                self.session.post(urljoin(self.host, action_url),
-                                  data=openid_form_data
-                                )
-            else:
-                self.log.debug("Using the action URL from the OpenID interstitial page: {}"
-                               .format(action_url))
-                self.session.post(action_url,
-                                  data=openid_form_data
-                                  )
-        else:
-            self.log.debug("No response hook needed for: {}\n".format(r.url))
+        if not is_auth_page(r):
             self.visit_history.append(r)
-            return r
+        return r
+
+
+def is_auth_page(response):
+    """Whether a request was bounced to the login dance, so its response isn't the requested page"""
+    return urlsplit(response.url).path in LOGIN_PATHS
+
 
 def safe_json_load(response):
     try:
         return json.loads(response.content)
     except JSONDecodeError:
-        return {}
\ No newline at end of file
+        return {}
+
+
+# Extracts that don't follow the ODSExtract?RecordType= URL pattern
+EXTRACT_PAGES = {'SSID': '/Extract/SSIDExtract',
+                 'DIRECTCERTIFICATION': '/Extract/DirectCertificationExtract',
+                 'REJECTEDRECORDS': '/Extract/RejectedRecords',
+                 'CANDIDATELIST': '/Extract/CandidateList',
+                 'REPLACEMENTSSID': '/Extract/ReplacementSSID',
+                 'SPEDDISCREPANCYEXTRACT': '/Extract/SPEDDiscrepancyExtract',
+                 'DSEAEXTRACT': '/Extract/DSEAExtract'}
+
+# Extracts tied to a file submission job, which need a Submitter and JobID
+SUBMISSION_EXTRACTS = ('REJECTEDRECORDS', 'CANDIDATELIST', 'SPEDDISCREPANCYEXTRACT', 'SSID')
+
+
+def extract_page_path(extract_name):
+    """Returns the path of the request page for the (upper-cased) extract_name"""
+    #TODO: Let's add some more validation layers here. Maybe through a separate extract module like reports or
+    #a config file
+    return EXTRACT_PAGES.get(extract_name, '/Extract/ODSExtract?RecordType={}'.format(extract_name))
+
+
+def choose_extract_form(root, extract_name, by_date_range=False, by_as_of_date=False):
+    """Returns the form node on an extract request page matching the requested mode"""
+    #In the past, for SPED and SSRV extracts, CALPADS showed SELPA and NonSELPA form options.
+    #They have either removed or only show by permission levels, so we won't add that extra layer, for now.
+    if by_date_range:
+        try:
+            if extract_name != 'CENR':
+                return root.xpath('//form[contains(@action, "Extract") and contains(@action, "Date")]')[0]
+            else:
+                return root.xpath('//form[contains(@action, "Extract") and contains(@action, "DateRange")]')[0]
+        except IndexError:
+            logging.getLogger(__name__).info("There is no By Date Range request option. "
+                                             "Falling back to the default form option.")
+    elif extract_name == 'CENR' and by_as_of_date:
+        return root.xpath('//form[contains(@action, "Extract") and contains(@action, "AsofDate")]')[0]
+    return root.xpath('//form[contains(@action, "Extract") and not(contains(@action, "Date"))]')[0]
+
+
+def fill_extract_form(extracts_form, form_data, lea_code):
+    """Merges the form's prefilled fields with the user's form_data, returning the list of fields to submit"""
+    default_filled_fields = extracts_form.prefilled_fields.copy() #Safe to do shallow copy; list contents are immutable
+
+    # Remove any tuples in the default_filled_fields whose keys appear in the user-provided form_data list
+    keys_in_form_data = {key for key, _ in form_data}
+    keys_in_form_data.add('ReportingLEA') # This will be added below based on lea_code
+    filled_fields = [item for item in default_filled_fields if item[0] not in keys_in_form_data]
+    filled_fields.extend(list(form_data) + [('ReportingLEA', lea_code)])
+
+    # Text inputs are not able to submit multiple key values, particularly a problem for Date Range
+    return extracts_form._filter_text_input_fields(filled_fields)
+
+
+def extract_schema_name(extract_name, by_date_range=False, by_as_of_date=False):
+    """Names the extract form variant for the form schema cache, e.g. 'SENR:date_range'"""
+    extract_name = extract_name.upper()
+    if by_date_range:
+        variant = 'date_range'
+    elif extract_name == 'CENR' and by_as_of_date:
+        variant = 'as_of_date'
+    else:
+        variant = 'default'
+    return '{}:{}'.format(extract_name, variant)
+
+
+def report_schema_name(report_code, is_snapshot=False, url_override=None):
+    """Names the report form for the form schema cache, e.g. '8.1:snapshot'"""
+    return '{}:{}'.format(url_override or report_code.lower(), 'snapshot' if is_snapshot else 'ods')
+
+
+def is_extract_request_success(page_text):
+    """Checks the page returned after an extract request for CALPADS' success message"""
+    success_text = 'Extract request made successfully.  Please check back later for download.'
+    request_response = etree.fromstring(page_text, parser=etree.HTMLParser(encoding='utf8'))
+    try:
+        return success_text == request_response.xpath('//p')[0].text
+    except IndexError:
+        return False
+
+
+def parse_org_change_form(page_text):
+    """Finds the UserOrgChange form on the homepage
+
+    Returns:
+        tuple of the form's action, a tuple of (option text, option value) pairs for every org the user can select,
+        and the form's request verification token
+    """
+    page_root = etree.fromstring(page_text, parser=etree.HTMLParser(encoding='utf8'))
+    orgchange_form = page_root.xpath("//form[contains(@action, 'UserOrgChange')]")[0]
+    org_options = tuple((option.text or '', option.attrib.get('value'))
+                        for option in orgchange_form.xpath("//select/option"))
+    request_token = orgchange_form.xpath("//input[@name='__RequestVerificationToken']")[0].get('value')
+    return orgchange_form.attrib['action'], org_options, request_token
+
+
+def find_org_value(org_options, lea_code):
+    """Returns the org change form value whose option text contains lea_code
+
+    Raises:
+        IndexError: when the lea_code is not one of the user's organizations
+    """
+    return [value for text, value in org_options if lea_code in text][0]
+
+
+def get_report_iframe_url(page_text):
+    """Returns the src of the SSRS iframe embedded on a report page"""
+    report_page_root = etree.fromstring(page_text, parser=etree.HTMLParser(encoding='utf8'))
+    return report_page_root.xpath("//iframe[@src and not(contains(@src, 'KeepAlive'))]")[0].attrib['src']
+
+
+def check_extract_request_lea(lea_code, extract_request):
+    """Raises ValueError when extract_request was made for an LEA other than lea_code
+
+    The extract listing and download links are scoped to the selected LEA, so waiting on another LEA's extract
+    would never find it.
+    """
+    if extract_request is not None and str(extract_request.lea_code) != str(lea_code):
+        raise ValueError("The extract request {} was made for LEA {}, not {}"
+                         .format(extract_request.request_id, extract_request.lea_code, lea_code))
+
+
+def get_report_export_url(page_text, download_format, reports_host="https://reports.calpads.org"):
+    """Builds the direct download URL for a submitted report form, or returns None if it can't be found"""
+    # Regex for grabbing the base, direct download URL for the report
+    regex = re.compile('(?<="ExportUrlBase":")[^"]+(?=")')  # Look for text sandwiched between the lookbehind and
+    # the lookahead, but EXCLUDE the double quotes (i.e. find the first double quotes as the upper limit of the text)
+    match = regex.search(page_text)
+    if not match:
+        return None
+    scheme, netloc, path, query, frag = urlsplit(urljoin(reports_host, match.group(0))
+                                                 .replace('\\u0026', '&')
+                                                 .replace('%3a', ':')
+                                                 .replace('%2f', '/'))
+    split_query = parse_qsl(query)
+    if not split_query:
+        return None
+    split_query.append(('Format', REPORTS_DL_FORMAT[download_format.upper()]))
+    return urlunsplit([scheme, netloc, path, urlencode(split_query), frag])
\ No newline at end of file
@@ -0,0 +1,283 @@
+"""Columnar export of extracts and history lookups to Arrow and Parquet
+
+Loading extracts and `get_*_history` responses into a warehouse row by row, as dicts or caret-delimited
+lines, takes longer and more memory than downloading them. This module turns them into Arrow record batches
+a batch at a time instead, which write_parquet() and write_arrow() stream to disk without ever holding a
+whole extract.
+
+Extract batches follow the typed ExtractLayout (see extract_parser.py). Code fields repeat a handful of
+values over millions of rows, e.g. school codes, grade levels, and program codes, so they're dictionary
+encoded: each batch stores the distinct codes once and a small integer per row. Identifier codes such as
+SSIDs are nearly all distinct and stay plain strings.
+
+History responses have no published layout, so their values are kept as strings, with nested values as
+JSON text, which keeps one schema per endpoint across every student. A column is dictionary encoded when
+its first batch repeats its values often enough.
+
+Requires pyarrow. Try: pip install calpads[arrow]
+"""
+import json
+import logging
+import os
+from .downloads import DEFAULT_CHUNK_SIZE
+from .extract_parser import ExtractLayout, get_layout, iter_extract_columns
+
+DEFAULT_BATCH_SIZE = 65536
+
+# Code fields that identify a person or record rather than categorize it, so they aren't dictionary encoded
+IDENTIFIER_FIELDS = frozenset(['ssid', 'seid', 'migrant_student_id'])
+
+# History columns are dictionary encoded when their first batch has at most this many distinct values per row
+DICTIONARY_RATIO = 0.5
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Arrow and Parquet export requires pyarrow. Try: pip install calpads[arrow]")
+    return pyarrow
+
+
+def dictionary_fields(layout):
+    """Returns the names of the layout's fields that are dictionary encoded by default: its non-identifier codes"""
+    return frozenset(name for name, field_type in layout.fields
+                     if field_type == 'code' and name not in IDENTIFIER_FIELDS)
+
+
+def arrow_schema(layout, dictionary=None):
+    """Returns the pyarrow.Schema of the record batches for an ExtractLayout
+
+    Args:
+        layout (ExtractLayout): the extract's layout
+        dictionary (iterable of str, optional): the fields to dictionary encode. Defaults to dictionary_fields(layout).
+    """
+    pa = _import_pyarrow()
+    dictionary = dictionary_fields(layout) if dictionary is None else frozenset(dictionary)
+    types = {'str': pa.string(),
+             'code': pa.string(),
+             'date': pa.date32(),
+             'int': pa.int64(),
+             'decimal': pa.float64(),
+             'flag': pa.bool_()}
+    return pa.schema([(name, pa.dictionary(pa.int32(), pa.string()) if name in dictionary else types[field_type])
+                      for name, field_type in layout.fields])
+
+
+def columns_to_arrow(layout, columns, dictionary=None):
+    """Returns a pyarrow.RecordBatch for columns, a sequence of value sequences in the layout's field order
+
+    Args:
+        layout (ExtractLayout): the extract's layout
+        columns (sequence of sequences): one sequence of parsed values per field
+        dictionary (iterable of str, optional): the fields to dictionary encode. Defaults to dictionary_fields(layout).
+    """
+    pa = _import_pyarrow()
+    schema = arrow_schema(layout, dictionary)
+    arrays = []
+    for field, values in zip(schema, columns):
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def extract_record_batches(source, record_type=None, batch_size=DEFAULT_BATCH_SIZE, dictionary=None,
+                           chunk_size=DEFAULT_CHUNK_SIZE, encoding='utf-8'):
+    """Stream an extract as Arrow record batches
+
+    Args:
+        source (str, path-like, bytes, file-like, or iterable of bytes): see extract_parser.iter_lines(), e.g. a
+            downloaded extract or a streaming response's iter_content()
+        record_type (str or ExtractLayout, optional): see extract_parser.iter_extract_records()
+        batch_size (int, optional): the most rows in each batch
+        dictionary (iterable of str, optional): the fields to dictionary encode. Defaults to dictionary_fields(layout).
+        chunk_size (int, optional): the bytes read at a time from a path or file-like object
+        encoding (str, optional): the text encoding of the extract
+
+    Returns:
+        a generator of pyarrow.RecordBatch, all with the same schema
+    """
+    _import_pyarrow()
+    layout = record_type if isinstance(record_type, ExtractLayout) else None
+    for batch in iter_extract_columns(source, record_type, batch_size, chunk_size, encoding):
+        if layout is None:
+            layout = get_layout(batch['record_type_code'][0])
+        yield columns_to_arrow(layout, list(batch.values()), dictionary)
+
+
+def _history_value(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return json.dumps(value)
+
+
+class HistoryBatcher:
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE):
+        """Collects history lookups into one record batch schema per endpoint
+
+        The first batch of an endpoint fixes its schema: an identifier column followed by the keys of its rows,
+        with the repetitive columns dictionary encoded. Keys that only show up later are dropped with a warning.
+
+        Args:
+            batch_size (int, optional): the rows buffered per endpoint before its batch is built
+        """
+        self.batch_size = batch_size
+        self.schemas = dict()
+        self._rows = dict()
+        self._dropped = dict()
+        self.log = logging.getLogger(__name__)
+
+    def add(self, identifier, endpoint, data):
+        """Buffer the Data rows of one history response. Returns the endpoint's batch once batch_size rows are
+        buffered, else None."""
+        rows = self._rows.setdefault(endpoint, [])
+        for row in (data or dict()).get('Data') or []:
+            rows.append((identifier, row))
+        if len(rows) >= self.batch_size:
+            return self._build(endpoint)
+        return None
+
+    def flush(self):
+        """Returns a (endpoint, batch) pair for every endpoint with buffered rows"""
+        return [(endpoint, self._build(endpoint)) for endpoint, rows in list(self._rows.items()) if rows]
+
+    def _build(self, endpoint):
+        pa = _import_pyarrow()
+        rows = self._rows.pop(endpoint)
+        schema = self.schemas.get(endpoint)
+        names = schema.names[1:] if schema is not None else list(dict.fromkeys(key for _, row in rows for key in row))
+        if schema is not None:
+            extra = {key for _, row in rows for key in row}.difference(names, self._dropped.get(endpoint, ()))
+            if extra:
+                self._dropped.setdefault(endpoint, set()).update(extra)
+                self.log.warning("Dropping the {} history columns missing from its first batch: {}"
+                                 .format(endpoint, ', '.join(sorted(extra))))
+        columns = [[str(identifier) for identifier, _ in rows]]
+        columns.extend([_history_value(row.get(name)) for _, row in rows] for name in names)
+        if schema is None:
+            fields = [pa.field('identifier', pa.string())]
+            for name, values in zip(names, columns[1:]):
+                repetitive = len(set(values)) <= DICTIONARY_RATIO * len(values)
+                fields.append(pa.field(name, pa.dictionary(pa.int32(), pa.string()) if repetitive else pa.string()))
+            schema = self.schemas[endpoint] = pa.schema(fields)
+        arrays = []
+        for field, values in zip(schema, columns):
+            array = pa.array(values, type=pa.string())
+            arrays.append(array.dictionary_encode() if pa.types.is_dictionary(field.type) else array)
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def history_record_batches(results, batch_size=DEFAULT_BATCH_SIZE):
+    """Stream history lookups as Arrow record batches, one schema per endpoint
+
+    Args:
+        results (iterable): calpads.bulk.BulkResult namedtuples, e.g. from client.fetch_histories(), or
+            (identifier, endpoint, data) tuples. Results with an error are logged and skipped.
+        batch_size (int, optional): the most rows in each batch
+
+    Returns:
+        a generator of (endpoint, pyarrow.RecordBatch) pairs
+    """
+    batcher = HistoryBatcher(batch_size)
+    log = logging.getLogger(__name__)
+    for result in results:
+        identifier, endpoint, data = result[:3]
+        error = result[3] if len(result) > 3 else None
+        if error is not None:
+            log.warning("Skipping the {} history of {}: {!r}".format(endpoint, identifier, error))
+            continue
+        batch = batcher.add(identifier, endpoint, data)
+        if batch is not None:
+            yield endpoint, batch
+    yield from batcher.flush()
+
+
+def write_parquet(batches, path, compression='zstd'):
+    """Write record batches with one schema to a Parquet file a batch at a time
+
+    Args:
+        batches (iterable of pyarrow.RecordBatch): e.g. from extract_record_batches()
+        path (str or path-like): the Parquet file to write
+        compression (str, optional): the Parquet compression codec
+
+    Returns:
+        int: the rows written. No file is written when there are no batches.
+    """
+    _import_pyarrow()
+    import pyarrow.parquet as pq
+    writer = None
+    rows = 0
+    try:
+        for batch in batches:
+            if writer is None:
+                writer = pq.ParquetWriter(path, batch.schema, compression=compression)
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def write_arrow(batches, path):
+    """Write record batches with one schema to an Arrow IPC stream file a batch at a time
+
+    The stream format is used because every batch carries its own dictionaries, which the IPC file format
+    doesn't allow. Read it back with pyarrow.ipc.open_stream().
+
+    Args:
+        batches (iterable of pyarrow.RecordBatch): e.g. from extract_record_batches()
+        path (str or path-like): the file to write
+
+    Returns:
+        int: the rows written. No file is written when there are no batches.
+    """
+    pa = _import_pyarrow()
+    writer = sink = None
+    rows = 0
+    try:
+        for batch in batches:
+            if writer is None:
+                sink = pa.OSFile(os.fspath(path), 'wb')
+                writer = pa.ipc.new_stream(sink, batch.schema)
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+            sink.close()
+    return rows
+
+
+def write_history_parquet(results, directory, batch_size=DEFAULT_BATCH_SIZE, compression='zstd'):
+    """Write history lookups to one Parquet file per endpoint, named <endpoint>.parquet
+
+    Args:
+        results (iterable): see history_record_batches()
+        directory (str or path-like): where the files are written. Created if it doesn't exist.
+        batch_size (int, optional): the most rows in each batch
+        compression (str, optional): the Parquet compression codec
+
+    Returns:
+        dict: {endpoint: path of its Parquet file}
+    """
+    _import_pyarrow()
+    import pyarrow.parquet as pq
+    os.makedirs(directory, exist_ok=True)
+    writers = dict()
+    paths = dict()
+    try:
+        for endpoint, batch in history_record_batches(results, batch_size):
+            if endpoint not in writers:
+                paths[endpoint] = os.path.join(directory, '{}.parquet'.format(endpoint))
+                writers[endpoint] = pq.ParquetWriter(paths[endpoint], batch.schema, compression=compression)
+            writers[endpoint].write_batch(batch)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return paths
@@ -0,0 +1,328 @@
+"""A content-addressed, compressed store of downloaded extracts and reports
+
+Daily pulls add up: every download_extract() or download_report() call writes a fresh, uncompressed file, and
+most days' files are byte-for-byte the same as the day before. The DownloadStore compresses a download while it
+streams and names the compressed file after the SHA-256 of its content, so a download identical to one already
+stored takes no extra space. A manifest records every download, whether it was new or a duplicate, and indexes
+it by LEA, kind (extract or report), extract or report name, request ID, and time.
+
+Layout of the store's directory:
+
+    objects/ab/abcdef...0123.zst    the compressed content, named by the SHA-256 of the uncompressed bytes
+    tmp/                            downloads in progress, renamed into objects/ once their hash is known
+    manifest.d/<host>-<pid>-<id>.jsonl
+                                    one manifest segment per open DownloadStore: a JSON line per download it
+                                    recorded, only ever appended to
+
+The manifest is a directory of JSON Lines files rather than a database, since SQLite's locking can't be trusted
+on a shared NFS volume. Neither can appends to one shared file: NFS doesn't make O_APPEND writes atomic, so
+lines from different hosts could overwrite each other. Every DownloadStore instead appends to a segment of its
+own, which no other writer touches, and the manifest is the merge of all the segments, ordered by download time.
+Each process reads the segments into memory when the store is opened; reload() picks up downloads added by
+other processes since. A line that can't be parsed, e.g. one left damaged by a crash, is logged and skipped.
+
+zstd compression needs zstandard (pip install calpads[zstd]). Without it, downloads are gzipped. Stored files
+can be read back with open(), which decompresses them on the fly.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import namedtuple
+from urllib.parse import urlparse, parse_qs
+
+COMPRESSION_EXTENSIONS = {'zstd': '.zst', 'gzip': '.gz'}
+
+DownloadEntry = namedtuple('DownloadEntry', ['digest', 'size', 'stored_size', 'compression', 'kind', 'lea_code',
+                                             'name', 'request_id', 'downloaded_at', 'duplicate'])
+DownloadEntry.__doc__ = """A download recorded in the manifest. digest is the SHA-256 hex digest of the uncompressed
+content; size and stored_size are its uncompressed and compressed bytes; kind is 'extract' or 'report'; name is the
+extract or report name, e.g. 'SENR' or '1.1'; downloaded_at is a Unix timestamp; duplicate is True when the same
+content was already stored."""
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression requires zstandard. Try: pip install calpads[zstd]")
+    return zstandard
+
+
+def default_compression():
+    """'zstd' when zstandard is installed, else 'gzip'"""
+    try:
+        _zstandard()
+    except ImportError:
+        return 'gzip'
+    return 'zstd'
+
+
+class StoreWriter:
+
+    def __init__(self, store, kind, lea_code, name, request_id=None):
+        """A writable binary file-like object that compresses and hashes what is written to a temporary file
+
+        Pass it as the file_name of a download, then commit() it to add it to the store or abort() to discard it.
+        As a context manager, it's committed when the block succeeds and aborted when it raises.
+        """
+        self.store = store
+        self.kind = kind
+        self.lea_code = lea_code
+        self.name = name
+        self.request_id = request_id
+        self.compression = store.compression
+        self.size = 0
+        self.closed = False
+        self._hasher = hashlib.sha256()
+        self._tmp_path = os.path.join(store.root, 'tmp', '{}{}'.format(uuid.uuid4().hex,
+                                                                      COMPRESSION_EXTENSIONS[self.compression]))
+        self._raw = open(self._tmp_path, 'wb')
+        if self.compression == 'zstd':
+            self._compressed = _zstandard().ZstdCompressor(level=store.level or 3).stream_writer(self._raw)
+        else:
+            # mtime=0 so identical content compresses to identical bytes
+            self._compressed = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=store.level or 6, mtime=0)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._hasher.update(data)
+        self.size += len(data)
+        self._compressed.write(data)
+        return len(data)
+
+    def _close_files(self):
+        if not self.closed:
+            self.closed = True
+            self._compressed.close()
+            if not self._raw.closed:
+                self._raw.close()
+
+    def commit(self, request_id=None):
+        """Finish the download and add it to the store. Returns its DownloadEntry."""
+        self._close_files()
+        if request_id is not None:
+            self.request_id = request_id
+        return self.store._add(self, self._hasher.hexdigest(), self._tmp_path)
+
+    def abort(self):
+        """Discard the download"""
+        self._close_files()
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and not self.closed:
+            self.commit()
+        elif exc_type is not None:
+            self.abort()
+
+
+class DownloadStore:
+
+    def __init__(self, root, compression=None, level=None):
+        """A content-addressed store of compressed downloads with a manifest
+
+        Args:
+            root (str): the store's directory. Created if it doesn't exist.
+            compression (str, optional): 'zstd' or 'gzip'. Defaults to zstd when zstandard is installed.
+            level (int, optional): the compression level. Defaults to 3 for zstd and 6 for gzip.
+        """
+        compression = compression or default_compression()
+        if compression not in COMPRESSION_EXTENSIONS:
+            raise ValueError("compression must be one of: {}".format(', '.join(COMPRESSION_EXTENSIONS)))
+        if compression == 'zstd':
+            _zstandard()
+        self.root = root
+        self.compression = compression
+        self.level = level
+        self.manifest_dir = os.path.join(root, 'manifest.d')
+        # This store's own segment, created with its first download
+        self.manifest_path = os.path.join(self.manifest_dir, '{}-{}-{}.jsonl'.format(
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex))
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'tmp'), exist_ok=True)
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        self.entries = []
+        # The bytes of each manifest segment read so far
+        self._manifest_offsets = {}
+        self._lock = threading.Lock()
+        self.log = logging.getLogger(__name__)
+        self.reload()
+
+    def reload(self):
+        """Read the manifest lines added to any segment since the store was opened or last reloaded"""
+        with self._lock:
+            paths = [os.path.join(self.manifest_dir, name) for name in sorted(os.listdir(self.manifest_dir))
+                     if name.endswith('.jsonl')]
+            added = 0
+            for path in paths:
+                added += self._read_segment(path)
+            if added:
+                # Segments are read one after another, so restore the oldest first order across them
+                self.entries.sort(key=lambda entry: entry.downloaded_at)
+
+    def _read_segment(self, path):
+        offset = self._manifest_offsets.get(path, 0)
+        added = 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # The segment's writer is mid-append; the line is read on a later reload()
+                    break
+                offset += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    self.entries.append(DownloadEntry(**json.loads(line.decode('utf8'))))
+                except (ValueError, TypeError) as e:
+                    self.log.warning("Skipping an unreadable line of manifest segment {}: {}".format(path, e))
+                    continue
+                added += 1
+        self._manifest_offsets[path] = offset
+        return added
+
+    def writer(self, kind, lea_code, name, request_id=None):
+        """Returns a StoreWriter for a download
+
+        Args:
+            kind (str): 'extract' or 'report'
+            lea_code (str): the LEA the download is for
+            name (str): the extract or report name, e.g. 'SENR' or '1.1'
+            request_id (str, optional): e.g. the ExtractRequestID. Can also be given to commit().
+        """
+        return StoreWriter(self, kind, lea_code, name, request_id)
+
+    def path(self, digest):
+        """Returns the path of the stored content with digest, or None when it isn't stored"""
+        for extension in COMPRESSION_EXTENSIONS.values():
+            path = os.path.join(self.root, 'objects', digest[:2], digest + extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def open(self, entry):
+        """Returns a binary file object that reads the decompressed content of a DownloadEntry or digest
+
+        e.g. iter_extract_records(store.open(store.latest('1234567', 'SENR')))
+        """
+        digest = entry.digest if isinstance(entry, DownloadEntry) else entry
+        path = self.path(digest)
+        if path is None:
+            raise FileNotFoundError("{} isn't in the download store".format(digest))
+        if path.endswith(COMPRESSION_EXTENSIONS['zstd']):
+            return _zstandard().ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return gzip.open(path, 'rb')
+
+    def find(self, lea_code=None, kind=None, name=None, request_id=None, since=None, until=None):
+        """Returns the manifest entries matching every given criterion, oldest first
+
+        Args:
+            lea_code (str, optional)
+            kind (str, optional): 'extract' or 'report'
+            name (str, optional): e.g. 'SENR' or '1.1'. Case insensitive.
+            request_id (str, optional)
+            since (float, optional): the earliest downloaded_at, as a Unix timestamp
+            until (float, optional): the latest downloaded_at, exclusive
+        """
+        name = name.upper() if name else name
+        return [entry for entry in self.entries
+                if (lea_code is None or entry.lea_code == str(lea_code))
+                and (kind is None or entry.kind == kind)
+                and (name is None or entry.name == name)
+                and (request_id is None or entry.request_id == str(request_id))
+                and (since is None or entry.downloaded_at >= since)
+                and (until is None or entry.downloaded_at < until)]
+
+    def latest(self, lea_code, name, kind='extract'):
+        """Returns the most recent DownloadEntry of name for lea_code, or None"""
+        entries = self.find(lea_code=lea_code, kind=kind, name=name)
+        return entries[-1] if entries else None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def download_extract(self, client, lea_code, extract_request=None, extract_name=None, **kwargs):
+        """Download an extract with client.download_extract() straight into the store
+
+        Args:
+            client (CALPADSClient): the client to download with
+            lea_code (str): the LEA to download for
+            extract_request (ExtractRequest, optional): see CALPADSClient.download_extract()
+            extract_name (str, optional): recorded in the manifest. Required without an extract_request.
+            **kwargs: passed on to client.download_extract()
+
+        Returns:
+            DownloadEntry, or None when the download failed
+        """
+        if extract_request is not None:
+            extract_name = extract_name or extract_request.extract_name
+        if not extract_name:
+            raise ValueError("An extract_name is needed to record the download without an extract_request")
+        with self.writer('extract', lea_code, extract_name) as writer:
+            if not client.download_extract(lea_code, file_name=writer, extract_request=extract_request, **kwargs):
+                writer.abort()
+                return None
+            request_id = getattr(extract_request, 'request_id', None)
+            if request_id is None and client.last_download is not None:
+                request_id = (parse_qs(urlparse(client.last_download.url or '').query)
+                              .get('ExtractRequestID', [None])[0])
+            return writer.commit(request_id)
+
+    def download_report(self, client, lea_code, report_code, **kwargs):
+        """Download a report with client.download_report() straight into the store
+
+        Args:
+            client (CALPADSClient): the client to download with
+            lea_code (str): the LEA to download for
+            report_code (str): e.g. '1.1'
+            **kwargs: passed on to client.download_report(), e.g. form_data
+
+        Returns:
+            DownloadEntry, or None when the download failed
+        """
+        with self.writer('report', lea_code, report_code) as writer:
+            if client.download_report(lea_code, report_code, file_name=writer, **kwargs) is not True:
+                writer.abort()
+                return None
+            return writer.commit()
+
+    def _add(self, writer, digest, tmp_path):
+        object_dir = os.path.join(self.root, 'objects', digest[:2])
+        os.makedirs(object_dir, exist_ok=True)
+        existing = self.path(digest)
+        if existing is not None:
+            os.remove(tmp_path)
+            stored_size = os.path.getsize(existing)
+            self.log.info("The {} {} download is identical to one already stored".format(writer.lea_code,
+                                                                                        writer.name))
+        else:
+            stored_size = os.path.getsize(tmp_path)
+            # Renamed within one filesystem, so a reader never sees a partly written object
+            os.replace(tmp_path, os.path.join(object_dir, digest + COMPRESSION_EXTENSIONS[writer.compression]))
+        entry = DownloadEntry(digest, writer.size, stored_size, writer.compression, writer.kind, str(writer.lea_code),
+                              str(writer.name).upper(),
+                              None if writer.request_id is None else str(writer.request_id),
+                              time.time(), existing is not None)
+        line = (json.dumps(entry._asdict(), sort_keys=True) + '\n').encode('utf8')
+        with self._lock:
+            # The segment is only written by this store, and the lock keeps its threads' lines whole
+            with open(self.manifest_path, 'ab') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        self.reload()
+        return entry
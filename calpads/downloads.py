@@ -0,0 +1,94 @@
+"""Helpers for streaming downloads to disk or any writable file-like object
+
+Extracts and reports can be hundreds of megabytes, so rather than buffering a response's whole body
+in memory, the clients write it chunk by chunk to a sink and keep track of the number of bytes written
+and, optionally, a checksum computed on the fly.
+"""
+import hashlib
+import os
+from collections import namedtuple
+from contextlib import contextmanager
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+DownloadStats = namedtuple('DownloadStats', ['url', 'bytes_written', 'checksum'])
+DownloadStats.__doc__ = """Summary of a streamed download. checksum is a hex digest, or None if one wasn't requested."""
+
+
+class DownloadCounter:
+
+    def __init__(self, checksum=None):
+        """Counts bytes and optionally hashes them as chunks go by
+
+        Args:
+            checksum (str, optional): the name of any hashlib algorithm, e.g. 'sha256' or 'md5'
+        """
+        self.bytes_written = 0
+        self.hasher = hashlib.new(checksum) if checksum else None
+
+    def update(self, chunk):
+        self.bytes_written += len(chunk)
+        if self.hasher is not None:
+            self.hasher.update(chunk)
+
+    def stats(self, url=None):
+        return DownloadStats(url, self.bytes_written, self.hasher.hexdigest() if self.hasher is not None else None)
+
+
+@contextmanager
+def open_sink(sink):
+    """Yields a writable binary file object for sink
+
+    Args:
+        sink (str, path-like, or file-like): a path is opened with open(sink, 'wb') and closed afterwards. If the
+            block raises, the partly written file is deleted. Anything with a write method is used as is and left
+            open for the caller.
+    """
+    if hasattr(sink, 'write'):
+        yield sink
+        return
+    # Opened outside the try, so a file that couldn't be opened, e.g. a read-only one, is never removed
+    f = open(sink, 'wb')
+    try:
+        with f:
+            yield f
+    except BaseException:
+        # A truncated download must not pass for a complete one
+        try:
+            os.remove(sink)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_chunks(chunks, sink, checksum=None, url=None):
+    """Write an iterable of bytes chunks to sink
+
+    Args:
+        chunks (iterable of bytes): e.g. response.iter_content(chunk_size)
+        sink (str, path-like, or file-like): see open_sink()
+        checksum (str, optional): the name of a hashlib algorithm to compute while writing
+        url (str, optional): recorded in the returned stats
+
+    Returns:
+        DownloadStats
+    """
+    counter = DownloadCounter(checksum)
+    with open_sink(sink) as f:
+        for chunk in chunks:
+            if chunk:
+                f.write(chunk)
+                counter.update(chunk)
+    return counter.stats(url)
+
+
+def stream_response(response, sink, chunk_size=DEFAULT_CHUNK_SIZE, checksum=None):
+    """Stream a requests.Response (ideally requested with stream=True) to sink, then release the connection
+
+    Returns:
+        DownloadStats
+    """
+    try:
+        return write_chunks(response.iter_content(chunk_size), sink, checksum, response.url)
+    finally:
+        response.close()
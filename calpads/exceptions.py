@@ -0,0 +1,20 @@
+"""Exceptions raised by the calpads package
+
+They all subclass CALPADSError, which itself is an Exception, so code catching Exception keeps working.
+"""
+
+
+class CALPADSError(Exception):
+    """Base class for errors raised by the calpads package"""
+
+
+class ReportNotFound(CALPADSError):
+    """The report code could not be found on the ODS or Snapshot report listings"""
+
+
+class SessionExpired(CALPADSError):
+    """The session expired while a request that can't safely be replayed was in flight"""
+
+
+class AuthenticationError(CALPADSError):
+    """Logging in to CALPADS failed, e.g. because the credentials were rejected"""
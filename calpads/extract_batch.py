@@ -0,0 +1,141 @@
+"""Batch downloading of many requested extracts
+
+CALPADS generates requested extracts in parallel on its end, so waiting on them one at a time makes the
+wall time the sum of all of them. iter_extract_downloads() watches the extract listing of each LEA
+involved in a single poll loop and starts streaming every extract on a worker thread as soon as it is
+complete, so the wall time is roughly that of the slowest extract.
+
+The download links only work within the selected LEA, which is state of the client's session shared by every
+worker thread. Downloads therefore run one LEA at a time: a completed extract of another LEA waits until the
+running downloads are done and its LEA has been selected.
+"""
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .downloads import DEFAULT_CHUNK_SIZE
+from .exceptions import CALPADSError
+from .extract_requests import is_extract_complete, is_extract_failed, backoff_delays
+
+ExtractDownload = namedtuple('ExtractDownload', ['extract_request', 'sink', 'stats', 'error'])
+ExtractDownload.__doc__ = """The outcome of downloading one ExtractRequest. stats is a DownloadStats when error is None."""
+
+
+class ExtractFailed(CALPADSError):
+    """CALPADS reported that generating a requested extract failed"""
+
+
+def default_extract_file_name(extract_request, directory='.'):
+    """e.g. ./1234567_SENR_98765.txt"""
+    return os.path.join(directory, '{}_{}_{}.txt'.format(extract_request.lea_code, extract_request.extract_name,
+                                                         extract_request.request_id))
+
+
+def iter_extract_downloads(client, extract_requests, sink_for, timeout=1800, poll=5, max_poll=60,
+                           max_workers=4, chunk_size=DEFAULT_CHUNK_SIZE, checksum=None):
+    """Wait on many ExtractRequest handles at once, streaming each extract as soon as it completes
+
+    Args:
+        client (CALPADSClient): the client that requested the extracts
+        extract_requests (iterable of ExtractRequest): the handles returned by request_extract()
+        sink_for (callable): takes an ExtractRequest (with its request_id set) and returns the path or writable
+            file-like object to stream it to
+        timeout (float): the overall deadline in seconds for every extract to complete
+        poll (float): the first delay between polls of the listing; it backs off up to max_poll and resets whenever
+            an extract completes
+        max_poll (float): the longest delay between polls
+        max_workers (int): the most extracts downloaded at the same time
+        chunk_size (int): the size of the chunks streamed to each sink
+        checksum (str, optional): the name of a hashlib algorithm to compute for each download
+
+    Returns:
+        a generator of ExtractDownload namedtuples in the order the downloads finish
+    """
+    pending = [extract_request for extract_request in extract_requests if extract_request]
+    # Completed extracts waiting for their LEA to be selected
+    ready = []
+    deadline = time.time() + timeout
+    delays = backoff_delays(poll, max_poll)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        downloads = dict()
+        while pending:
+            # One listing request per LEA covers every pending extract in it
+            for lea_code in sorted({extract_request.lea_code for extract_request in pending}):
+                rows = client.get_requested_extracts(lea_code).get('Data') or []
+                for extract_request in [r for r in pending if r.lea_code == lea_code]:
+                    row = client._extract_ids.resolve(extract_request, rows)
+                    if row is None:
+                        continue
+                    if is_extract_complete(row):
+                        pending.remove(extract_request)
+                        ready.append(extract_request)
+                    elif is_extract_failed(row):
+                        pending.remove(extract_request)
+                        yield ExtractDownload(extract_request, None, None,
+                                              ExtractFailed("Extract request {} has status {}"
+                                                            .format(extract_request.request_id,
+                                                                    row.get('ExtractStatus'))))
+            started_download = yield from _start_downloads(client, ready, downloads, executor, sink_for,
+                                                           chunk_size, checksum)
+            if not pending:
+                break
+            if started_download:
+                delays = backoff_delays(poll, max_poll)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                for extract_request in pending:
+                    yield ExtractDownload(extract_request, None, None,
+                                          TimeoutError("Timed out waiting on {}".format(extract_request)))
+                break
+            wake_at = time.time() + min(next(delays), remaining)
+            # Report downloads as soon as they finish while waiting for the next poll
+            while downloads and time.time() < wake_at:
+                done, _ = wait(downloads, timeout=wake_at - time.time(), return_when=FIRST_COMPLETED)
+                yield from _collect(downloads, done)
+                yield from _start_downloads(client, ready, downloads, executor, sink_for, chunk_size, checksum)
+            time.sleep(max(0, wake_at - time.time()))
+        while downloads or ready:
+            yield from _start_downloads(client, ready, downloads, executor, sink_for, chunk_size, checksum)
+            done, _ = wait(downloads, return_when=FIRST_COMPLETED)
+            yield from _collect(downloads, done)
+
+
+def _start_downloads(client, ready, downloads, executor, sink_for, chunk_size, checksum):
+    """Start streaming the ready extracts that can run within the selected LEA. Returns whether any started.
+
+    The selected LEA is session state that the worker threads share, so it's only switched while no download is
+    running: extracts of the LEA being downloaded from start right away, and the rest wait until it's done. Yields
+    an ExtractDownload with the error for each ready extract of an LEA that couldn't be selected.
+    """
+    started = False
+    while ready:
+        if downloads:
+            lea_code = next(iter(downloads.values()))[0].lea_code
+        else:
+            lea_code = ready[0].lea_code
+            try:
+                client._select_lea(lea_code)
+            except Exception as e:
+                for extract_request in [r for r in ready if r.lea_code == lea_code]:
+                    ready.remove(extract_request)
+                    yield ExtractDownload(extract_request, None, None, e)
+                continue
+        batch = [r for r in ready if r.lea_code == lea_code]
+        if not batch:
+            break
+        for extract_request in batch:
+            ready.remove(extract_request)
+            sink = sink_for(extract_request)
+            future = executor.submit(client._stream_extract, extract_request.request_id, sink, chunk_size, checksum)
+            downloads[future] = (extract_request, sink)
+        started = True
+    return started
+
+
+def _collect(downloads, done):
+    for future in done:
+        extract_request, sink = downloads.pop(future)
+        try:
+            yield ExtractDownload(extract_request, sink, future.result(), None)
+        except Exception as e:
+            yield ExtractDownload(extract_request, sink, None, e)
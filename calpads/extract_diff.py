@@ -0,0 +1,219 @@
+"""Streaming diff of two extracts of the same record type
+
+Pulling SENR or SELA every day is mostly about finding what changed since yesterday. ExtractDiff compares
+two downloaded extracts record by record, matching records by the record type's natural key (e.g. SSID,
+school, and enrollment start date for SENR), and yields the added, removed, and changed records, with the
+changed fields' old and new values.
+
+Neither extract is ever held in memory whole. Both are streamed once and their lines spilled to partition
+files by a hash of the natural key, so a record and its counterpart always land in the same partition. The
+partitions are then diffed one at a time, holding only one partition of the old extract in a dict, so memory
+is bounded by the partition size rather than the extract size. Lines that are identical apart from ignored
+fields are matched without being parsed; only changed records are converted to typed values.
+
+Records sharing a natural key are paired in file order. A record type without a known natural key is keyed
+by all of its fields, so its changes come out as a removal and an addition.
+"""
+import logging
+import os
+import zlib
+from collections import Counter, namedtuple
+from tempfile import TemporaryDirectory
+from .downloads import DEFAULT_CHUNK_SIZE
+from .extract_parser import DELIMITER, ExtractLayout, ExtractParseError, get_layout, is_header, iter_lines
+
+# The fields that identify a record of each record type, following the CALPADS File Specification
+NATURAL_KEYS = {'SENR': ('ssid', 'school_of_attendance', 'enrollment_start_date'),
+                'SINF': ('ssid', 'effective_start_date'),
+                'SELA': ('ssid', 'english_language_acquisition_status_start_date'),
+                'SPRG': ('ssid', 'school_of_attendance', 'education_program_code',
+                         'education_program_membership_start_date'),
+                'SCSE': ('ssid', 'school_of_attendance', 'local_assigned_course_id', 'course_section_id',
+                         'academic_term_code'),
+                'SCSC': ('ssid', 'school_of_attendance', 'local_assigned_course_id', 'course_section_id',
+                         'academic_term_code', 'marking_period_code'),
+                'STAS': ('ssid', 'school_of_attendance', 'academic_year_id'),
+                'CRSC': ('school_of_attendance', 'local_assigned_course_id', 'course_section_id',
+                         'academic_term_code')}
+
+# The bytes of the old extract diffed in memory at a time. Parsed lines take several times their size.
+DEFAULT_PARTITION_BYTES = 64 * 1024 * 1024
+
+RecordChange = namedtuple('RecordChange', ['change', 'key', 'old', 'new', 'deltas'])
+RecordChange.__doc__ = """One difference between two extracts. change is 'added', 'removed', or 'changed'; key is
+the natural key's values; old and new are the typed records, None when added or removed; deltas is a dict of
+{field name: (old value, new value)} for changed records and empty otherwise."""
+
+
+class ExtractDiff:
+
+    def __init__(self, old, new, record_type=None, key_fields=None, ignore_fields=(), partitions=None,
+                 partition_bytes=DEFAULT_PARTITION_BYTES, tmp_dir=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 encoding='utf-8'):
+        """Diff two extracts of one record type. Iterate over it for the RecordChange tuples.
+
+        Args:
+            old (str, path-like, bytes, file-like, or iterable of bytes): the earlier extract, see
+                extract_parser.iter_lines()
+            new (str, path-like, bytes, file-like, or iterable of bytes): the later extract
+            record_type (str or ExtractLayout, optional): the extracts' record type, e.g. 'SENR', or a custom layout.
+                Defaults to the record type code of the first row.
+            key_fields (iterable of str, optional): the fields that identify a record. Defaults to the record type's
+                NATURAL_KEYS entry.
+            ignore_fields (iterable of str, optional): fields whose differences don't count, e.g. local_record_id
+            partitions (int, optional): the number of hash partitions. Defaults to enough partitions to keep each
+                to about partition_bytes of the old extract, or 16 when its size isn't known. With one partition
+                nothing is spilled to disk.
+            partition_bytes (int, optional): see partitions
+            tmp_dir (str, optional): where the partition files are written. Defaults to the system temp directory.
+            chunk_size (int, optional): the bytes read at a time from a path or file-like object
+            encoding (str, optional): the text encoding of the extracts
+        """
+        self.old = old
+        self.new = new
+        self.log = logging.getLogger(__name__)
+        self.layout = None
+        if isinstance(record_type, ExtractLayout):
+            self.layout = record_type
+        elif record_type:
+            self.layout = get_layout(record_type)
+        self.key_fields = tuple(key_fields) if key_fields else None
+        self.ignore_fields = frozenset(ignore_fields)
+        if self.layout is not None:
+            self._use_layout(self.layout)
+        if partitions is None:
+            if isinstance(old, (bytes, bytearray)):
+                partitions = max(1, -(-len(old) // partition_bytes))
+            elif isinstance(old, (str, os.PathLike)):
+                partitions = max(1, -(-os.path.getsize(old) // partition_bytes))
+            else:
+                partitions = 16
+        self.partitions = partitions
+        self.tmp_dir = tmp_dir
+        self.chunk_size = chunk_size
+        self.encoding = encoding
+        self.counts = Counter()
+
+    def _use_layout(self, layout):
+        self.layout = layout
+        if self.key_fields is None:
+            self.key_fields = NATURAL_KEYS.get(layout.record_type)
+            if self.key_fields is None:
+                self.log.info("There is no natural key for {} extracts, so records are keyed by every field"
+                              .format(layout.record_type))
+                self.key_fields = layout.field_names
+        unknown = [name for name in self.key_fields + tuple(self.ignore_fields) if name not in layout.field_names]
+        if unknown:
+            raise ValueError("{} has no fields named: {}".format(layout.record_type, ', '.join(unknown)))
+        self._key_indexes = [layout.field_names.index(name) for name in self.key_fields]
+        self._compared_indexes = [i for i, name in enumerate(layout.field_names) if name not in self.ignore_fields]
+
+    def _iter_rows(self, source):
+        """Yields (line, values) for the records of source, with values padded or trimmed to the layout"""
+        first_row = True
+        width = None
+        for line in iter_lines(source, self.chunk_size, self.encoding):
+            if not line:
+                continue
+            values = line.split(DELIMITER)
+            if first_row:
+                first_row = False
+                if is_header(values, self.layout):
+                    continue
+            if self.layout is None:
+                self._use_layout(get_layout(values[0]))
+            if width is None:
+                width = len(self.layout.fields)
+            if len(values) != width:
+                del values[width:]
+                values.extend([''] * (width - len(values)))
+            yield line, values
+
+    def _key(self, values):
+        return tuple(values[i] for i in self._key_indexes)
+
+    def _partition(self, key):
+        return zlib.crc32('\x1f'.join(key).encode('utf8')) % self.partitions
+
+    def _spill(self, source, directory, side):
+        """Writes the lines of source to one file per partition. Returns their paths."""
+        paths = [os.path.join(directory, '{}-{}.txt'.format(side, i)) for i in range(self.partitions)]
+        files = [open(path, 'w', encoding='utf8', newline='\n') for path in paths]
+        try:
+            for line, values in self._iter_rows(source):
+                files[self._partition(self._key(values))].write(line + '\n')
+        finally:
+            for f in files:
+                f.close()
+        return paths
+
+    def _read_partition(self, path):
+        width = len(self.layout.fields)
+        with open(path, encoding='utf8', newline='\n') as f:
+            for line in f:
+                values = line.rstrip('\n').split(DELIMITER)
+                if len(values) != width:
+                    del values[width:]
+                    values.extend([''] * (width - len(values)))
+                yield values
+
+    def _diff(self, old_rows, new_rows):
+        """Yields the changes between two iterables of split lines that share their partition"""
+        occurrences = Counter()
+        old_by_key = dict()
+        for values in old_rows:
+            key = self._key(values)
+            old_by_key[key, occurrences[key]] = values
+            occurrences[key] += 1
+        occurrences.clear()
+        for values in new_rows:
+            key = self._key(values)
+            old_values = old_by_key.pop((key, occurrences[key]), None)
+            occurrences[key] += 1
+            if old_values is None:
+                new = self._record(values)
+                self.counts['added'] += 1
+                yield RecordChange('added', self._typed_key(new), None, new, dict())
+                continue
+            compared = self._compared_indexes
+            if all(old_values[i] == values[i] for i in compared):
+                self.counts['unchanged'] += 1
+                continue
+            old, new = self._record(old_values), self._record(values)
+            deltas = {self.layout.field_names[i]: (old[i], new[i]) for i in compared if old[i] != new[i]}
+            if not deltas:
+                # e.g. '1.0' and '1' are the same decimal
+                self.counts['unchanged'] += 1
+                continue
+            self.counts['changed'] += 1
+            yield RecordChange('changed', self._typed_key(new), old, new, deltas)
+        for values in old_by_key.values():
+            old = self._record(values)
+            self.counts['removed'] += 1
+            yield RecordChange('removed', self._typed_key(old), old, None, dict())
+
+    def _record(self, values):
+        try:
+            return self.layout.parse_fields(list(values))
+        except ValueError as e:
+            raise ExtractParseError("A {} record with key {} couldn't be parsed: {}"
+                                    .format(self.layout.record_type, self._key(values), e))
+
+    def _typed_key(self, record):
+        return tuple(record[i] for i in self._key_indexes)
+
+    def __iter__(self):
+        """Yields a RecordChange for every added, removed, or changed record, a partition at a time"""
+        self.counts.clear()
+        if self.partitions == 1:
+            old_rows = [values for line, values in self._iter_rows(self.old)]
+            yield from self._diff(old_rows, (values for line, values in self._iter_rows(self.new)))
+            return
+        with TemporaryDirectory(prefix='calpads-diff-', dir=self.tmp_dir) as directory:
+            old_paths = self._spill(self.old, directory, 'old')
+            new_paths = self._spill(self.new, directory, 'new')
+            if self.layout is None:
+                return
+            for i, (old_path, new_path) in enumerate(zip(old_paths, new_paths)):
+                self.log.debug("Diffing partition {} of {}".format(i + 1, self.partitions))
+                yield from self._diff(self._read_partition(old_path), self._read_partition(new_path))
@@ -0,0 +1,315 @@
+"""Streaming, typed parsing of downloaded ODS extract files
+
+ODS extracts come back in the CALPADS file format: one caret (^) delimited record per line, with the
+record type code (SENR, SELA, SPRG...) in the first field, dates as CCYYMMDD, and codes that must keep
+their leading zeros. ExtractLayout describes the fields of one record type, following the CALPADS File
+Specification, and builds a namedtuple for its records.
+
+iter_extract_records() reads a file, file-like object, or iterable of bytes chunks (e.g. a streaming
+download's response.iter_content()) a chunk at a time and yields typed records, so memory stays
+constant however many rows the extract has. iter_extract_columns() yields the same data as batches of
+columns instead. Code fields are interned, so millions of rows share one string per distinct code.
+
+CALPADS revises its file formats now and then. Rows with more fields than the layout keep only the
+layout's fields and rows with fewer are padded with None; register_layout() adds or replaces a layout.
+"""
+import codecs
+import logging
+import os
+import sys
+from collections import namedtuple
+from datetime import date
+from .downloads import DEFAULT_CHUNK_SIZE
+from .exceptions import CALPADSError
+
+DELIMITER = '^'
+
+
+class ExtractParseError(CALPADSError):
+    """A line of an extract couldn't be parsed with its layout"""
+
+
+def _parse_date(value):
+    # CCYYMMDD
+    return date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+
+
+def _parse_flag(value):
+    return value.upper() in ('Y', 'TRUE', '1')
+
+
+# Converters for each field type, applied to non-blank values. Blank values are always None.
+FIELD_TYPES = {'str': str,
+               'code': sys.intern,
+               'date': _parse_date,
+               'int': int,
+               'decimal': float,
+               'flag': _parse_flag}
+
+
+class ExtractLayout:
+
+    def __init__(self, record_type, fields):
+        """The fields of one extract record type, in file order
+
+        Args:
+            record_type (str): the record type code in the first field of every row, e.g. 'SENR'
+            fields (iterable of tuples): (field name, type) pairs, where type is a key of FIELD_TYPES
+        """
+        self.record_type = record_type.upper()
+        self.fields = tuple(fields)
+        unknown = [field_type for name, field_type in self.fields if field_type not in FIELD_TYPES]
+        if unknown:
+            raise ValueError("Unknown field types: {}".format(', '.join(unknown)))
+        self.field_names = tuple(name for name, field_type in self.fields)
+        self.record = namedtuple(self.record_type.title() + 'Record', self.field_names)
+        self.record.__doc__ = "A parsed {} record".format(self.record_type)
+        # Plain strings need no conversion, so only the other fields are visited for each row
+        self.converters = tuple((i, FIELD_TYPES[field_type]) for i, (name, field_type) in enumerate(self.fields)
+                                if field_type != 'str')
+
+    def __repr__(self):
+        return "ExtractLayout({!r}, {} fields)".format(self.record_type, len(self.fields))
+
+    def parse_fields(self, values):
+        """Returns the record for a row already split into a list of strings. The list is modified."""
+        return self.record._make(self.convert_fields(values))
+
+    def convert_fields(self, values):
+        """Converts a row already split into a list of strings in place and returns it, without building a record"""
+        width = len(self.fields)
+        if len(values) != width:
+            del values[width:]
+            values.extend([''] * (width - len(values)))
+        for i, value in enumerate(values):
+            if not value:
+                values[i] = None
+        for i, convert in self.converters:
+            value = values[i]
+            if value is not None:
+                values[i] = convert(value)
+        return values
+
+
+# Leading fields shared by most student-level files
+_STUDENT_FIELDS = (('record_type_code', 'code'), ('transaction_type_code', 'code'), ('local_record_id', 'str'),
+                   ('reporting_lea', 'code'), ('school_of_attendance', 'code'), ('academic_year_id', 'code'),
+                   ('ssid', 'code'), ('local_student_id', 'str'), ('student_legal_first_name', 'str'),
+                   ('student_legal_last_name', 'str'), ('student_birth_date', 'date'),
+                   ('student_gender_code', 'code'))
+
+_COURSE_SECTION_FIELDS = (('local_assigned_course_id', 'str'), ('course_section_id', 'str'),
+                          ('academic_term_code', 'code'))
+
+EXTRACT_LAYOUTS = dict()
+
+
+def register_layout(layout):
+    """Add or replace the layout used for layout.record_type"""
+    EXTRACT_LAYOUTS[layout.record_type] = layout
+    return layout
+
+
+register_layout(ExtractLayout('SENR', (
+    ('record_type_code', 'code'), ('transaction_type_code', 'code'), ('local_record_id', 'str'),
+    ('reporting_lea', 'code'), ('school_of_attendance', 'code'), ('school_of_attendance_nps', 'code'),
+    ('academic_year_id', 'code'), ('ssid', 'code'), ('local_student_id', 'str'),
+    ('student_legal_first_name', 'str'), ('student_legal_middle_name', 'str'), ('student_legal_last_name', 'str'),
+    ('student_legal_name_suffix', 'str'), ('student_alias_first_name', 'str'),
+    ('student_alias_middle_name', 'str'), ('student_alias_last_name', 'str'), ('student_birth_date', 'date'),
+    ('student_gender_code', 'code'), ('student_birth_city', 'str'), ('student_birth_state_province_code', 'code'),
+    ('student_birth_country_code', 'code'), ('enrollment_start_date', 'date'), ('enrollment_status_code', 'code'),
+    ('grade_level_code', 'code'), ('enrollment_exit_date', 'date'), ('student_exit_category', 'code'),
+    ('student_school_completion_status', 'code'), ('expected_receiver_school_of_attendance', 'code'),
+    ('student_met_all_uc_csu_requirements_indicator', 'flag'), ('student_school_transfer_code', 'code'),
+    ('district_of_geographic_residence_code', 'code'), ('student_golden_state_seal_merit_diploma_indicator', 'flag'),
+    ('student_seal_of_biliteracy_indicator', 'flag'),
+    ('adult_age_students_with_disabilities_in_transition_status', 'flag'),
+    ('student_proof_of_residency_code', 'code'))))
+
+register_layout(ExtractLayout('SINF', (
+    ('record_type_code', 'code'), ('transaction_type_code', 'code'), ('local_record_id', 'str'),
+    ('effective_start_date', 'date'), ('effective_end_date', 'date'), ('reporting_lea', 'code'),
+    ('school_of_attendance', 'code'), ('academic_year_id', 'code'), ('ssid', 'code'), ('local_student_id', 'str'),
+    ('student_legal_first_name', 'str'), ('student_legal_middle_name', 'str'), ('student_legal_last_name', 'str'),
+    ('student_legal_name_suffix', 'str'), ('student_alias_first_name', 'str'),
+    ('student_alias_middle_name', 'str'), ('student_alias_last_name', 'str'), ('student_birth_date', 'date'),
+    ('student_gender_code', 'code'), ('student_birth_city', 'str'), ('student_birth_state_province_code', 'code'),
+    ('student_birth_country_code', 'code'), ('student_hispanic_ethnicity_indicator', 'flag'),
+    ('student_ethnicity_missing_indicator', 'flag'), ('student_race_1_code', 'code'),
+    ('student_race_2_code', 'code'), ('student_race_3_code', 'code'), ('student_race_4_code', 'code'),
+    ('student_race_5_code', 'code'), ('student_race_missing_indicator', 'flag'),
+    ('address_line_1', 'str'), ('address_line_2', 'str'), ('address_city_name', 'str'),
+    ('address_state_province_code', 'code'), ('address_zip_code', 'code'),
+    ('student_initial_us_school_enrollment_date_k12', 'date'),
+    ('enrolled_in_us_school_less_than_three_cumulative_years_indicator', 'flag'),
+    ('parent_guardian_highest_education_level_code', 'code'), ('guardian_1_first_name', 'str'),
+    ('guardian_1_last_name', 'str'), ('guardian_2_first_name', 'str'), ('guardian_2_last_name', 'str'))))
+
+register_layout(ExtractLayout('SELA', _STUDENT_FIELDS + (
+    ('english_language_acquisition_status_code', 'code'), ('english_language_acquisition_status_start_date', 'date'),
+    ('primary_language_code', 'code'))))
+
+register_layout(ExtractLayout('SPRG', _STUDENT_FIELDS + (
+    ('education_program_code', 'code'), ('education_program_membership_code', 'code'),
+    ('education_program_membership_start_date', 'date'), ('education_program_membership_end_date', 'date'),
+    ('education_service_academic_year', 'code'), ('education_service_code', 'code'),
+    ('california_partnership_academy_id', 'code'), ('migrant_student_id', 'code'),
+    ('primary_disability_code', 'code'), ('district_of_special_education_accountability', 'code'),
+    ('homeless_dwelling_type', 'code'), ('unaccompanied_youth_indicator', 'flag'),
+    ('runaway_youth_indicator', 'flag'))))
+
+register_layout(ExtractLayout('SCSE', _STUDENT_FIELDS + _COURSE_SECTION_FIELDS))
+
+register_layout(ExtractLayout('SCSC', _STUDENT_FIELDS + _COURSE_SECTION_FIELDS + (
+    ('student_credits_attempted', 'decimal'), ('student_credits_earned', 'decimal'),
+    ('student_course_final_grade', 'code'), ('uc_csu_admission_requirement_code', 'code'),
+    ('marking_period_code', 'code'))))
+
+register_layout(ExtractLayout('STAS', _STUDENT_FIELDS + (
+    ('hourly_attendance_system_indicator', 'flag'), ('expected_attendance_days', 'decimal'),
+    ('days_attended_in_seat', 'decimal'), ('days_attended_non_classroom_based', 'decimal'),
+    ('days_absent_out_of_school_suspension', 'decimal'), ('days_in_school_suspension', 'decimal'),
+    ('days_absent_excused_non_suspension', 'decimal'), ('days_absent_unexcused_non_suspension', 'decimal'),
+    ('incomplete_independent_study_days', 'decimal'))))
+
+register_layout(ExtractLayout('CRSC', (
+    ('record_type_code', 'code'), ('transaction_type_code', 'code'), ('local_record_id', 'str'),
+    ('reporting_lea', 'code'), ('school_of_attendance', 'code'), ('academic_year_id', 'code'),
+    ('local_assigned_course_id', 'str'), ('course_section_id', 'str'), ('state_course_code', 'code'),
+    ('academic_term_code', 'code'), ('course_section_instructional_level_code', 'code'),
+    ('independent_study_indicator', 'flag'), ('distance_learning_indicator', 'flag'),
+    ('multiple_teacher_code', 'code'), ('course_section_instructional_strategy_code', 'code'),
+    ('course_section_instructional_language_code', 'code'), ('course_content_delivery_type_code', 'code'),
+    ('cte_funding_provider_code', 'code'), ('seid', 'code'), ('local_staff_id', 'str'),
+    ('staff_legal_first_name', 'str'), ('staff_legal_last_name', 'str'), ('staff_birth_date', 'date'))))
+
+
+def get_layout(record_type):
+    """Returns the ExtractLayout for record_type
+
+    Raises:
+        ExtractParseError: when there is no layout for record_type
+    """
+    try:
+        return EXTRACT_LAYOUTS[record_type.upper()]
+    except KeyError:
+        raise ExtractParseError("There is no layout for {} extracts. Known layouts: {}"
+                                .format(record_type, ' '.join(sorted(EXTRACT_LAYOUTS))))
+
+
+def is_header(values, layout=None):
+    """Whether the first row of an extract, split into values, is a header line rather than a record
+
+    Args:
+        values (list): the fields of the first non-blank line
+        layout (ExtractLayout, optional): the extract's layout, when known. Otherwise any known record type code
+            marks a record.
+    """
+    code = values[0].upper()
+    return code not in EXTRACT_LAYOUTS if layout is None else code != layout.record_type
+
+
+def iter_lines(source, chunk_size=DEFAULT_CHUNK_SIZE, encoding='utf-8'):
+    """Yields the lines of source without their line endings, reading chunk_size bytes at a time
+
+    Args:
+        source (str, path-like, bytes, file-like, or iterable of bytes): a path, the whole extract, a binary
+            file-like object, or the chunks of a download, e.g. response.iter_content(chunk_size)
+        chunk_size (int, optional): the bytes read at a time from a path or file-like object
+        encoding (str, optional): the text encoding of the extract
+    """
+    if isinstance(source, (bytes, bytearray)):
+        # The content itself, e.g. download_extract(..., return_bytes=True), rather than a path
+        source = [source]
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            yield from iter_lines(f, chunk_size, encoding)
+        return
+    if hasattr(source, 'read'):
+        chunks = iter(lambda: source.read(chunk_size), b'')
+    else:
+        chunks = source
+    # An incremental decoder copes with multi-byte characters split across chunks
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    pending = ''
+    for chunk in chunks:
+        if not chunk:
+            continue
+        lines = (pending + decoder.decode(chunk)).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip('\r')
+    pending += decoder.decode(b'', final=True)
+    if pending.rstrip('\r'):
+        yield pending.rstrip('\r')
+
+
+def iter_extract_records(source, record_type=None, chunk_size=DEFAULT_CHUNK_SIZE, encoding='utf-8'):
+    """Stream the typed records of an extract
+
+    Blank lines are skipped, as is a header line, recognized by a first field that isn't the record type code.
+    Without a record_type, the layout is picked from the record type code of the first row.
+
+    Args:
+        source (str, path-like, bytes, file-like, or iterable of bytes): see iter_lines()
+        record_type (str or ExtractLayout, optional): the extract's record type, e.g. 'SENR', or a custom layout.
+            Defaults to the record type code of the first row.
+        chunk_size (int, optional): the bytes read at a time from a path or file-like object
+        encoding (str, optional): the text encoding of the extract
+
+    Returns:
+        a generator of the layout's namedtuple records
+
+    Raises:
+        ExtractParseError: when there is no layout for the record type or a value can't be converted
+    """
+    if isinstance(record_type, ExtractLayout):
+        layout = record_type
+    else:
+        layout = get_layout(record_type) if record_type else None
+    first_row = True
+    for line_number, line in enumerate(iter_lines(source, chunk_size, encoding), start=1):
+        if not line:
+            continue
+        values = line.split(DELIMITER)
+        if first_row:
+            first_row = False
+            if is_header(values, layout):
+                logging.getLogger(__name__).debug("Skipping the header line of the extract")
+                continue
+        if layout is None:
+            layout = get_layout(values[0])
+        try:
+            yield layout.parse_fields(values)
+        except ValueError as e:
+            raise ExtractParseError("Line {} of the {} extract: {}".format(line_number, layout.record_type, e))
+
+
+def iter_extract_columns(source, record_type=None, batch_size=10000, chunk_size=DEFAULT_CHUNK_SIZE,
+                         encoding='utf-8'):
+    """Stream an extract as batches of columns, e.g. to build data frames or Arrow tables a batch at a time
+
+    Args:
+        source (str, path-like, bytes, file-like, or iterable of bytes): see iter_lines()
+        record_type (str or ExtractLayout, optional): see iter_extract_records()
+        batch_size (int, optional): the most rows in each batch
+        chunk_size (int, optional): the bytes read at a time from a path or file-like object
+        encoding (str, optional): the text encoding of the extract
+
+    Returns:
+        a generator of dicts of {field name: list of values}, each list batch_size long except in the last batch
+    """
+    batch = []
+    for record in iter_extract_records(source, record_type, chunk_size, encoding):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield records_to_columns(batch)
+            batch = []
+    if batch:
+        yield records_to_columns(batch)
+
+
+def records_to_columns(records):
+    """Transposes a non-empty list of records into {field name: list of values}"""
+    return dict(zip(records[0]._fields, map(list, zip(*records))))
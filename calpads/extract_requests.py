@@ -0,0 +1,114 @@
+"""Handles for requested extracts and the helpers used to wait on them
+
+CALPADS' extract listing (/Extract?SelectedLEA=...) returns every extract requested for an LEA, newest
+first. Rather than assuming the newest row is the one we asked for, request_extract() remembers which
+ExtractRequestIDs already existed before it submitted the request. The first new row of the same
+type that no other handle in this process has claimed is ours, which keeps concurrent requests from the
+same LEA from picking up each other's files.
+"""
+import random
+import threading
+import time
+
+# Keys CALPADS might use for the extract type in the listing rows, in order of preference
+EXTRACT_TYPE_KEYS = ('ExtractType', 'RecordType', 'ExtractName', 'Extract')
+
+
+class ExtractRequest:
+
+    def __init__(self, lea_code, extract_name, requested_at, prior_ids, request_id=None):
+        """A handle for an extract that was successfully requested. Always truthy.
+
+        Args:
+            lea_code (str): the LEA the extract was requested for
+            extract_name (str): the upper-cased extract name, e.g. SENR
+            requested_at (float): time.time() when the request was submitted
+            prior_ids (frozenset): ExtractRequestIDs that were listed before the request was submitted
+            request_id (optional): the ExtractRequestID, once it has been matched in the listing
+        """
+        self.lea_code = lea_code
+        self.extract_name = extract_name
+        self.requested_at = requested_at
+        self.prior_ids = prior_ids
+        self.request_id = request_id
+
+    def __bool__(self):
+        return True
+
+    def __repr__(self):
+        return '{}(lea_code={!r}, extract_name={!r}, request_id={!r})'.format(self.__class__.__name__, self.lea_code,
+                                                                             self.extract_name, self.request_id)
+
+
+class ExtractIdRegistry:
+
+    def __init__(self):
+        """Thread-safe record of the ExtractRequestIDs already matched to a handle"""
+        self._claimed = set()
+        self._lock = threading.Lock()
+
+    def resolve(self, extract_request, rows):
+        """Match extract_request to its row in the listing, claiming the ExtractRequestID.
+
+        Returns:
+            the matching row, or None if it can't be identified (yet)
+        """
+        if extract_request.request_id is not None:
+            return find_extract_row(rows, extract_request.request_id)
+        with self._lock:
+            candidates = [row for row in rows
+                          if row.get('ExtractRequestID') not in extract_request.prior_ids
+                          and row.get('ExtractRequestID') not in self._claimed
+                          and extract_type_matches(row, extract_request.extract_name)]
+            if not candidates:
+                return None
+            # Rows are listed newest first, so the last candidate is the oldest unclaimed request
+            row = candidates[-1]
+            self._claimed.add(row['ExtractRequestID'])
+            extract_request.request_id = row['ExtractRequestID']
+            return row
+
+
+def find_extract_row(rows, request_id):
+    for row in rows:
+        if row.get('ExtractRequestID') == request_id:
+            return row
+    return None
+
+
+def extract_type_matches(row, extract_name):
+    """Whether a listing row could be an extract_name extract. Rows without a recognizable type key match."""
+    for key in EXTRACT_TYPE_KEYS:
+        if row.get(key):
+            return extract_name.upper() in str(row[key]).upper().replace(' ', '')
+    return True
+
+
+def is_extract_complete(row):
+    return row.get('ExtractStatus') == 'Complete'
+
+
+def is_extract_failed(row):
+    status = str(row.get('ExtractStatus', '')).lower()
+    return 'fail' in status or 'error' in status
+
+
+def backoff_delays(initial=2.0, maximum=60.0, multiplier=2.0, jitter=0.25):
+    """Yield an endless series of exponentially growing, jittered sleep durations
+
+    Each delay is drawn uniformly from [(1 - jitter) * d, d], where d starts at initial and is multiplied by
+    multiplier on every step up to maximum. Jitter keeps several waiters from polling in lockstep.
+    """
+    delay = initial
+    while True:
+        yield random.uniform((1 - jitter) * delay, delay)
+        delay = min(maximum, delay * multiplier)
+
+
+def sleep_until_next_poll(delays, deadline):
+    """Sleep for the next backoff delay, but never past the deadline. Returns False when the deadline has passed."""
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        return False
+    time.sleep(min(next(delays), remaining))
+    return True
@@ -0,0 +1,251 @@
+"""An indexed local SQLite store of parsed extracts
+
+Answering "what does CALPADS say about this SSID" from flat extract files means scanning gigabytes, and
+asking the per-SSID history endpoints means a round trip per student. The ExtractStore loads the latest
+extracts into a SQLite database instead, with one table per record type (senr, sela, sprg...) whose columns
+follow the record type's ExtractLayout, and indexes on the SSID, SEID, and school columns. Lookups are then
+local indexed queries that take well under a millisecond.
+
+Loading is built for bulk: rows are parsed with the streaming parser and inserted with executemany() in
+batches, all in one transaction, into a fresh table whose indexes are built once the rows are in. A reader
+never sees a half-loaded extract, and a failed load leaves the previous one in place.
+
+Dates are stored as ISO 8601 text, so they sort and compare as dates, and flags as 0 or 1. Records read back
+are the layout's namedtuples, with the same types iter_extract_records() yields.
+"""
+import json
+import logging
+import re
+import sqlite3
+import time
+from datetime import date, datetime
+from .downloads import DEFAULT_CHUNK_SIZE
+from .extract_parser import ExtractLayout, get_layout, iter_extract_records
+
+# Columns indexed in every table that has them
+INDEXED_FIELDS = ('ssid', 'seid', 'school_of_attendance')
+
+SQLITE_TYPES = {'str': 'TEXT',
+                'code': 'TEXT',
+                'date': 'TEXT',
+                'int': 'INTEGER',
+                'decimal': 'REAL',
+                'flag': 'INTEGER'}
+
+
+def _quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _table_name(record_type):
+    if not re.match(r'^[A-Za-z][A-Za-z0-9_]*$', record_type):
+        raise ValueError("{!r} can't be used as a table name".format(record_type))
+    return record_type.lower()
+
+
+class ExtractStore:
+
+    def __init__(self, path=':memory:'):
+        """A SQLite database of the latest extract of each record type
+
+        The connection belongs to the thread that creates the store. Open another ExtractStore on the same file
+        for each thread that queries it.
+
+        Args:
+            path (str, optional): the database file. Created if it doesn't exist. Defaults to an in-memory database.
+        """
+        self.path = path
+        # Transactions are begun and committed explicitly, so a load's DDL is rolled back with its rows
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS extract_tables (record_type TEXT PRIMARY KEY, '
+                                'fields TEXT NOT NULL, row_count INTEGER NOT NULL, source TEXT, loaded_at REAL)')
+        self._layouts = dict()
+        self.log = logging.getLogger(__name__)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def load(self, source, record_type=None, batch_size=10000, replace=True, chunk_size=DEFAULT_CHUNK_SIZE,
+             encoding='utf-8'):
+        """Bulk load an extract into the table for its record type, in a single transaction
+
+        Args:
+            source (str, path-like, bytes, file-like, or iterable of bytes): see extract_parser.iter_lines()
+            record_type (str or ExtractLayout, optional): see extract_parser.iter_extract_records()
+            batch_size (int, optional): the rows handed to each executemany()
+            replace (bool, optional): when True, the extract replaces the table's rows. When False, it's appended.
+            chunk_size (int, optional): the bytes read at a time from a path or file-like object
+            encoding (str, optional): the text encoding of the extract
+
+        Returns:
+            int: the rows loaded
+
+        Raises:
+            ExtractParseError: when the extract can't be parsed. Nothing is loaded.
+        """
+        started = time.monotonic()
+        records = iter_extract_records(source, record_type, chunk_size, encoding)
+        first = next(records, None)
+        if first is None:
+            self.log.info("The extract has no records, so nothing was loaded")
+            return 0
+        layout = record_type if isinstance(record_type, ExtractLayout) else get_layout(first.record_type_code)
+        table = _table_name(layout.record_type)
+        date_fields = [i for i, (name, field_type) in enumerate(layout.fields) if field_type == 'date']
+        flag_fields = [i for i, (name, field_type) in enumerate(layout.fields) if field_type == 'flag']
+
+        def to_row(record):
+            row = list(record)
+            for i in date_fields:
+                if row[i] is not None:
+                    row[i] = row[i].isoformat()
+            for i in flag_fields:
+                if row[i] is not None:
+                    row[i] = int(row[i])
+            return row
+
+        insert = 'INSERT INTO {} VALUES ({})'.format(_quote(table), ', '.join('?' * len(layout.fields)))
+        row_count = loaded = 0
+        self.connection.execute('BEGIN')
+        try:
+            existing = self._stored_fields(layout.record_type)
+            if replace or (existing is not None and existing != layout.fields):
+                if not replace:
+                    self.log.warning("The {} layout changed since the last load, so its table is replaced"
+                                     .format(layout.record_type))
+                self.connection.execute('DROP TABLE IF EXISTS {}'.format(_quote(table)))
+                existing = None
+            if existing is None:
+                self.connection.execute('CREATE TABLE {} ({})'.format(_quote(table), ', '.join(
+                    '{} {}'.format(_quote(name), SQLITE_TYPES[field_type]) for name, field_type in layout.fields)))
+                # Rows go in before the indexes are built, which is much faster than updating them row by row
+                replace = True
+            else:
+                row_count = self.count(layout.record_type)
+            batch = [to_row(first)]
+            for record in records:
+                batch.append(to_row(record))
+                if len(batch) >= batch_size:
+                    self.connection.executemany(insert, batch)
+                    loaded += len(batch)
+                    batch = []
+            self.connection.executemany(insert, batch)
+            loaded += len(batch)
+            row_count += loaded
+            if replace:
+                for name in INDEXED_FIELDS:
+                    if name in layout.field_names:
+                        self.connection.execute('CREATE INDEX {} ON {} ({})'.format(
+                            _quote('{}_{}'.format(table, name)), _quote(table), _quote(name)))
+            self.connection.execute('INSERT OR REPLACE INTO extract_tables VALUES (?, ?, ?, ?, ?)',
+                                    (layout.record_type, json.dumps(layout.fields), row_count,
+                                     source if isinstance(source, str) else None, time.time()))
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+        self._layouts[layout.record_type] = layout
+        self.log.info("Loaded {} {} rows in {:.1f} seconds".format(loaded, layout.record_type,
+                                                                   time.monotonic() - started))
+        return loaded
+
+    def _stored_fields(self, record_type):
+        row = self.connection.execute('SELECT fields FROM extract_tables WHERE record_type = ?',
+                                      (record_type,)).fetchone()
+        return None if row is None else tuple(tuple(field) for field in json.loads(row[0]))
+
+    def layout(self, record_type):
+        """Returns the ExtractLayout of the stored record_type table, as it was when loaded
+
+        Raises:
+            KeyError: when no extract of record_type has been loaded
+        """
+        record_type = record_type.upper()
+        layout = self._layouts.get(record_type)
+        if layout is None:
+            fields = self._stored_fields(record_type)
+            if fields is None:
+                raise KeyError("No {} extract has been loaded".format(record_type))
+            layout = self._layouts[record_type] = ExtractLayout(record_type, fields)
+        return layout
+
+    @property
+    def record_types(self):
+        """The record types loaded, e.g. ['SELA', 'SENR']"""
+        return [row[0] for row in self.connection.execute('SELECT record_type FROM extract_tables ORDER BY 1')]
+
+    def loads(self):
+        """Returns a dict of {record type: {'row_count', 'source', 'loaded_at'}} for the loaded extracts"""
+        return {record_type: {'row_count': row_count, 'source': source, 'loaded_at': loaded_at}
+                for record_type, row_count, source, loaded_at in self.connection.execute(
+                    'SELECT record_type, row_count, source, loaded_at FROM extract_tables')}
+
+    def count(self, record_type):
+        """Returns the rows stored for record_type"""
+        self.layout(record_type)
+        return self.connection.execute('SELECT COUNT(*) FROM {}'.format(_quote(_table_name(record_type)))).fetchone()[0]
+
+    def query(self, record_type, **criteria):
+        """Returns the stored records of record_type whose fields equal criteria, in load order
+
+        e.g. store.query('SENR', school_of_attendance='0123456', grade_level_code='10')
+
+        Args:
+            record_type (str): e.g. 'SENR'
+            **criteria: field names and the values to match. Dates may be datetime.date objects.
+
+        Returns:
+            list of the layout's namedtuple records
+        """
+        layout = self.layout(record_type)
+        unknown = [name for name in criteria if name not in layout.field_names]
+        if unknown:
+            raise ValueError("{} has no fields named: {}".format(layout.record_type, ', '.join(unknown)))
+        sql = 'SELECT * FROM {}'.format(_quote(_table_name(layout.record_type)))
+        if criteria:
+            sql += ' WHERE ' + ' AND '.join('{} = ?'.format(_quote(name)) for name in criteria)
+        parameters = [value.isoformat() if isinstance(value, date) else value for value in criteria.values()]
+        return [self._to_record(layout, row) for row in self.connection.execute(sql + ' ORDER BY rowid', parameters)]
+
+    def lookup(self, identifier, field='ssid', record_types=None):
+        """Returns every stored record about one student or staff member
+
+        Args:
+            identifier (str or int): the SSID, or the value of field
+            field (str, optional): the identifying field, e.g. 'seid' for staff. Defaults to 'ssid'.
+            record_types (iterable of str, optional): the record types to look in. Defaults to every loaded type
+                with the field.
+
+        Returns:
+            dict of {record type: list of records}, only including the record types with matches
+        """
+        if record_types is None:
+            record_types = [record_type for record_type in self.record_types
+                            if field in self.layout(record_type).field_names]
+        results = dict()
+        for record_type in record_types:
+            records = self.query(record_type, **{field: str(identifier)})
+            if records:
+                results[record_type.upper()] = records
+        return results
+
+    @staticmethod
+    def _to_record(layout, row):
+        values = list(row)
+        for i, (name, field_type) in enumerate(layout.fields):
+            value = values[i]
+            if value is None:
+                continue
+            if field_type == 'date':
+                values[i] = datetime.strptime(value, '%Y-%m-%d').date()
+            elif field_type == 'flag':
+                values[i] = bool(value)
+        return layout.record._make(values)
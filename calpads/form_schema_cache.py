@@ -0,0 +1,190 @@
+"""Cache of parsed extract and report form schemas
+
+The extract request and report forms change rarely, but every dry run used to navigate to the live
+page and parse it again. The FormSchemaCache keeps the parsed field definitions and valid values
+(exactly what dry_run=True returns) keyed by (kind, LEA, form name), optionally persisted to a JSON
+file. Whenever a live form is parsed, its fingerprint is compared with the cached one and the entry is
+replaced if the page changed. Cached schemas also allow form_data to be validated client-side.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+# Bump when the shape of the parsed schemas changes so stale disk caches are ignored
+SCHEMA_VERSION = 1
+
+
+def encode_schema(schema):
+    """Make a parsed form schema JSON serializable, preserving tuples and the str/bool type markers"""
+    if isinstance(schema, type):
+        return {'__type__': schema.__name__}
+    if isinstance(schema, tuple):
+        return {'__tuple__': [encode_schema(item) for item in schema]}
+    if isinstance(schema, list):
+        return [encode_schema(item) for item in schema]
+    if isinstance(schema, dict):
+        return {key: encode_schema(value) for key, value in schema.items()}
+    return schema
+
+
+def decode_schema(encoded):
+    """Reverse encode_schema()"""
+    if isinstance(encoded, dict):
+        if '__type__' in encoded:
+            return {'str': str, 'bool': bool}[encoded['__type__']]
+        if '__tuple__' in encoded:
+            return tuple(decode_schema(item) for item in encoded['__tuple__'])
+        return {key: decode_schema(value) for key, value in encoded.items()}
+    if isinstance(encoded, list):
+        return [decode_schema(item) for item in encoded]
+    return encoded
+
+
+def schema_fingerprint(schema):
+    """A stable digest of a parsed form schema, used to notice when the live page changes"""
+    canonical = json.dumps(encode_schema(schema), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf8')).hexdigest()
+
+
+class FormSchemaCache:
+
+    def __init__(self, path=None, ttl=None):
+        """In-memory, optionally disk-backed, cache of parsed form schemas
+
+        Args:
+            path (str, optional): a JSON file used to persist schemas between runs
+            ttl (float, optional): seconds after which a cached schema is ignored. Defaults to None, meaning schemas
+                are kept until a live parse shows the form changed or they are invalidated.
+        """
+        self.path = path
+        self.ttl = ttl
+        self._entries = dict()
+        self._lock = threading.Lock()
+        self.log = logging.getLogger(__name__)
+        if path:
+            self._load_from_disk()
+
+    def get(self, kind, lea_code, name):
+        """Returns the cached schema for the form, or None
+
+        Args:
+            kind (str): 'extract' or 'report'
+            lea_code (str): the LEA the form was parsed for
+            name (str): the form name, e.g. 'SENR:default' or '8.1:snapshot'
+        """
+        entry = self._entries.get(_cache_key(kind, lea_code, name))
+        if entry is None:
+            return None
+        if self.ttl is not None and (time.time() - entry['cached_at']) > self.ttl:
+            return None
+        return decode_schema(entry['schema'])
+
+    def put(self, kind, lea_code, name, schema):
+        """Cache a freshly parsed schema. Returns True if it differs from the cached one (or there was none)."""
+        fingerprint = schema_fingerprint(schema)
+        key = _cache_key(kind, lea_code, name)
+        with self._lock:
+            previous = self._entries.get(key)
+            changed = previous is None or previous['fingerprint'] != fingerprint
+            if previous is not None and changed:
+                self.log.info("The {} form {} for {} changed since it was cached".format(kind, name, lea_code))
+            self._entries[key] = {'fingerprint': fingerprint, 'cached_at': time.time(),
+                                  'schema': encode_schema(schema)}
+            if self.path and (changed or self.ttl is not None):
+                self._save_to_disk()
+        return changed
+
+    def invalidate(self, kind=None, lea_code=None, name=None):
+        """Drop every cached schema matching the provided parts of the key. With no arguments, drops everything."""
+        with self._lock:
+            for key in list(self._entries):
+                key_kind, key_lea, key_name = key.split('|', 2)
+                if ((kind is None or kind == key_kind) and (lea_code is None or lea_code == key_lea)
+                        and (name is None or name == key_name)):
+                    del self._entries[key]
+            if self.path:
+                self._save_to_disk()
+
+    def _save_to_disk(self):
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump({'version': SCHEMA_VERSION, 'entries': self._entries}, f)
+        os.replace(tmp_path, self.path)
+
+    def _load_from_disk(self):
+        try:
+            with open(self.path, 'r', encoding='utf8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            self.log.debug("No usable form schema cache at {}".format(self.path))
+            return
+        if cached.get('version') != SCHEMA_VERSION:
+            self.log.info("Ignoring a form schema cache written by a different version")
+            return
+        self._entries = cached.get('entries', dict())
+
+
+def _cache_key(kind, lea_code, name):
+    return '|'.join((kind, str(lea_code), name))
+
+
+def validate_extract_form_data(schema, form_data):
+    """Check extract form_data against a parsed extract schema (what request_extract(dry_run=True) returns)
+
+    Args:
+        schema (dict): the parsed extract form fields
+        form_data (list of iterables): the (key, value) pairs that would be sent to request_extract
+
+    Returns:
+        list of str describing each problem found. An empty list means the form data looks valid.
+    """
+    problems = []
+    provided = dict()
+    for key, value in form_data:
+        provided.setdefault(key, []).append(value)
+    for key, values in provided.items():
+        field = schema.get(key)
+        if field is None:
+            problems.append("{} is not a field on this form".format(key))
+            continue
+        valid_values = field['ValidValues']
+        if isinstance(valid_values, dict):
+            if len(values) > 1 and not valid_values.get('_allows_multiple'):
+                problems.append("{} only allows one value".format(key))
+            allowed = {str(v) for k, v in valid_values.items() if k != '_allows_multiple'}
+            for value in values:
+                if str(value) not in allowed:
+                    problems.append("{} is not a valid value for {}".format(value, key))
+    for key, field in schema.items():
+        if field['Required'] and field['ValidValues'] is not bool and key not in provided:
+            problems.append("{} is required".format(key))
+    return problems
+
+
+def validate_report_form_data(schema, form_data):
+    """Check report form_data against a parsed report schema (what download_report(dry_run=True) returns)
+
+    Args:
+        schema (dict): the filtered report form parameters
+        form_data (dict): the data that would be sent to download_report
+
+    Returns:
+        list of str describing each problem found. An empty list means the form data looks valid.
+    """
+    problems = []
+    for paramname, paramvalue in form_data.items():
+        valid_values = schema.get(paramname)
+        if valid_values is None:
+            problems.append("{} is not a parameter of this report".format(paramname))
+        elif isinstance(valid_values, dict):
+            folded = {option.casefold() for option in valid_values}
+            for checkbox in paramvalue:
+                if checkbox.casefold() not in folded:
+                    problems.append("{} is not a valid option for {}".format(checkbox, paramname))
+        elif valid_values != ("You can insert any string here",):
+            if str(paramvalue).casefold() not in {option.casefold() for option in valid_values}:
+                problems.append("{} is not a valid value for {}".format(paramvalue, paramname))
+    return problems
@@ -0,0 +1,247 @@
+"""Incremental sync of per-student history lookups
+
+Refetching every student's `get_*_history` endpoints every night costs a request per student per endpoint,
+yet most students don't change from one day to the next. HistorySync keeps a local mirror of the history
+responses instead, in a SQLite database with a content hash per response, and only refetches the
+(SSID, endpoint) pairs whose data could have changed:
+
+    * the SSIDs in a changed-SSID set, on every synced endpoint
+    * the students in an extract delta, e.g. an ExtractDiff of yesterday's and today's SENR, on only the
+      endpoints fed by that record type (an SENR change refetches the enrollment history, and the demographics
+      history too when a name, birth date, or gender changed)
+    * the SSIDs of a roster, e.g. today's SENR extract, that the mirror has no response for yet, or whose
+      response is older than max_age
+
+The lookups run on a calpads.bulk.BulkHistoryFetcher, so they're concurrent and failures are reported per
+lookup. A failed lookup, including a response without a Data list (the getters return {} for anything that
+isn't JSON), leaves the mirrored response in place.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from collections import Counter, defaultdict, namedtuple
+from .bulk import STUDENT_HISTORY_ENDPOINTS, HistoryLookupFailed
+
+# The history endpoints that show data from each extract record type
+ENDPOINTS_BY_RECORD_TYPE = {'SENR': ('enrollment',),
+                            'SINF': ('demographics', 'address'),
+                            'SELA': ('elas',),
+                            'SPRG': ('program',),
+                            'SCSE': ('course_section',),
+                            'SCSC': ('course_section',),
+                            'STAS': ('stas',)}
+
+# Fields outside of SINF that the demographics history also shows
+DEMOGRAPHIC_FIELDS = frozenset(['student_legal_first_name', 'student_legal_middle_name', 'student_legal_last_name',
+                                'student_legal_name_suffix', 'student_alias_first_name', 'student_alias_middle_name',
+                                'student_alias_last_name', 'student_birth_date', 'student_gender_code',
+                                'student_birth_city', 'student_birth_state_province_code',
+                                'student_birth_country_code'])
+
+SyncReport = namedtuple('SyncReport', ['fetched', 'changed', 'unchanged', 'failed', 'skipped'])
+SyncReport.__doc__ = """The outcome of a HistorySync.sync(). fetched counts the lookups made; changed lists the
+(identifier, endpoint) pairs whose response is new or differs from the mirror; unchanged counts the responses
+that matched; failed lists the BulkResults with an error; skipped counts the mirrored pairs that weren't
+refetched."""
+
+
+def content_hash(data):
+    """A stable digest of a history response, independent of its key order"""
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf8')).hexdigest()
+
+
+def endpoints_for_changes(changes):
+    """Returns {SSID: set of endpoints} whose history could have changed with an extract delta
+
+    Args:
+        changes (iterable): calpads.extract_diff.RecordChange tuples, e.g. an ExtractDiff
+
+    Returns:
+        dict of {str: set of str}. Record types without history endpoints, or without an SSID, are left out.
+    """
+    plan = defaultdict(set)
+    for change in changes:
+        record = change.new if change.new is not None else change.old
+        endpoints = ENDPOINTS_BY_RECORD_TYPE.get(record.record_type_code, ())
+        ssid = getattr(record, 'ssid', None)
+        if not endpoints or not ssid:
+            continue
+        plan[ssid].update(endpoints)
+        if record.record_type_code == 'SENR' and DEMOGRAPHIC_FIELDS.intersection(change.deltas):
+            plan[ssid].add('demographics')
+    return dict(plan)
+
+
+class HistoryMirror:
+
+    def __init__(self, path):
+        """A SQLite mirror of history responses, one row per (identifier, endpoint)
+
+        The connection belongs to the thread that creates the mirror.
+
+        Args:
+            path (str): the database file. Created if it doesn't exist.
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS histories (identifier TEXT NOT NULL, '
+                                'endpoint TEXT NOT NULL, data TEXT NOT NULL, content_hash TEXT NOT NULL, '
+                                'fetched_at REAL NOT NULL, changed_at REAL NOT NULL, '
+                                'PRIMARY KEY (identifier, endpoint))')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def get(self, identifier, endpoint):
+        """Returns the mirrored response for identifier and endpoint, or None"""
+        row = self.connection.execute('SELECT data FROM histories WHERE identifier = ? AND endpoint = ?',
+                                      (str(identifier), endpoint)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def get_all(self, identifier):
+        """Returns {endpoint: response} for every mirrored endpoint of identifier"""
+        return {endpoint: json.loads(data) for endpoint, data in self.connection.execute(
+            'SELECT endpoint, data FROM histories WHERE identifier = ?', (str(identifier),))}
+
+    def put(self, identifier, endpoint, data, now=None):
+        """Mirror a response. Returns True when it's new or its content changed."""
+        now = time.time() if now is None else now
+        digest = content_hash(data)
+        row = self.connection.execute('SELECT content_hash FROM histories WHERE identifier = ? AND endpoint = ?',
+                                      (str(identifier), endpoint)).fetchone()
+        if row is not None and row[0] == digest:
+            self.connection.execute('UPDATE histories SET fetched_at = ? WHERE identifier = ? AND endpoint = ?',
+                                    (now, str(identifier), endpoint))
+            return False
+        self.connection.execute('INSERT OR REPLACE INTO histories VALUES (?, ?, ?, ?, ?, ?)',
+                                (str(identifier), endpoint, json.dumps(data), digest, now, now))
+        return True
+
+    def fetched_at(self, endpoints):
+        """Returns {(identifier, endpoint): fetched_at} for every mirrored response of endpoints"""
+        endpoints = list(endpoints)
+        sql = 'SELECT identifier, endpoint, fetched_at FROM histories WHERE endpoint IN ({})'.format(
+            ', '.join('?' * len(endpoints)))
+        return {(identifier, endpoint): fetched_at
+                for identifier, endpoint, fetched_at in self.connection.execute(sql, endpoints)}
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM histories').fetchone()[0]
+
+
+class HistorySync:
+
+    def __init__(self, fetcher, mirror, endpoints=None, commit_every=500):
+        """Keep a HistoryMirror up to date, refetching only what could have changed
+
+        e.g.
+            fetcher = BulkHistoryFetcher(lambda: CALPADSClient(username, password), max_workers=8)
+            with fetcher, HistoryMirror('histories.db') as mirror:
+                report = HistorySync(fetcher, mirror).sync(changes=ExtractDiff(yesterday, today),
+                                                            roster=today_ssids)
+
+        Args:
+            fetcher (calpads.bulk.BulkHistoryFetcher): runs the lookups
+            mirror (HistoryMirror): the local mirror
+            endpoints (iterable of str, optional): the student endpoints kept in the mirror. Defaults to all of them.
+            commit_every (int, optional): the responses mirrored per transaction, so an interrupted sync keeps
+                most of its progress
+        """
+        self.fetcher = fetcher
+        self.mirror = mirror
+        self.endpoints = tuple(endpoints) if endpoints is not None else tuple(STUDENT_HISTORY_ENDPOINTS)
+        unknown = [endpoint for endpoint in self.endpoints if endpoint not in STUDENT_HISTORY_ENDPOINTS]
+        if unknown:
+            raise ValueError("Unknown student history endpoint(s): {}".format(', '.join(unknown)))
+        self.commit_every = commit_every
+        self.log = logging.getLogger(__name__)
+
+    def plan(self, changed=None, changes=None, roster=None, max_age=None):
+        """Returns {SSID: set of endpoints} to refetch
+
+        Args:
+            changed (iterable of str, optional): SSIDs to refetch on every synced endpoint
+            changes (iterable, optional): calpads.extract_diff.RecordChange tuples, e.g. an ExtractDiff of the
+                previous and latest extract. Their students are refetched on the endpoints the record type feeds.
+            roster (iterable of str, optional): every SSID that should be mirrored. Pairs missing from the mirror
+                are fetched.
+            max_age (float, optional): seconds after which a roster SSID's mirrored response is refetched anyway
+        """
+        plan = defaultdict(set)
+        for ssid in changed or ():
+            plan[str(ssid)].update(self.endpoints)
+        if changes is not None:
+            for ssid, endpoints in endpoints_for_changes(changes).items():
+                endpoints = endpoints.intersection(self.endpoints)
+                if endpoints:
+                    plan[str(ssid)].update(endpoints)
+        if roster is not None:
+            fetched_at = self.mirror.fetched_at(self.endpoints)
+            oldest = None if max_age is None else time.time() - max_age
+            for ssid in roster:
+                ssid = str(ssid)
+                for endpoint in self.endpoints:
+                    fetched = fetched_at.get((ssid, endpoint))
+                    if fetched is None or (oldest is not None and fetched < oldest):
+                        plan[ssid].add(endpoint)
+        return dict(plan)
+
+    def sync(self, changed=None, changes=None, roster=None, max_age=None):
+        """Refetch the pairs plan() picks and mirror the responses
+
+        Args:
+            see plan()
+
+        Returns:
+            a SyncReport
+        """
+        plan = self.plan(changed, changes, roster, max_age)
+        # One fetch per distinct endpoint set, since the fetcher looks up every endpoint for every identifier
+        groups = defaultdict(list)
+        for ssid, endpoints in plan.items():
+            groups[tuple(sorted(endpoints))].append(ssid)
+        counts = Counter()
+        changed_pairs = []
+        failed = []
+        pending = 0
+        self.mirror.connection.execute('BEGIN')
+        try:
+            for endpoints, ssids in groups.items():
+                for result in self.fetcher.fetch(ssids, endpoints):
+                    counts['fetched'] += 1
+                    # Checked here too so no fetcher can overwrite a good mirrored response with an empty one
+                    if result.error is None and (not isinstance(result.data, dict) or 'Data' not in result.data):
+                        result = result._replace(data=None, error=HistoryLookupFailed(
+                            "The {} history of {} didn't come back as JSON with a Data list"
+                            .format(result.endpoint, result.identifier)))
+                    if result.error is not None:
+                        failed.append(result)
+                        continue
+                    if self.mirror.put(result.identifier, result.endpoint, result.data):
+                        changed_pairs.append((result.identifier, result.endpoint))
+                    else:
+                        counts['unchanged'] += 1
+                    pending += 1
+                    if pending >= self.commit_every:
+                        self.mirror.connection.execute('COMMIT')
+                        self.mirror.connection.execute('BEGIN')
+                        pending = 0
+        finally:
+            self.mirror.connection.execute('COMMIT')
+        refetched = counts['fetched'] - len(failed)
+        report = SyncReport(counts['fetched'], changed_pairs, counts['unchanged'], failed,
+                            len(self.mirror) - refetched)
+        self.log.info("Fetched {} histories: {} changed, {} unchanged, {} failed"
+                      .format(report.fetched, len(report.changed), report.unchanged, len(report.failed)))
+        return report
@@ -0,0 +1,222 @@
+"""In-process request and flow metrics with Prometheus text and JSON exporters
+
+MetricsRegistry.response_hook is added to the client session's response hooks, so every response
+(including redirect hops and login steps) records its latency, status, size, and endpoint template,
+e.g. GET www.calpads.org/Student/{id}/Enrollment. Multi-step operations such as download_report record
+a flow span whose marks time each step (LEA switch, report page, form POST, export...).
+
+Latencies go into fixed-bucket histograms for Prometheus, which computes p50/p99 server-side, and into
+a bounded reservoir per series for the quantiles in to_json().
+"""
+import json
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Samples kept per series for the quantiles in to_json()
+RESERVOIR_SIZE = 1024
+
+# Path segments that identify a record rather than an endpoint: numbers (SSIDs, SEIDs, job IDs), emails, and GUIDs
+_ID_SEGMENT = re.compile(r'^(\d+|[^/]*@[^/]*|[0-9a-fA-F-]{32,36})$')
+
+
+def endpoint_template(url):
+    """The host and path of url with record identifiers replaced by {id}, with the query dropped
+
+    e.g. https://www.calpads.org/Student/1234567890/Enrollment?format=JSON -> www.calpads.org/Student/{id}/Enrollment
+    """
+    scheme, netloc, path, query, frag = urlsplit(url)
+    segments = ['{id}' if _ID_SEGMENT.match(segment) else segment for segment in path.split('/')]
+    return netloc + '/'.join(segments)
+
+
+class Series:
+    """A latency histogram plus a reservoir sample for one set of labels"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.samples = []
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        index = bisect_left(LATENCY_BUCKETS, seconds)
+        if index < len(self.buckets):
+            self.buckets[index] += 1
+        # Reservoir sampling keeps a uniform sample of every observation
+        if len(self.samples) < RESERVOIR_SIZE:
+            self.samples.append(seconds)
+        else:
+            slot = random.randrange(self.count)
+            if slot < RESERVOIR_SIZE:
+                self.samples[slot] = seconds
+
+    def quantile(self, q):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Flow:
+    """A span timing one multi-step operation. Call mark(step) after each step to time it.
+
+    The labels are kept for callers inspecting the flow but aren't exported, to keep the series count bounded.
+    """
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.steps = []
+        self.started = time.perf_counter()
+        self._last_mark = self.started
+        self.seconds = None
+        self.error = None
+
+    def mark(self, step):
+        """Record the time since the previous mark (or the start of the flow) as step"""
+        now = time.perf_counter()
+        self.steps.append((step, now - self._last_mark))
+        self.registry._observe_step(self.name, step, now - self._last_mark)
+        self._last_mark = now
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        """A thread-safe collection of request and flow metrics"""
+        self._lock = threading.Lock()
+        self._requests = dict()
+        self._statuses = dict()
+        self._bytes = dict()
+        self._flows = dict()
+        self._flow_outcomes = dict()
+        self._steps = dict()
+
+    def response_hook(self, r, *args, **kwargs):
+        """A requests response hook: session.hooks['response'].append(registry.response_hook)"""
+        self.observe_request(r.request.method if r.request is not None else 'GET', r.url, r.status_code,
+                             r.elapsed.total_seconds(), int(r.headers.get('Content-Length') or 0))
+        return r
+
+    def observe_request(self, method, url, status_code, seconds, bytes_received=0):
+        """Record one response. seconds is the time until the headers arrived."""
+        labels = (method.upper(), endpoint_template(url))
+        with self._lock:
+            self._requests.setdefault(labels, Series()).observe(seconds)
+            status_labels = labels + (str(status_code),)
+            self._statuses[status_labels] = self._statuses.get(status_labels, 0) + 1
+            self._bytes[labels] = self._bytes.get(labels, 0) + bytes_received
+
+    @contextmanager
+    def flow(self, name, **labels):
+        """Time a multi-step operation:
+
+            with registry.flow('download_report', report='8.1') as flow:
+                ...
+                flow.mark('iframe')
+        """
+        flow = Flow(self, name, labels)
+        try:
+            yield flow
+        except BaseException as e:
+            flow.error = e
+            raise
+        finally:
+            flow.seconds = time.perf_counter() - flow.started
+            outcome = 'ok' if flow.error is None else 'error'
+            with self._lock:
+                self._flows.setdefault(name, Series()).observe(flow.seconds)
+                self._flow_outcomes[(name, outcome)] = self._flow_outcomes.get((name, outcome), 0) + 1
+
+    def _observe_step(self, flow_name, step, seconds):
+        with self._lock:
+            self._steps.setdefault((flow_name, step), Series()).observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            for metric in (self._requests, self._statuses, self._bytes, self._flows, self._flow_outcomes,
+                           self._steps):
+                metric.clear()
+
+    def to_json(self):
+        """A JSON-serializable summary with counts and p50/p90/p99 latencies per endpoint, flow, and step"""
+        with self._lock:
+            return {'requests': [dict(method=method, endpoint=endpoint, bytes=self._bytes.get((method, endpoint), 0),
+                                      statuses={status: count for (m, e, status), count in self._statuses.items()
+                                                if (m, e) == (method, endpoint)},
+                                      **_summary(series))
+                                 for (method, endpoint), series in sorted(self._requests.items())],
+                    'flows': [dict(flow=name, ok=self._flow_outcomes.get((name, 'ok'), 0),
+                                   error=self._flow_outcomes.get((name, 'error'), 0), **_summary(series))
+                              for name, series in sorted(self._flows.items())],
+                    'steps': [dict(flow=name, step=step, **_summary(series))
+                              for (name, step), series in sorted(self._steps.items())]}
+
+    def to_prometheus(self):
+        """The metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            _histogram(lines, 'calpads_request_seconds', 'Time until response headers arrived',
+                       [({'method': method, 'endpoint': endpoint}, series)
+                        for (method, endpoint), series in sorted(self._requests.items())])
+            lines.append('# HELP calpads_responses_total Responses by status code')
+            lines.append('# TYPE calpads_responses_total counter')
+            for (method, endpoint, status), count in sorted(self._statuses.items()):
+                lines.append('calpads_responses_total{} {}'.format(
+                    _labels({'method': method, 'endpoint': endpoint, 'status': status}), count))
+            lines.append('# HELP calpads_response_bytes_total Response bytes by Content-Length')
+            lines.append('# TYPE calpads_response_bytes_total counter')
+            for (method, endpoint), total in sorted(self._bytes.items()):
+                lines.append('calpads_response_bytes_total{} {}'.format(
+                    _labels({'method': method, 'endpoint': endpoint}), total))
+            _histogram(lines, 'calpads_flow_seconds', 'Duration of multi-step operations',
+                       [({'flow': name}, series) for name, series in sorted(self._flows.items())])
+            lines.append('# HELP calpads_flows_total Multi-step operations by outcome')
+            lines.append('# TYPE calpads_flows_total counter')
+            for (name, outcome), count in sorted(self._flow_outcomes.items()):
+                lines.append('calpads_flows_total{} {}'.format(_labels({'flow': name, 'outcome': outcome}), count))
+            _histogram(lines, 'calpads_flow_step_seconds', 'Duration of each step of multi-step operations',
+                       [({'flow': name, 'step': step}, series) for (name, step), series in sorted(self._steps.items())])
+        return '\n'.join(lines) + '\n'
+
+    def dumps(self):
+        return json.dumps(self.to_json())
+
+
+def _summary(series):
+    return {'count': series.count, 'seconds': series.total, 'p50': series.quantile(0.5),
+            'p90': series.quantile(0.9), 'p99': series.quantile(0.99)}
+
+
+def _labels(labels):
+    escaped = ('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for key, value in labels.items())
+    return '{' + ','.join(escaped) + '}'
+
+
+def _histogram(lines, name, help_text, labelled_series):
+    lines.append('# HELP {} {}'.format(name, help_text))
+    lines.append('# TYPE {} histogram'.format(name))
+    for labels, series in labelled_series:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, series.buckets):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(name, _labels(dict(labels, le=repr(bound))), cumulative))
+        lines.append('{}_bucket{} {}'.format(name, _labels(dict(labels, le='+Inf')), series.count))
+        lines.append('{}_sum{} {}'.format(name, _labels(labels), series.total))
+        lines.append('{}_count{} {}'.format(name, _labels(labels), series.count))
+
+
+# Shared by every client that isn't given its own registry, so pools and bulk workers report together
+default_registry = MetricsRegistry()
@@ -0,0 +1,228 @@
+"""Parse large extract files on every core
+
+The streaming parser in extract_parser.py keeps memory flat but runs on one core, which makes it the
+bottleneck for multi-gigabyte SCSC or CRSC extracts. Extract records never span lines, so a downloaded
+extract can be cut into independent pieces: split_ranges() memory maps the file and splits it into byte
+ranges that end on a newline, and iter_parallel_batches() parses the ranges in a process pool, with each
+worker mapping the file itself, so only the range's offsets and its parsed batch cross process boundaries.
+
+Each range comes back as one column batch, either a dict of NumPy arrays or an Arrow RecordBatch, built in
+the worker so the conversion is parallel too. Batches are yielded in file order, or as soon as they're ready
+with ordered=False, and at most a couple of ranges per worker are in flight so memory stays bounded.
+
+NumPy output needs numpy (pip install calpads[numpy]) and Arrow output needs pyarrow
+(pip install calpads[arrow]). In NumPy batches dates are datetime64[D] with NaT for blanks, int and decimal
+fields are float64 with NaN for blanks, and the rest are object arrays. Arrow batches are built like the
+ones in columnar.py, with every type kept, nulls for blanks, and dictionary encoded codes.
+"""
+import logging
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from .columnar import columns_to_arrow
+from .extract_parser import DELIMITER, ExtractLayout, ExtractParseError, get_layout, is_header, iter_lines
+
+DEFAULT_RANGE_SIZE = 16 * 1024 * 1024
+
+OUTPUTS = ('numpy', 'arrow')
+
+# NumPy dtypes for each extract field type. Blank values become NaT or NaN, so ints are stored as floats.
+NUMPY_DTYPES = {'str': object,
+                'code': object,
+                'date': 'datetime64[D]',
+                'int': 'float64',
+                'decimal': 'float64',
+                'flag': object}
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("NumPy column batches require numpy. Try: pip install calpads[numpy]")
+    return numpy
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Arrow record batches require pyarrow. Try: pip install calpads[arrow]")
+    return pyarrow
+
+
+def columns_to_numpy(layout, columns):
+    """Returns {field name: NumPy array} for columns, a sequence of value sequences in the layout's field order"""
+    np = _import_numpy()
+    return {name: np.array(values, dtype=NUMPY_DTYPES[field_type])
+            for (name, field_type), values in zip(layout.fields, columns)}
+
+
+def split_ranges(path, range_size=DEFAULT_RANGE_SIZE):
+    """Splits a file into contiguous byte ranges of about range_size bytes that each end just after a newline
+
+    Args:
+        path (str or path-like): the downloaded extract
+        range_size (int, optional): the target bytes in each range. A range runs on to the end of the line it
+            would otherwise cut.
+
+    Returns:
+        list of (start, end) offsets, covering the whole file
+    """
+    if range_size < 1:
+        raise ValueError("range_size must be positive")
+    size = os.path.getsize(path)
+    if not size:
+        return []
+    ranges = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = start + range_size
+            if end < size:
+                # Searching from the range's last byte keeps a range that already ends on a newline as is
+                newline = mm.find(b'\n', end - 1)
+                end = size if newline == -1 else newline + 1
+            else:
+                end = size
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _detect_layout(path, record_type, encoding):
+    """Returns the layout of the extract at path and whether its first non-blank line is a header"""
+    if isinstance(record_type, ExtractLayout):
+        layout = record_type
+    else:
+        layout = get_layout(record_type) if record_type else None
+    header = None
+    with open(path, 'rb') as f:
+        for line in iter_lines(f, chunk_size=64 * 1024, encoding=encoding):
+            if not line:
+                continue
+            values = line.split(DELIMITER)
+            if header is None:
+                header = is_header(values, layout)
+                if not header and layout is None:
+                    layout = get_layout(values[0])
+            elif layout is None:
+                layout = get_layout(values[0])
+            if layout is not None:
+                break
+    return layout, bool(header)
+
+
+# The layouts a worker process has rebuilt, by (record type, fields). Layouts travel to the workers as plain
+# tuples because their namedtuple record classes are created at runtime and can't be pickled.
+_worker_layouts = dict()
+
+
+def _parse_range(path, start, end, record_type, fields, skip_header, encoding, output):
+    """Parses the lines in path[start:end] into one column batch, or returns None when there are no records"""
+    layout = _worker_layouts.get((record_type, fields))
+    if layout is None:
+        layout = _worker_layouts[(record_type, fields)] = ExtractLayout(record_type, fields)
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode(encoding, errors='replace')
+    convert_fields = layout.convert_fields
+    rows = []
+    for line_number, line in enumerate(text.split('\n'), start=1):
+        line = line.rstrip('\r')
+        if not line:
+            continue
+        if skip_header:
+            skip_header = False
+            continue
+        try:
+            rows.append(convert_fields(line.split(DELIMITER)))
+        except ValueError as e:
+            raise ExtractParseError("Line {} of bytes {}-{} of the {} extract: {}"
+                                    .format(line_number, start, end, record_type, e))
+    if not rows:
+        return None
+    columns = list(zip(*rows))
+    del rows
+    if output == 'arrow':
+        return columns_to_arrow(layout, columns)
+    return columns_to_numpy(layout, columns)
+
+
+def iter_parallel_batches(path, record_type=None, output='numpy', ordered=True, max_workers=None,
+                          range_size=DEFAULT_RANGE_SIZE, encoding='utf-8', executor=None):
+    """Parse a downloaded extract on several processes, yielding a column batch for each byte range
+
+    Blank lines and a header line are skipped like iter_extract_records() does. A file with a single range is
+    parsed in this process.
+
+    Args:
+        path (str or path-like): the downloaded extract
+        record_type (str or ExtractLayout, optional): the extract's record type, e.g. 'SCSC', or a custom layout.
+            Defaults to the record type code of the first row.
+        output (str, optional): 'numpy' for dicts of {field name: NumPy array} or 'arrow' for pyarrow.RecordBatch
+        ordered (bool, optional): yield the batches in file order. When False, they're yielded as they finish,
+            which keeps the workers busy when a consumer doesn't care about order.
+        max_workers (int, optional): the worker processes. Defaults to the number of CPUs.
+        range_size (int, optional): the target bytes in each range, and so in each batch's source
+        encoding (str, optional): the text encoding of the extract
+        executor (concurrent.futures.Executor, optional): a process pool to run on instead of starting one, e.g. to
+            reuse it across files. It isn't shut down.
+
+    Returns:
+        a generator of column batches
+
+    Raises:
+        ExtractParseError: when there is no layout for the record type or a value can't be converted
+        ImportError: when the output's package isn't installed
+    """
+    if output not in OUTPUTS:
+        raise ValueError("output must be one of: {}".format(', '.join(OUTPUTS)))
+    # Fail before any work is handed out when the output's package is missing
+    if output == 'arrow':
+        _import_pyarrow()
+    else:
+        _import_numpy()
+    log = logging.getLogger(__name__)
+    ranges = split_ranges(path, range_size)
+    if not ranges:
+        return
+    layout, has_header = _detect_layout(path, record_type, encoding)
+    if layout is None:
+        return
+    tasks = [(os.fspath(path), start, end, layout.record_type, layout.fields, has_header and i == 0, encoding, output)
+             for i, (start, end) in enumerate(ranges)]
+    if len(tasks) == 1 and executor is None:
+        batch = _parse_range(*tasks[0])
+        if batch is not None:
+            yield batch
+        return
+
+    max_workers = max_workers or os.cpu_count() or 1
+    log.debug("Parsing {} ranges of the {} extract on {} processes".format(len(tasks), layout.record_type,
+                                                                          max_workers))
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    # Bound the parsed batches waiting on the consumer to a couple per worker
+    max_pending = 2 * max_workers
+    tasks = deque(tasks)
+    pending = deque()
+    try:
+        while tasks or pending:
+            while tasks and len(pending) < max_pending:
+                pending.append(executor.submit(_parse_range, *tasks.popleft()))
+            if ordered:
+                batch = pending.popleft().result()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                future = done.pop()
+                pending.remove(future)
+                batch = future.result()
+            if batch is not None:
+                yield batch
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=True)
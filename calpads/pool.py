@@ -0,0 +1,179 @@
+"""A pool of independently authenticated clients for working on several LEAs in parallel
+
+The selected LEA is server-side session state, so a single CALPADSClient can only work within one LEA
+at a time and must not be shared between threads. The CALPADSClientPool keeps up to `size` logged in
+clients, leases each one to a single caller at a time, and remembers which LEA each client's session is
+working within. Leasing a client for an LEA prefers an idle client already pinned to that LEA, so
+repeated work on the same LEA skips both the login and the LEA switch.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+PoolResult = namedtuple('PoolResult', ['lea_code', 'data', 'error'])
+PoolResult.__doc__ = """The outcome of running a function for one LEA. Exactly one of data or error is not None."""
+
+
+class CALPADSClientPool:
+
+    def __init__(self, credentials, size=None, client_factory=None):
+        """Lease authenticated clients pinned to LEAs to concurrent callers
+
+        Args:
+            credentials (list of tuples): (username, password) pairs. Clients are spread across them round-robin, so
+                several accounts can be used to keep any one of them from carrying every session.
+            size (int, optional): the most clients, and so the most concurrent sessions, to keep. Defaults to the
+                number of credentials.
+            client_factory (callable, optional): takes a username and password and returns a new, authenticated
+                client. Defaults to creating CALPADSClients that share one CALPADSTransport.
+        """
+        if not credentials:
+            raise ValueError("At least one (username, password) pair is required")
+        # The transport the pool created for its clients, if any, shut down with the pool
+        self._transport = None
+        if client_factory is None:
+            from .client import CALPADSClient
+            from .transport import CALPADSTransport
+            # One transport for the whole pool, so its rate limits cover every session
+            transport = self._transport = CALPADSTransport()
+
+            def client_factory(username, password):
+                return CALPADSClient(username, password, transport=transport)
+        self.credentials = list(credentials)
+        self.size = size or len(self.credentials)
+        self.client_factory = client_factory
+        self._idle = []
+        self._leased = set()
+        self._creating = 0
+        self._created = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self.log = logging.getLogger(__name__)
+
+    @contextmanager
+    def lease(self, lea_code=None, timeout=None):
+        """Borrow a client working within lea_code for the duration of the with block
+
+        Args:
+            lea_code (str, optional): the LEA the client should be working within. When None, the client is left in
+                whatever LEA it last worked in.
+            timeout (float, optional): how long to wait for a client to free up. Defaults to waiting indefinitely.
+
+        Yields:
+            CALPADSClient: the caller has exclusive use of it until the block exits
+
+        Raises:
+            TimeoutError: when no client frees up within timeout seconds
+        """
+        client = self._acquire(lea_code, timeout)
+        try:
+            if lea_code is not None:
+                client._select_lea(lea_code)
+            yield client
+        finally:
+            self._release(client)
+
+    def run(self, function, lea_codes, max_workers=None):
+        """Call function(client, lea_code) for every LEA in parallel, each with its own leased client
+
+        Args:
+            function (callable): takes a leased client and the lea_code it is working within
+            lea_codes (iterable of str): the LEAs to run function for
+            max_workers (int, optional): the number of threads. Defaults to the pool size.
+
+        Returns:
+            a generator of PoolResult namedtuples in completion order
+        """
+        with ThreadPoolExecutor(max_workers=max_workers or self.size) as executor:
+            futures = {executor.submit(self._run_one, function, lea_code): lea_code for lea_code in lea_codes}
+            for future in as_completed(futures):
+                try:
+                    yield PoolResult(futures[future], future.result(), None)
+                except Exception as e:
+                    self.log.info("Failed running {} for LEA {}: {}".format(function, futures[future], e))
+                    yield PoolResult(futures[future], None, e)
+
+    @property
+    def stats(self):
+        """A dict with the number of clients logged in, idle, and currently leased"""
+        with self._condition:
+            return {'created': self._created, 'idle': len(self._idle), 'leased': len(self._leased)}
+
+    def close(self):
+        """Close the sessions of every idle client, and the transport the pool created for them. Leased clients are
+        closed when they are returned."""
+        with self._condition:
+            self._closed = True
+            for client in self._idle:
+                client.session.close()
+            self._idle = []
+            self._condition.notify_all()
+        if self._transport is not None:
+            self._transport.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run_one(self, function, lea_code):
+        with self.lease(lea_code) as client:
+            return function(client, lea_code)
+
+    def _acquire(self, lea_code, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("The client pool is closed")
+                client = self._pick_idle(lea_code)
+                if client is not None:
+                    self._leased.add(client)
+                    return client
+                if len(self._leased) + self._creating < self.size:
+                    credentials = self.credentials[self._created % len(self.credentials)]
+                    self._created += 1
+                    self._creating += 1
+                    break
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No client in the pool freed up within {} seconds".format(timeout))
+                self._condition.wait(remaining)
+        # Log in outside of the lock so other callers can keep leasing idle clients meanwhile
+        try:
+            client = self.client_factory(*credentials)
+        except Exception:
+            with self._condition:
+                self._creating -= 1
+                self._created -= 1
+                self._condition.notify()
+            raise
+        self.log.debug("Logged in a new client as {}".format(credentials[0]))
+        with self._condition:
+            self._creating -= 1
+            self._leased.add(client)
+        return client
+
+    def _pick_idle(self, lea_code):
+        """Pops the best idle client for lea_code: one pinned to it, then an unpinned one, then any. Needs the lock."""
+        if not self._idle:
+            return None
+        for preference in (lambda c: c._selected_lea == lea_code, lambda c: c._selected_lea is None):
+            for i, client in enumerate(self._idle):
+                if preference(client):
+                    return self._idle.pop(i)
+        # Reuse the least recently returned client
+        return self._idle.pop(0)
+
+    def _release(self, client):
+        with self._condition:
+            self._leased.discard(client)
+            if self._closed:
+                client.session.close()
+            else:
+                self._idle.append(client)
+            self._condition.notify()
@@ -0,0 +1,121 @@
+"""Index of the reports listed on the CALPADS ODS and Snapshot report pages
+
+Finding a report's URL used to mean fetching and scanning the whole ODS or Snapshot listing on every
+download. The ReportCatalog parses both listings once into a (report code, is_snapshot) index, keeps it
+for a time-to-live, and can optionally persist it to disk so that separate processes can share it.
+"""
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+from urllib.parse import urljoin
+from lxml import etree
+
+ReportEntry = namedtuple('ReportEntry', ['code', 'title', 'url', 'is_snapshot'])
+ReportEntry.__doc__ = """A report on the listing pages. code is lower-cased, e.g. '8.1' or '1.17'."""
+
+ODS_LISTING_PATH = '/Report/ODS'
+SNAPSHOT_LISTING_PATH = '/Report/Snapshot'
+
+# Reports that can be downloaded but do not show up on the listing pages: (code, title, path, is_snapshot)
+UNLISTED_REPORTS = (('8.1eoy3', 'Student Profile List (EOY 3)',
+                     '/Report/Snapshot/8_1_StudentProfileList_EOY3_', True),)
+
+
+def parse_report_listing(page_text, host, is_snapshot):
+    """Parse an ODS or Snapshot listing page into a list of ReportEntry"""
+    root = etree.fromstring(page_text, parser=etree.HTMLParser(encoding='utf8'))
+    entries = []
+    for element in root.xpath("//*[@class='num-wrap-in']"):
+        if not element.text:
+            continue
+        try:
+            anchor = element.xpath('./../../a')[0]
+        except IndexError:
+            continue
+        code = element.text.strip()
+        # The anchor's text includes the report number, so drop it from the title
+        title = ' '.join(' '.join(anchor.itertext()).split())
+        if title.startswith(code):
+            title = title[len(code):].strip()
+        entries.append(ReportEntry(code.lower(), title, urljoin(host, anchor.attrib['href']), is_snapshot))
+    return entries
+
+
+class ReportCatalog:
+
+    def __init__(self, ttl=12 * 60 * 60, cache_path=None):
+        """In-memory, optionally disk-backed, index of the CALPADS report listings
+
+        Args:
+            ttl (float): how many seconds the parsed listings are trusted before they are fetched again.
+                Defaults to 12 hours.
+            cache_path (str, optional): a JSON file used to persist the index across processes. It is read on
+                first use and rewritten whenever the listings are refreshed.
+        """
+        self.ttl = ttl
+        self.cache_path = cache_path
+        self.fetched_at = None
+        self._index = dict()
+        self.log = logging.getLogger(__name__)
+        if cache_path:
+            self._load_from_disk()
+
+    @property
+    def is_stale(self):
+        return self.fetched_at is None or (time.time() - self.fetched_at) > self.ttl
+
+    def load_listings(self, ods_page_text, snapshot_page_text, host):
+        """Replace the index with freshly fetched ODS and Snapshot listing pages"""
+        entries = (parse_report_listing(ods_page_text, host, False)
+                   + parse_report_listing(snapshot_page_text, host, True)
+                   + [ReportEntry(code, title, urljoin(host, path), is_snapshot)
+                      for code, title, path, is_snapshot in UNLISTED_REPORTS])
+        self._index = {(entry.code, entry.is_snapshot): entry for entry in entries}
+        self.fetched_at = time.time()
+        self.log.debug("Indexed {} reports".format(len(self._index)))
+        if self.cache_path:
+            self._save_to_disk()
+
+    def get(self, report_code, is_snapshot=False):
+        """Returns the ReportEntry for report_code (case insensitive), or None when it isn't listed"""
+        return self._index.get((report_code.lower(), is_snapshot))
+
+    def entries(self, is_snapshot=None):
+        """Returns every ReportEntry, optionally only the Snapshot (True) or ODS (False) reports"""
+        return sorted((entry for entry in self._index.values()
+                       if is_snapshot is None or entry.is_snapshot == is_snapshot),
+                      key=lambda entry: (entry.is_snapshot, _report_sort_key(entry.code)))
+
+    def invalidate(self):
+        """Forget the index so the listings are fetched again on next use"""
+        self.fetched_at = None
+        self._index = dict()
+
+    def _save_to_disk(self):
+        tmp_path = '{}.{}.tmp'.format(self.cache_path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump({'fetched_at': self.fetched_at,
+                       'reports': [list(entry) for entry in self._index.values()]}, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def _load_from_disk(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf8') as f:
+                cached = json.load(f)
+            entries = [ReportEntry(*report) for report in cached['reports']]
+        except (OSError, ValueError, KeyError, TypeError):
+            self.log.debug("No usable report catalog cache at {}".format(self.cache_path))
+            return
+        self._index = {(entry.code, entry.is_snapshot): entry for entry in entries}
+        self.fetched_at = cached['fetched_at']
+
+
+def _report_sort_key(code):
+    """Sort '1.2' before '1.17' and '8.1' before '8.1eoy3'"""
+    parts = []
+    for part in code.split('.'):
+        digits = ''.join(c for c in part if c.isdigit())
+        parts.append((int(digits) if digits else 0, part))
+    return parts
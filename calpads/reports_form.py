@@ -20,6 +20,14 @@ REPORTS_DL_FORMAT = {'CSV': 'CSV',
                      'XML': 'XML',
                      'DATAFEED': 'ATOM'}
 
+def _dropdown_div_id(node_id):
+    """Trims a node id like 'ReportViewer_ctl04_ctl05_divDropDown_ctl02' to its dropdown div id"""
+    idx = node_id.find('_divDropDown')
+    if idx == -1:
+        return node_id
+    return node_id[:idx + len('_divDropDown')]
+
+
 class ReportsForm:
 
     def __init__(self, page_source):
@@ -38,41 +46,60 @@ class ReportsForm:
         self.filtered_parse = self.filter_parsed_form()
 
     def parse_the_form(self):
-        all_form_elements = self.root.xpath("//*[@data-parametername]")
-        params_dict = dict.fromkeys([tag.attrib['data-parametername'] for tag in all_form_elements])
-        #self.log.debug('This is the init params_dict: \n{}'.format(params_dict))
-        for element in all_form_elements:
-            tag_combos = []
+        """Parse every report parameter in a single pass over the document.
+
+        Besides the complete parse, this builds case-folded lookup indexes used by fill_form():
+        self.select_index maps parameter name -> (form field name, {folded option text: value}) and
+        self.dropdown_index maps parameter name -> (form field name, {folded label text: index}).
+        """
+        self.select_index = dict()
+        self.dropdown_index = dict()
+        # Nodes needed by the multi-select dropdowns live outside of their parameter's div, so index them once
+        # by the dropdown div id instead of searching the whole document for every parameter and every option
+        hidden_inputs = dict()
+        labels = dict()
+        for tag in self.root.iter('input', 'label'):
+            if tag.tag == 'input' and tag.attrib.get('type') == 'hidden':
+                hidden_inputs.setdefault(_dropdown_div_id(tag.attrib.get('id', '')), tag)
+            elif tag.tag == 'label' and tag.attrib.get('for'):
+                labels.setdefault(_dropdown_div_id(tag.attrib['for']), []).append(tag)
+
+        params_dict = dict()
+        for element in self.root.xpath("//*[@data-parametername]"):
             key = element.attrib['data-parametername']
-            for child in element.xpath('.//*'):
+            if key in params_dict:
+                continue
+            tag_combos = []
+            first_select = None
+            first_input = None
+            for child in element.iterdescendants(tag=etree.Element):
                 tag_combos.append(
                     child.tag)  # Find all the tags that are under the parameter div (i.e. where the form field is located)
                 if 'calendar' in child.attrib.get('class', ''):
                     tag_combos = tag_combos[
                                  :-2]  # If it's a calendar date input, remove the last two tags so it's treated like a textbox
-            params_dict[key] = [tuple(tag_combos)]
+                if child.tag == 'select' and first_select is None:
+                    first_select = child
+                elif child.tag == 'input' and first_input is None:
+                    first_input = child
+            param_values = [tuple(tag_combos)]
+            params_dict[key] = param_values
 
-        for parametername, param_values in params_dict.items():
             if param_values[0][0] == 'select':
-                select = self.root.xpath("//*[@data-parametername='{}']//select".format(parametername))[0]
-                param_values.append(('select',
-                                     tuple((unicodedata.normalize('NFKC', option.text),
-                                            # This is the key associated with the request form data
-                                            select.attrib.get('name'),
-                                            # The value is what actually needs to be passed to the form upon submission
-                                            unicodedata.normalize('NFKC', option.attrib.get('value')))
-                                           for option in select.xpath('.//*')
-                                           if unicodedata.normalize('NFKC', option.text) != '<Select a Value>')
-                                     )
-                                    )
+                formname = first_select.attrib.get('name')
+                options = []
+                for option in first_select.iterdescendants(tag=etree.Element):
+                    text = unicodedata.normalize('NFKC', option.text)
+                    if text == '<Select a Value>':
+                        continue
+                    # The value is what actually needs to be passed to the form upon submission
+                    options.append((text, formname, unicodedata.normalize('NFKC', option.attrib.get('value'))))
+                param_values.append(('select', tuple(options)))
+                # Later duplicates win, matching a linear scan for the last case-insensitive match
+                self.select_index[key] = (formname, {text.casefold(): value for text, _, value in options})
 
             elif param_values[0][-1] == 'input':
-                param_values.append(('textbox', ('plain text',
-                                                 self.root.xpath("//*[@data-parametername='{}']"
-                                                            .format(parametername))[0]
-                                                 .xpath(".//input")[0]
-                                                 .get('name'))
-                                     ))
+                param_values.append(('textbox', ('plain text', first_input.get('name'))))
 
             elif param_values[0][-1] == 'label':
                 param_values.append(('textbox_defaultnull', ('plain text',
@@ -80,19 +107,16 @@ class ReportsForm:
                                      ))
 
             else:
-                form_input_div = self.root.xpath("//*[@data-parametername='{}']".format(parametername))[0]
-                div_id = form_input_div.attrib['id'] + '_divDropDown'
-                all_input_labels = self.root.xpath('//*[contains(@for, "{}")]'.format(div_id))
-                all_input_labels_txt = [unicodedata.normalize('NFKC', label.text) for label in all_input_labels
-                                        if unicodedata.normalize('NFKC', label.text) != '(Select All)']
-                dict_opts = dict.fromkeys(all_input_labels_txt)
-                for idx, item in enumerate(all_input_labels_txt):
-                    dict_opts[item] = ((True, False),
-                                       self.root.xpath('//input[@type="hidden" and contains(@id, "{}")]'
-                                                  .format(div_id))[0].attrib.get('name'),
-                                       str(idx)
-                                       )  # Append the index which will be used for filling in the form
+                div_id = element.attrib['id'] + '_divDropDown'
+                all_input_labels_txt = [unicodedata.normalize('NFKC', label.text) for label in labels.get(div_id, [])]
+                all_input_labels_txt = [text for text in all_input_labels_txt if text != '(Select All)']
+                hidden_input = hidden_inputs.get(div_id)
+                formname = hidden_input.attrib.get('name') if hidden_input is not None else None
+                # Append the index which will be used for filling in the form
+                dict_opts = {item: ((True, False), formname, str(idx)) for idx, item in enumerate(all_input_labels_txt)}
                 param_values.append(('dropdown', dict_opts))
+                self.dropdown_index[key] = (formname, {item.casefold(): str(idx)
+                                                       for idx, item in enumerate(all_input_labels_txt)})
 
         return params_dict
 
@@ -127,28 +151,19 @@ class ReportsForm:
             #Check if the key that the user provided is expected, otherwise log and do nothing
             if self.complete_parse.get(paramname):
                 if self.complete_parse[paramname][1][0] == 'select':
-                    #self.log.debug(self.complete_parse[paramname][1][1])
-                    formname = self.complete_parse[paramname][1][1][0][1] #TODO: Make value easier to get?
-                    formval = None
-                    for val_tuple in self.complete_parse[paramname][1][1]:
-                        if val_tuple[0].lower() == paramvalue.lower():
-                            formval = val_tuple[2]
+                    formname, valid_values = self.select_index[paramname]
+                    formval = valid_values.get(str(paramvalue).casefold())
                     if formval is None:
                         self.log.info("Provided {} input was not processed: {}"
                                       .format(paramname, paramvalue))
                         continue
                     to_submit[formname] = formval
                 elif self.complete_parse[paramname][1][0] == 'dropdown':
-                    valid_dict = self.complete_parse[paramname][1][1]
-                    formname = valid_dict[list(valid_dict.keys())[0]][1] #TODO: Maybe we should make this value easier to get?
-                    formval = ''
-                    for checkbox, checked in paramvalue.items():
-                        if checkbox in valid_dict.keys():
-                            if checked: #Double checking that the user sent True/truthy value
-                                if formval:
-                                    formval = ','.join([formval, valid_dict[checkbox][2]])
-                                else:
-                                    formval += valid_dict[checkbox][2]
+                    formname, valid_values = self.dropdown_index[paramname]
+                    #Double checking that the user sent True/truthy value
+                    checked_indexes = [valid_values[checkbox.casefold()] for checkbox, checked in paramvalue.items()
+                                       if checked and checkbox.casefold() in valid_values]
+                    formval = ','.join(checked_indexes)
                     if formval == '':
                         self.log.info("Provided {} input was not processed: {}"
                                       .format(paramname, paramvalue))
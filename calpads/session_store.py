@@ -0,0 +1,198 @@
+"""Persisted authenticated sessions, so new clients can skip the login dance
+
+Logging in walks /Account/Login, /connect/authorize, and its callback, which costs several requests and
+HTML parses. A SessionStore saves the cookies of an authenticated session so the next client created
+with the same credentials (in this process, or any process on the host for the FileSessionStore) can
+reuse them while CALPADS still honors them. Restored cookies are trusted without a round trip; once
+they have expired, the first request is bounced to the login page and the client logs in again.
+
+Processes sharing a session also share its server-side selected LEA. The store records the LEA last
+selected in the session, and a client only skips selecting an LEA when the store agrees the session is
+still working within it. Nothing stops another process from switching right after that check, though, so
+processes sharing a session should still work within the same LEA or switch LEAs one at a time.
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from requests.cookies import create_cookie
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+# Bump when the shape of the saved state changes so old files are ignored
+SESSION_STATE_VERSION = 1
+
+
+def session_key(host, username):
+    """The key a session is saved under. A digest, so usernames don't end up in file names."""
+    return hashlib.sha256('{}|{}'.format(host, username.casefold()).encode('utf8')).hexdigest()
+
+
+def dump_cookies(cookie_jar):
+    """Serialize a cookie jar to a list of dicts"""
+    return [{'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain, 'path': cookie.path,
+             'secure': cookie.secure, 'expires': cookie.expires,
+             'rest': {'HttpOnly': None} if cookie.has_nonstandard_attr('HttpOnly') else {}}
+            for cookie in cookie_jar]
+
+
+def load_cookies(cookie_jar, cookies):
+    """Add the cookies from dump_cookies() to cookie_jar, skipping any that have expired"""
+    now = time.time()
+    for cookie in cookies:
+        if cookie.get('expires') is not None and cookie['expires'] <= now:
+            continue
+        cookie_jar.set_cookie(create_cookie(**cookie))
+
+
+class SessionStore:
+    """Base class for session stores. Subclasses implement load(), save(), and clear(), and may override lock()."""
+
+    def __init__(self, ttl=8 * 60 * 60):
+        """
+        Args:
+            ttl (float, optional): seconds after which a saved session is no longer offered. Defaults to 8 hours.
+        """
+        self.ttl = ttl
+        self.log = logging.getLogger(__name__)
+
+    def load(self, key):
+        """Returns the saved state dict with 'cookies', 'selected_lea', and 'saved_at', or None"""
+        raise NotImplementedError
+
+    def save(self, key, cookies, selected_lea=None):
+        """Save the cookies from dump_cookies() under key, with the LEA the session is working within"""
+        raise NotImplementedError
+
+    def clear(self, key):
+        """Forget the session saved under key"""
+        raise NotImplementedError
+
+    @contextmanager
+    def lock(self, key):
+        """Held while a client restores or logs in a session, so only one of them runs the login dance"""
+        yield
+
+    def _is_fresh(self, state):
+        return (state is not None and state.get('version') == SESSION_STATE_VERSION
+                and (self.ttl is None or time.time() - state.get('saved_at', 0) <= self.ttl))
+
+    def _state(self, cookies, selected_lea=None):
+        return {'version': SESSION_STATE_VERSION, 'saved_at': time.time(), 'cookies': cookies,
+                'selected_lea': selected_lea}
+
+
+class MemorySessionStore(SessionStore):
+    """Shares sessions between clients in the same process"""
+
+    def __init__(self, ttl=8 * 60 * 60):
+        super().__init__(ttl)
+        self._states = dict()
+        self._locks = dict()
+        self._locks_lock = threading.Lock()
+
+    def load(self, key):
+        state = self._states.get(key)
+        return state if self._is_fresh(state) else None
+
+    def save(self, key, cookies, selected_lea=None):
+        self._states[key] = self._state(cookies, selected_lea)
+
+    def clear(self, key):
+        self._states.pop(key, None)
+
+    @contextmanager
+    def lock(self, key):
+        with self._locks_lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            yield
+
+
+class FileSessionStore(SessionStore):
+
+    def __init__(self, directory, encryption_key=None, ttl=8 * 60 * 60):
+        """Shares sessions between processes on the same host through files in directory
+
+        Files are written atomically with owner-only permissions, and an flock on a companion .lock file keeps
+        processes from logging in at the same time (on platforms with fcntl).
+
+        Args:
+            directory (str): where the session files are kept. Created if it doesn't exist.
+            encryption_key (bytes or str, optional): a Fernet key, e.g. from cryptography.fernet.Fernet.generate_key(),
+                used to encrypt the saved cookies. Requires the cryptography package. Without it, the cookies are
+                saved in plain text and protected only by file permissions.
+            ttl (float, optional): seconds after which a saved session is no longer offered. Defaults to 8 hours.
+        """
+        super().__init__(ttl)
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._fernet = None
+        if encryption_key is not None:
+            try:
+                from cryptography.fernet import Fernet
+            except ImportError:
+                raise ImportError("Encrypting the session store requires cryptography. Try: pip install calpads[crypto]")
+            self._fernet = Fernet(encryption_key)
+        self._thread_lock = threading.Lock()
+
+    def load(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                payload = f.read()
+            if self._fernet is not None:
+                payload = self._fernet.decrypt(payload)
+            state = json.loads(payload.decode('utf8'))
+        except (OSError, ValueError) as e:
+            self.log.debug("No usable saved session for {}: {}".format(key[:8], e.__class__.__name__))
+            return None
+        except Exception as e:
+            # e.g. cryptography.fernet.InvalidToken when the key changed
+            self.log.info("Could not decrypt the saved session: {}".format(e.__class__.__name__))
+            return None
+        return state if self._is_fresh(state) else None
+
+    def save(self, key, cookies, selected_lea=None):
+        payload = json.dumps(self._state(cookies, selected_lea)).encode('utf8')
+        if self._fernet is not None:
+            payload = self._fernet.encrypt(payload)
+        path = self._path(key)
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+    def clear(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def lock(self, key):
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._path(key) + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _path(self, key):
+        return os.path.join(self.directory, '{}.session'.format(key))
+
+
+def generate_key():
+    """A new random Fernet-compatible key for FileSessionStore(encryption_key=...)"""
+    return base64.urlsafe_b64encode(os.urandom(32))
@@ -0,0 +1,227 @@
+"""Rate limiting, retries, timeouts, and adaptive concurrency for every CALPADS request
+
+CALPADSTransport is a requests transport adapter mounted on the client's session, so every request
+(including each hop of a redirect and each step of the login dance) passes through it. For each host
+it keeps:
+
+* a token bucket capping the request rate,
+* an AIMD limit on the number of requests in flight: it grows by one slot for every `limit` fast,
+  successful responses and halves on a 429, a 5xx, or a response slower than slow_latency,
+* retries with jittered exponential backoff (honoring Retry-After) for idempotent requests that fail
+  with a connection error or a retryable status,
+* a default timeout, so a stalled connection can't hang a run forever.
+
+A request holds its concurrency slot until its response headers arrive. The body of a streamed response,
+e.g. an extract download, is read after the slot is released, so it isn't counted against the limit:
+holding slots for minutes-long downloads would starve the listing polls that run alongside them, and a
+caller that keeps a stream open while making other requests could deadlock.
+
+One transport can be shared by several clients, e.g. every worker of a BulkHistoryFetcher, so the
+limits apply to all of them together. requests closes every adapter mounted on a session whenever the
+session is closed, including at the end of each `with session:` block, so close() leaves the shared
+connection pools alone; call shutdown() once every client is done with the transport.
+"""
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+
+# Requests that are safe to send again
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# (requests per second, burst) for each host. reports.calpads.org runs SSRS, which is slower to render.
+DEFAULT_HOST_RATES = {'www.calpads.org': (10.0, 20),
+                      'reports.calpads.org': (4.0, 8)}
+DEFAULT_RATE = (10.0, 20)
+
+# (connect, read) seconds
+DEFAULT_TIMEOUT = (10, 300)
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst):
+        """Allows rate requests per second on average, and bursts of up to burst requests
+
+        Args:
+            rate (float): tokens added per second
+            burst (int): the most tokens the bucket holds
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it. Returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class AdaptiveConcurrency:
+
+    def __init__(self, initial=4, minimum=1, maximum=32, slow_latency=15.0):
+        """An AIMD limit on the requests in flight to one host
+
+        Args:
+            initial (int): the starting limit
+            minimum (int): the limit never drops below this
+            maximum (int): the limit never grows past this
+            slow_latency (float): seconds after which a response counts as a sign of an overloaded server
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.slow_latency = slow_latency
+        self.limit = float(initial)
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, overloaded=False):
+        """Free a slot and adjust the limit from the outcome of the request that held it
+
+        Args:
+            latency (float, optional): seconds until the response headers arrived. None if the request failed.
+            overloaded (bool): whether the server signaled it is overloaded, e.g. with a 429 or 5xx
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if overloaded or (latency is not None and latency > self.slow_latency):
+                self.limit = max(self.minimum, self.limit / 2)
+            elif latency is not None:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class HostLimits:
+    """The token bucket and concurrency limit for one host"""
+
+    def __init__(self, rate, burst, concurrency):
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+
+
+class CALPADSTransport(HTTPAdapter):
+
+    def __init__(self, host_rates=None, default_rate=DEFAULT_RATE, retries=3, backoff=0.5, max_backoff=30.0,
+                 timeout=DEFAULT_TIMEOUT, initial_concurrency=4, max_concurrency=32, slow_latency=15.0, **kwargs):
+        """A transport adapter that throttles, retries, and times out requests. Mount it with session.mount().
+
+        Args:
+            host_rates (dict, optional): {host: (requests per second, burst)}. Defaults to DEFAULT_HOST_RATES.
+            default_rate (tuple, optional): the (requests per second, burst) for any other host
+            retries (int, optional): the most times an idempotent request is retried. Defaults to 3.
+            backoff (float, optional): the first delay between retries, doubled on each one. Defaults to 0.5 seconds.
+            max_backoff (float, optional): the longest delay between retries. Defaults to 30 seconds.
+            timeout (float or tuple, optional): the default (connect, read) timeout for requests made without one
+            initial_concurrency (int, optional): the starting limit on requests in flight per host
+            max_concurrency (int, optional): the most requests in flight per host. Also sizes the connection pool.
+            slow_latency (float, optional): seconds after which a response shrinks the concurrency limit
+            kwargs: passed on to requests.adapters.HTTPAdapter
+        """
+        kwargs.setdefault('pool_maxsize', max_concurrency)
+        super().__init__(**kwargs)
+        self.host_rates = DEFAULT_HOST_RATES if host_rates is None else host_rates
+        self.default_rate = default_rate
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.slow_latency = slow_latency
+        self._hosts = dict()
+        self._hosts_lock = threading.Lock()
+        self.log = logging.getLogger(__name__)
+
+    def close(self):
+        """Does nothing, so closing one client's session doesn't drop the connections the others are using"""
+
+    def shutdown(self):
+        """Close the pooled connections. The transport opens new ones if it's used again."""
+        super().close()
+
+    def limits(self, host):
+        """Returns the HostLimits for host, creating them on first use"""
+        with self._hosts_lock:
+            limits = self._hosts.get(host)
+            if limits is None:
+                rate, burst = self.host_rates.get(host, self.default_rate)
+                limits = HostLimits(rate, burst, AdaptiveConcurrency(self.initial_concurrency,
+                                                                     maximum=self.max_concurrency,
+                                                                     slow_latency=self.slow_latency))
+                self._hosts[host] = limits
+            return limits
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        limits = self.limits(urlsplit(request.url).netloc)
+        idempotent = request.method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            limits.bucket.acquire()
+            limits.concurrency.acquire()
+            started = time.monotonic()
+            try:
+                response = super().send(request, timeout=timeout, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                limits.concurrency.release(overloaded=isinstance(e, Timeout))
+                # A connect timeout means nothing was sent, so even a POST is safe to retry
+                if attempt >= self.retries or not (idempotent or isinstance(e, ConnectTimeout)):
+                    raise
+                delay = self._backoff(attempt)
+                self.log.info("Retrying {} {} in {:.1f}s after {!r}".format(request.method, request.url, delay, e))
+            else:
+                latency = time.monotonic() - started
+                overloaded = response.status_code in RETRY_STATUSES
+                limits.concurrency.release(latency, overloaded)
+                if not (overloaded and idempotent and attempt < self.retries):
+                    return response
+                delay = retry_after(response) or self._backoff(attempt)
+                self.log.info("Retrying {} {} in {:.1f}s after a {}".format(request.method, request.url, delay,
+                                                                         response.status_code))
+                response.close()
+            time.sleep(min(delay, self.max_backoff))
+            attempt += 1
+
+    def _backoff(self, attempt):
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+
+def retry_after(response):
+    """The seconds a response's Retry-After header asks to wait, or None"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
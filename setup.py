@@ -21,5 +21,12 @@ setup(
     install_requires=[
     "lxml>=4.4.1, <5.0.0", #Might not need 4.4.1 exactly, but for now
     "requests>=2.22.0, <3.0.0"
-    ]
+    ],
+    extras_require={
+    "async": ["aiohttp>=3.6.0, <4.0.0"],
+    "crypto": ["cryptography>=2.8"],
+    "numpy": ["numpy>=1.17"],
+    "arrow": ["pyarrow>=1.0"],
+    "zstd": ["zstandard>=0.15"]
+    }
 )
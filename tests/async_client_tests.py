@@ -0,0 +1,89 @@
+import asyncio
+import io
+import threading
+import unittest
+from tests.fake_calpads import FakeCALPADSServer
+
+try:
+    import aiohttp
+    from calpads.async_client import AsyncCALPADSClient
+except ImportError:
+    aiohttp = None
+
+
+@unittest.skipIf(aiohttp is None, "aiohttp is not installed")
+class AsyncClientTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeCALPADSServer(username='user', password='pass', schools=5, report_bytes=10 * 1024,
+                                       extract_bytes=10 * 1024)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def run_with_client(self, flow):
+        async def run():
+            async with AsyncCALPADSClient('user', 'pass', host=self.server.url) as client:
+                return client, await flow(client)
+        return asyncio.run(run())
+
+    def test_login(self):
+        client, connected = self.run_with_client(lambda client: asyncio.sleep(0, client.is_connected))
+        self.assertTrue(connected)
+        self.assertEqual(client.host, self.server.url)
+        self.assertEqual(client.last_login.steps, 2)
+
+    def test_concurrent_requests_share_one_login(self):
+        async def flow(client):
+            self.server.expire()
+            client.last_login = None
+            return await asyncio.gather(*(client.get_enrollment_history(str(1000000000 + i)) for i in range(5)))
+        client, histories = self.run_with_client(flow)
+        self.assertEqual([history['Data'][0]['SSID'] for history in histories],
+                         [str(1000000000 + i) for i in range(5)])
+        self.assertEqual(client._auth_generation, 2)
+        self.assertEqual(client.last_login.steps, 2)
+
+    def test_history_lookups(self):
+        async def flow(client):
+            return await asyncio.gather(client.get_enrollment_history('1000000001'),
+                                        client.get_demographics_history('1000000001'),
+                                        client.get_staff_courses_history('2000000001'))
+        _, (enrollment, demographics, courses) = self.run_with_client(flow)
+        self.assertEqual(enrollment['Data'][0]['Endpoint'], 'Enrollment')
+        self.assertEqual(demographics['Data'][0]['SSID'], '1000000001')
+        self.assertEqual(courses['Data'][0]['Endpoint'], 'StaffCourses')
+
+    def test_report_download(self):
+        sink = io.BytesIO()
+
+        async def flow(client):
+            return await client.download_report(self.server.lea_codes[1], '1.1', file_name=sink,
+                                                 form_data={'AcademicYear': '2019-2020'}, checksum='sha256')
+        client, downloaded = self.run_with_client(flow)
+        self.assertTrue(downloaded)
+        self.assertEqual(sink.getvalue(), self.server.payload('REPORT', self.server.report_bytes))
+        # The export URL is built against the report server that rendered the form
+        self.assertTrue(client.last_download.url.startswith(self.server.url))
+        self.assertIsNotNone(client.last_download.checksum)
+
+    def test_session_expiry_within_an_lea(self):
+        lea_code = self.server.lea_codes[1]
+
+        async def flow(client):
+            await client.get_user_orgs(lea_code, 'user')
+            self.server.expire()
+            return await client.get_user_orgs(lea_code, 'user')
+        client, orgs = self.run_with_client(flow)
+        # The GET was replayed after logging back in and selecting the LEA again
+        self.assertEqual(orgs['Data'][0]['OrgCode'], lea_code)
+        self.assertEqual(client._selected_lea, lea_code)
+        self.assertEqual(client._auth_generation, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from calpads.auth import LoginFlow
+from calpads.exceptions import AuthenticationError
+from tests.fake_calpads import LOGIN_PAGE, CALLBACK_PAGE
+
+LOGIN_URL = 'https://www.calpads.org/Account/Login?ReturnUrl=%2F'
+CALLBACK_URL = 'https://www.calpads.org/connect/authorize/callback?ReturnUrl=%2F'
+
+
+class LoginFlowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.flow = LoginFlow({'Username': 'user', 'Password': 'pass'}, 'https://www.calpads.org/')
+
+    def test_steps(self):
+        step = self.flow.next_step(LOGIN_URL, 200, LOGIN_PAGE.format(return_url='/'))
+        self.assertEqual((step.state, step.method, step.url), ('credentials', 'POST', LOGIN_URL))
+        self.assertEqual(step.data['__RequestVerificationToken'], 'login-token')
+        self.assertEqual(step.data['ReturnUrl'], '/')
+        self.flow.record(CALLBACK_URL, 200)
+        step = self.flow.next_step(CALLBACK_URL, 200, CALLBACK_PAGE.format(return_url='%2F'))
+        self.assertEqual(step.state, 'openid')
+        self.assertEqual(step.url, 'https://www.calpads.org/signin-oidc?ReturnUrl=%2F')
+        self.assertEqual(step.data, {'code': 'abc', 'state': 'xyz'})
+        self.flow.record('https://www.calpads.org/', 200)
+        self.assertIsNone(self.flow.next_step('https://www.calpads.org/', 200, '<html></html>'))
+        self.assertEqual(self.flow.steps, 2)
+
+    def test_rejected_credentials(self):
+        self.flow.next_step(LOGIN_URL, 200, LOGIN_PAGE.format(return_url='/'))
+        self.flow.record(LOGIN_URL, 200)
+        with self.assertRaises(AuthenticationError):
+            self.flow.next_step(LOGIN_URL, 200, LOGIN_PAGE.format(return_url='/'))
+
+    def test_step_limit(self):
+        flow = LoginFlow({}, 'https://www.calpads.org/', max_steps=2)
+        for _ in range(2):
+            flow.next_step(CALLBACK_URL, 200, CALLBACK_PAGE.format(return_url='%2F'))
+            flow.record(CALLBACK_URL, 200)
+        with self.assertRaises(AuthenticationError):
+            flow.next_step(CALLBACK_URL, 200, CALLBACK_PAGE.format(return_url='%2F'))
+
+    def test_unparseable_login_page(self):
+        with self.assertRaises(AuthenticationError):
+            self.flow.next_step(LOGIN_URL, 200, '<html><body>Maintenance</body></html>')
@@ -0,0 +1,90 @@
+import unittest
+import threading
+from calpads.bulk import BulkHistoryFetcher, HistoryLookupFailed, STUDENT_HISTORY_ENDPOINTS
+
+
+class FakeClient:
+    """Stands in for an authenticated CALPADSClient"""
+
+    def __init__(self):
+        self.thread = threading.get_ident()
+        self.closed = False
+        self.session = self
+
+    def close(self):
+        self.closed = True
+
+    def get_enrollment_history(self, ssid):
+        if ssid == 'bad':
+            raise ValueError('bad ssid')
+        if ssid == 'expired':
+            # safe_json_load() of an error or login page
+            return {}
+        return {'Data': [{'SSID': ssid}], 'Total Count': 1}
+
+    def get_sped_history(self, ssid):
+        return {'Data': [], 'Total Count': 0}
+
+
+class BulkHistoryFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.created = []
+
+        def factory():
+            client = FakeClient()
+            self.created.append(client)
+            return client
+        self.fetcher = BulkHistoryFetcher(factory, max_workers=3, max_pending=2)
+
+    def test_fetch_streams_every_pair(self):
+        with self.fetcher:
+            results = list(self.fetcher.fetch((str(i) for i in range(20)), ['enrollment', 'sped']))
+        self.assertEqual(len(results), 40)
+        self.assertTrue(all(result.error is None for result in results))
+        self.assertEqual({(r.identifier, r.endpoint) for r in results},
+                         {(str(i), e) for i in range(20) for e in ('enrollment', 'sped')})
+
+    def test_identifiers_are_consumed_incrementally(self):
+        consumed = []
+
+        def identifiers():
+            for i in range(1000):
+                consumed.append(i)
+                yield str(i)
+        with self.fetcher:
+            results = self.fetcher.fetch(identifiers(), ['enrollment', 'sped'])
+            next(results)
+            # Only as far as max_pending lookups in flight needed, not the whole stream
+            self.assertLessEqual(len(consumed), 3)
+            self.assertEqual(sum(1 for _ in results), 1999)
+        self.assertEqual(len(consumed), 1000)
+
+    def test_one_client_per_worker(self):
+        with self.fetcher:
+            list(self.fetcher.fetch(range(30), ['sped']))
+        self.assertLessEqual(len(self.created), 3)
+        self.assertTrue(all(client.closed for client in self.created))
+
+    def test_errors_are_per_item(self):
+        with self.fetcher:
+            results, failures = self.fetcher.fetch_all(['1', 'bad', '2'], ['enrollment'])
+        self.assertEqual(set(results.keys()), {'1', '2'})
+        self.assertEqual(len(failures), 1)
+        self.assertIsInstance(failures[0].error, ValueError)
+
+    def test_responses_without_data_are_failures(self):
+        with self.fetcher:
+            results, failures = self.fetcher.fetch_all(['1', 'expired'], ['enrollment', 'sped'])
+        self.assertEqual(set(results.keys()), {'1', 'expired'})
+        self.assertEqual(list(results['expired']), ['sped'])
+        self.assertEqual([(failure.identifier, failure.endpoint) for failure in failures], [('expired', 'enrollment')])
+        self.assertIsInstance(failures[0].error, HistoryLookupFailed)
+
+    def test_unknown_endpoint(self):
+        with self.assertRaises(ValueError):
+            list(self.fetcher.fetch(['1'], ['not_an_endpoint']))
+
+    def test_default_endpoints_are_student_endpoints(self):
+        self.assertIn('enrollment', STUDENT_HISTORY_ENDPOINTS)
+        self.assertNotIn('staff_courses', STUDENT_HISTORY_ENDPOINTS)
@@ -0,0 +1,65 @@
+import os
+import threading
+import time
+import unittest
+from tempfile import TemporaryDirectory
+from calpads.cache import ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def test_hit_returns_a_copy(self):
+        cache = ResponseCache()
+        calls = []
+        fetch = lambda: calls.append(1) or [{'Value': '1'}]
+        first = cache.get_or_fetch('leas', ('user',), fetch)
+        first.append('modified')
+        self.assertEqual(cache.get_or_fetch('leas', ('user',), fetch), [{'Value': '1'}])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_ttl_and_empty_results(self):
+        cache = ResponseCache(ttls={'schools': 0.01})
+        cache.get_or_fetch('schools', ('1',), lambda: ['school'])
+        time.sleep(0.02)
+        self.assertEqual(cache.get_or_fetch('schools', ('1',), lambda: ['new school']), ['new school'])
+        cache.get_or_fetch('leas', ('user',), lambda: {})
+        self.assertEqual(cache.get_or_fetch('leas', ('user',), lambda: ['lea']), ['lea'])
+
+    def test_lru_eviction_and_invalidate(self):
+        cache = ResponseCache(max_entries=2)
+        for lea in ('1', '2', '3'):
+            cache.get_or_fetch('schools', (lea,), lambda: [lea])
+        self.assertEqual(cache.get_or_fetch('schools', ('1',), lambda: ['refetched']), ['refetched'])
+        cache.invalidate('schools', ('3',))
+        self.assertEqual(cache.get_or_fetch('schools', ('3',), lambda: ['again']), ['again'])
+        cache.invalidate()
+        self.assertEqual(cache.get_or_fetch('schools', ('1',), lambda: ['fresh']), ['fresh'])
+
+    def test_single_flight(self):
+        cache = ResponseCache()
+        calls = []
+        release = threading.Event()
+
+        def slow_fetch():
+            calls.append(1)
+            release.wait()
+            return ['submitter']
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            cache.get_or_fetch('submitter_names', ('1',), slow_fetch))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [['submitter']] * 5)
+
+    def test_disk_backend(self):
+        with TemporaryDirectory() as td:
+            path = os.path.join(td, 'responses.json')
+            ResponseCache(path=path).get_or_fetch('leas', ('user',), lambda: ['lea'])
+            self.assertEqual(ResponseCache(path=path).get_or_fetch('leas', ('user',), lambda: ['other']), ['lea'])
@@ -0,0 +1,120 @@
+import io
+import os
+import unittest
+import zlib
+from tempfile import TemporaryDirectory
+from calpads.cassette import Cassette, CassetteMiss, RecordingTransport, ReplayTransport, request_key
+from calpads.client import CALPADSClient
+from tests.fake_calpads import FakeCALPADSAdapter, selected_lea
+
+FORM = 'application/x-www-form-urlencoded'
+
+
+class RequestKeyTest(unittest.TestCase):
+
+    def test_query_order_and_host_case_are_ignored(self):
+        self.assertEqual(request_key('get', 'https://WWW.calpads.org/Extract?format=JSON&SelectedLEA=1'),
+                         request_key('GET', 'https://www.calpads.org/Extract?SelectedLEA=1&format=JSON'))
+
+    def test_volatile_form_fields_are_ignored(self):
+        url = 'https://www.calpads.org/Account/Login'
+        self.assertEqual(request_key('POST', url, 'Username=a&Password=b&__RequestVerificationToken=1', FORM),
+                         request_key('POST', url, 'Username=c&Password=d&__RequestVerificationToken=2', FORM))
+        self.assertNotEqual(request_key('POST', url, 'RecordType=SENR', FORM),
+                            request_key('POST', url, 'RecordType=SELA', FORM))
+
+    def test_multipart_boundaries_are_ignored(self):
+        def multipart(boundary, token):
+            body = ('--{0}\r\nContent-Disposition: form-data; name="__RequestVerificationToken"\r\n\r\n{1}\r\n'
+                    '--{0}\r\nContent-Disposition: form-data; name="FileType"\r\n\r\nSENR\r\n--{0}--\r\n'
+                    .format(boundary, token))
+            return request_key('POST', 'https://www.calpads.org/FileSubmission/FileUpload', body,
+                               'multipart/form-data; boundary={}'.format(boundary))
+        self.assertEqual(multipart('abc', 'one'), multipart('xyz', 'two'))
+
+
+class CassetteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'test.cassette')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _record(self, bodies, flush=True):
+        cassette = Cassette(self.path, record=True)
+        for key, body in bodies:
+            cassette.append(key, {'status_code': 200, 'length': len(body)}, io.BytesIO(body))
+        if flush:
+            cassette.close()
+        return cassette
+
+    def test_repeated_keys_replay_in_order_then_repeat_the_last(self):
+        self._record([('GET /Extract', b'pending'), ('GET /Leas', b'[]'), ('GET /Extract', b'complete')])
+        cassette = Cassette(self.path)
+        bodies = []
+        for _ in range(3):
+            meta, offset, length = cassette.next_entry('GET /Extract')
+            bodies.append(cassette.open_body(offset, length).read())
+        self.assertEqual(bodies, [b'pending', b'complete', b'complete'])
+        with self.assertRaises(CassetteMiss):
+            cassette.next_entry('GET /Missing')
+
+    def test_cassette_without_an_index_is_scanned(self):
+        recording = self._record([('GET /Leas', b'x' * 100000)], flush=False)
+        recording._file.flush()
+        cassette = Cassette(self.path)
+        meta, offset, length = cassette.next_entry('GET /Leas')
+        self.assertEqual(cassette.open_body(offset, length).read(), b'x' * 100000)
+        recording.close()
+
+    def test_appending_keeps_earlier_recordings(self):
+        self._record([('GET /Leas', b'first')])
+        self._record([('GET /Schools', b'second')])
+        self.assertEqual(len(Cassette(self.path)), 2)
+
+
+class RecordReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'session.cassette')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_replay_serves_a_recorded_session_without_the_server(self):
+        server = FakeCALPADSAdapter('user', 's3cret-password')
+        with RecordingTransport(self.path, transport=server) as transport:
+            client = CALPADSClient('user', 's3cret-password', transport=transport)
+            client._select_lea('2222222')
+            recorded = client.get_leas()
+        self.assertEqual(selected_lea(recorded), '2222222')
+
+        client = CALPADSClient('user', 'another-password', transport=ReplayTransport(self.path))
+        client._select_lea('2222222')
+        self.assertEqual(client.get_leas(), recorded)
+        self.assertTrue(client.is_connected)
+        with self.assertRaises(CassetteMiss):
+            client.get_all_schools('2222222')
+
+    def test_credentials_and_cookies_are_not_recorded(self):
+        server = FakeCALPADSAdapter('user', 's3cret-password')
+        with RecordingTransport(self.path, transport=server) as transport:
+            CALPADSClient('user', 's3cret-password', transport=transport).get_leas()
+        cassette = Cassette(self.path)
+        with open(self.path, 'rb') as f:
+            contents = f.read()
+        for offsets in cassette.index.values():
+            for offset in offsets:
+                meta, body_offset, body_length = cassette._read_entry(io.BytesIO(contents), offset)
+                body = zlib.decompress(contents[body_offset:body_offset + body_length])
+                self.assertNotIn(b's3cret-password', body)
+                self.assertNotIn(b'value="abc"', body)
+                self.assertNotIn('Set-Cookie', meta['headers'])
+        self.assertNotIn(b's3cret-password', contents)
+
+
+if __name__ == '__main__':
+    unittest.main()
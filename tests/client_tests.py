@@ -3,6 +3,7 @@ import os
 import logging
 from tempfile import TemporaryDirectory
 from calpads.client import CALPADSClient
+from calpads.exceptions import AuthenticationError
 
 #Might explore adding colors to the output for tests
 #https://stackoverflow.com/questions/384076/how-can-i-color-python-logging-output
@@ -40,11 +41,10 @@ class ClientTest(CALPADSTest):
         self.cp_client._login()
         self.assertTrue(self.cp_client.is_connected)
 
-    @unittest.skip("This isn't quite ready for a unittest. Might need to remove the self.login call at instantiation")
     def test_invalid_login(self):
-        self.cp_client.username = 'BAD USER'
-        with self.assertRaises(RecursionError):
-            self.cp_client._login()
+        bad_client = CALPADSClient('BAD USER', os.getenv('CALPADS_PASSWORD'))
+        with self.assertRaises(AuthenticationError):
+            bad_client._login()
 
     def test_get_leas(self):
         #Wouldn't be shocked if this fails if the specification changes on CALPADS' end
@@ -116,7 +116,7 @@ class ClientTest(CALPADSTest):
             #Test that all of the bytes were written to file
             #Cautionary Tale here if the content is compressed:
             #https://stackoverflow.com/a/50825553
-            self.assertTrue(len(self.cp_client.visit_history[-1].content)
+            self.assertTrue(self.cp_client.last_download.bytes_written
                             ==
                             os.stat(os.path.join(td, 'testing.csv')).st_size
                             )
@@ -142,7 +142,7 @@ class ClientTest(CALPADSTest):
             #Test that all of the bytes were written to file
             #Cautionary Tale here if the content is compressed:
             #https://stackoverflow.com/a/50825553
-            self.assertTrue(len(self.cp_client.visit_history[-1].content)
+            self.assertTrue(self.cp_client.last_download.bytes_written
                             ==
                             os.stat(os.path.join(td, 'testing.csv')).st_size
                             )
@@ -168,7 +168,7 @@ class ClientTest(CALPADSTest):
             self.assertTrue(self.cp_client.download_extract(lea_code=os.getenv('CALPADS_TEST_LEA_CODE'),
                                                             file_name=os.path.join(td, 'testing.txt')))
 
-            self.assertTrue(len(self.cp_client.visit_history[-1].content)
+            self.assertTrue(self.cp_client.last_download.bytes_written
                             ==
                             os.stat(os.path.join(td, 'testing.txt')).st_size
                             )
\ No newline at end of file
@@ -0,0 +1,85 @@
+import os
+import unittest
+from datetime import date
+from tempfile import TemporaryDirectory
+from calpads.bulk import BulkResult
+from tests.extract_parser_tests import senr_line
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
+if pyarrow is not None:
+    from calpads.columnar import (extract_record_batches, history_record_batches, write_arrow, write_parquet,
+                                  write_history_parquet)
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class ExtractRecordBatchesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = '\n'.join(senr_line('{:010d}'.format(i), exit_date='20200605' if i % 2 else '')
+                              for i in range(10)).encode('utf8')
+
+    def test_codes_are_dictionary_encoded_but_identifiers_are_not(self):
+        batches = list(extract_record_batches([self.data], batch_size=4))
+        self.assertEqual([batch.num_rows for batch in batches], [4, 4, 2])
+        schema = batches[0].schema
+        self.assertTrue(pyarrow.types.is_dictionary(schema.field('school_of_attendance').type))
+        self.assertEqual(schema.field('ssid').type, pyarrow.string())
+        self.assertEqual(schema.field('student_birth_date').type, pyarrow.date32())
+        self.assertEqual(len(batches[0].column(schema.get_field_index('grade_level_code')).dictionary), 1)
+        table = pyarrow.Table.from_batches(batches)
+        self.assertEqual(table.column('enrollment_exit_date').to_pylist()[:2], [None, date(2020, 6, 5)])
+        self.assertEqual(table.column('school_of_attendance').to_pylist(), ['0123456'] * 10)
+
+    def test_write_parquet_and_arrow(self):
+        with TemporaryDirectory() as tmp_dir:
+            parquet_path = os.path.join(tmp_dir, 'senr.parquet')
+            arrow_path = os.path.join(tmp_dir, 'senr.arrows')
+            self.assertEqual(write_parquet(extract_record_batches([self.data], batch_size=4), parquet_path), 10)
+            self.assertEqual(write_arrow(extract_record_batches([self.data], batch_size=4), arrow_path), 10)
+            table = pq.read_table(parquet_path)
+            self.assertEqual(table.column('ssid').to_pylist(), ['{:010d}'.format(i) for i in range(10)])
+            self.assertTrue(pyarrow.types.is_dictionary(table.schema.field('grade_level_code').type))
+            with pyarrow.ipc.open_stream(arrow_path) as reader:
+                self.assertEqual(reader.read_all().num_rows, 10)
+            self.assertEqual(write_parquet(extract_record_batches([b'']), os.path.join(tmp_dir, 'empty')), 0)
+            self.assertFalse(os.path.exists(os.path.join(tmp_dir, 'empty')))
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class HistoryRecordBatchesTest(unittest.TestCase):
+
+    def results(self):
+        for i in range(6):
+            ssid = '{:010d}'.format(i)
+            rows = [{'SSID': ssid, 'SchoolCode': '0123456', 'GradeLevel': '10', 'Days': i, 'Extra': {'a': i}}]
+            yield BulkResult(ssid, 'enrollment', {'Data': rows, 'Total Count': 1}, None)
+            yield BulkResult(ssid, 'sped', {'Data': [], 'Total Count': 0}, None)
+        yield BulkResult('9', 'enrollment', None, RuntimeError('timed out'))
+        yield BulkResult('10', 'enrollment', {'Data': [{'SSID': '10', 'NewColumn': 'x'}]}, None)
+
+    def test_one_schema_per_endpoint(self):
+        batches = list(history_record_batches(self.results(), batch_size=4))
+        self.assertEqual([endpoint for endpoint, batch in batches], ['enrollment', 'enrollment'])
+        first, second = (batch for endpoint, batch in batches)
+        self.assertEqual(first.schema, second.schema)
+        self.assertEqual(first.schema.names, ['identifier', 'SSID', 'SchoolCode', 'GradeLevel', 'Days', 'Extra'])
+        self.assertTrue(pyarrow.types.is_dictionary(first.schema.field('SchoolCode').type))
+        self.assertEqual(first.schema.field('SSID').type, pyarrow.string())
+        table = pyarrow.Table.from_batches([first, second])
+        self.assertEqual(table.column('Days').to_pylist(), ['0', '1', '2', '3', '4', '5', None])
+        self.assertEqual(table.column('Extra').to_pylist()[0], '{"a": 0}')
+
+    def test_write_history_parquet(self):
+        with TemporaryDirectory() as tmp_dir:
+            paths = write_history_parquet(self.results(), tmp_dir, batch_size=4)
+            self.assertEqual(list(paths), ['enrollment'])
+            self.assertEqual(pq.read_table(paths['enrollment']).num_rows, 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
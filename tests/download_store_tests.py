@@ -0,0 +1,126 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from calpads.download_store import DownloadStore
+from calpads.downloads import write_chunks
+from calpads.extract_requests import ExtractRequest
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class FakeClient:
+    """Streams canned content to the sink like CALPADSClient's download methods"""
+
+    def __init__(self, content):
+        self.content = content
+        self.last_download = None
+
+    def download_extract(self, lea_code, file_name=None, extract_request=None, **kwargs):
+        if self.content is None:
+            return False
+        self.last_download = write_chunks([self.content[:5], self.content[5:]], file_name,
+                                          url='https://www.calpads.org/Extract/DownloadLink?ExtractRequestID=77')
+        return True
+
+    def download_report(self, lea_code, report_code, file_name=None, **kwargs):
+        self.last_download = write_chunks([self.content], file_name)
+        return True
+
+
+class DownloadStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, 'store')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def objects(self):
+        return [name for _, _, names in os.walk(os.path.join(self.root, 'objects')) for name in names]
+
+    def test_identical_downloads_are_stored_once(self):
+        store = DownloadStore(self.root, compression='gzip')
+        content = b'SENR^A^^1234567\n' * 1000
+        first = store.download_extract(FakeClient(content), '1234567', extract_name='senr')
+        second = store.download_extract(FakeClient(content), '1234567',
+                                        extract_request=ExtractRequest('1234567', 'SENR', 0, frozenset(), 88))
+        self.assertFalse(first.duplicate)
+        self.assertTrue(second.duplicate)
+        self.assertEqual(first.digest, second.digest)
+        self.assertEqual((first.request_id, second.request_id), ('77', '88'))
+        self.assertEqual(first.size, len(content))
+        self.assertLess(first.stored_size, first.size)
+        self.assertEqual(len(self.objects()), 1)
+        with store.open(second) as f:
+            self.assertEqual(f.read(), content)
+
+    def test_manifest_is_indexed_and_survives_reopening(self):
+        store = DownloadStore(self.root, compression='gzip')
+        store.download_extract(FakeClient(b'one'), '1234567', extract_name='SENR')
+        store.download_report(FakeClient(b'report'), '1234567', '1.1')
+        store.download_extract(FakeClient(b'two'), '7654321', extract_name='SENR')
+        reopened = DownloadStore(self.root, compression='gzip')
+        self.assertEqual(len(reopened), 3)
+        self.assertEqual([entry.lea_code for entry in reopened.find(name='senr')], ['1234567', '7654321'])
+        self.assertEqual(reopened.find(kind='report')[0].name, '1.1')
+        with reopened.open(reopened.latest('1234567', 'SENR')) as f:
+            self.assertEqual(f.read(), b'one')
+        self.assertEqual(reopened.find(since=reopened.entries[-1].downloaded_at), reopened.entries[-1:])
+        store.download_extract(FakeClient(b'three'), '1234567', extract_name='SENR')
+        reopened.reload()
+        self.assertEqual(len(reopened), 4)
+
+    def test_each_store_appends_to_its_own_segment(self):
+        first = DownloadStore(self.root, compression='gzip')
+        second = DownloadStore(self.root, compression='gzip')
+        first.download_extract(FakeClient(b'one'), '1234567', extract_name='SENR')
+        second.download_extract(FakeClient(b'two'), '1234567', extract_name='SENR')
+        first.download_extract(FakeClient(b'three'), '1234567', extract_name='SENR')
+        self.assertEqual(sorted(os.listdir(os.path.join(self.root, 'manifest.d'))),
+                         sorted(os.path.basename(store.manifest_path) for store in (first, second)))
+        first.reload()
+        # Merged across the segments, oldest first
+        self.assertEqual([entry.size for entry in first.entries], [3, 3, 5])
+        self.assertEqual(first.latest('1234567', 'SENR').size, 5)
+        self.assertEqual(DownloadStore(self.root, compression='gzip').entries, first.entries)
+
+    def test_unreadable_lines_are_skipped(self):
+        store = DownloadStore(self.root, compression='gzip')
+        store.download_extract(FakeClient(b'one'), '1234567', extract_name='SENR')
+        with open(store.manifest_path, 'ab') as f:
+            f.write(b'\x00\x00{"digest": \n{"digest": "abc"}\n')
+        store.download_extract(FakeClient(b'two'), '1234567', extract_name='SENR')
+        with self.assertLogs('calpads.download_store', level='WARNING') as logs:
+            reopened = DownloadStore(self.root, compression='gzip')
+        self.assertEqual(len(logs.output), 2)
+        self.assertEqual(reopened.entries, store.entries)
+        self.assertEqual(len(reopened), 2)
+
+    def test_failed_downloads_leave_nothing_behind(self):
+        store = DownloadStore(self.root, compression='gzip')
+        self.assertIsNone(store.download_extract(FakeClient(None), '1234567', extract_name='SENR'))
+        with self.assertRaises(RuntimeError):
+            with store.writer('report', '1234567', '1.1') as writer:
+                writer.write(b'partial')
+                raise RuntimeError('connection reset')
+        self.assertEqual(os.listdir(os.path.join(self.root, 'tmp')), [])
+        self.assertEqual(self.objects(), [])
+        self.assertEqual(len(store), 0)
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_zstd_and_gzip_copies_dedupe(self):
+        content = b'SENR^A^^1234567\n' * 1000
+        entry = DownloadStore(self.root, compression='zstd').download_report(FakeClient(content), '1234567', '1.1')
+        self.assertTrue(self.objects()[0].endswith('.zst'))
+        store = DownloadStore(self.root, compression='gzip')
+        self.assertTrue(store.download_report(FakeClient(content), '1234567', '1.1').duplicate)
+        with store.open(entry.digest) as f:
+            self.assertEqual(f.read(), content)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import hashlib
+import io
+import os
+import unittest
+from unittest import mock
+from tempfile import TemporaryDirectory
+from calpads.downloads import DownloadCounter, DownloadStats, open_sink, write_chunks, stream_response
+
+
+class FakeResponse:
+    """The parts of a streamed requests.Response that stream_response uses"""
+
+    def __init__(self, chunks, url='https://www.calpads.org/Extract/DownloadLink?ExtractRequestID=1', error=None):
+        self.chunks = chunks
+        self.url = url
+        self.error = error
+        self.closed = False
+        self.chunk_size = None
+
+    def iter_content(self, chunk_size):
+        self.chunk_size = chunk_size
+        yield from self.chunks
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+class DownloadCounterTest(unittest.TestCase):
+
+    def test_counts_bytes(self):
+        counter = DownloadCounter()
+        counter.update(b'abc')
+        counter.update(b'')
+        counter.update(b'de')
+        self.assertEqual(counter.stats('url'), DownloadStats('url', 5, None))
+
+    def test_checksum(self):
+        counter = DownloadCounter('md5')
+        counter.update(b'abc')
+        counter.update(b'de')
+        self.assertEqual(counter.stats().checksum, hashlib.md5(b'abcde').hexdigest())
+
+    def test_unknown_checksum(self):
+        with self.assertRaises(ValueError):
+            DownloadCounter('not-a-hash')
+
+
+class SinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'extract.txt')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_path_sink(self):
+        stats = write_chunks([b'SENR^A', b'', b'^1\n'], self.path, checksum='sha256', url='url')
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'SENR^A^1\n')
+        self.assertEqual(stats, DownloadStats('url', 9, hashlib.sha256(b'SENR^A^1\n').hexdigest()))
+
+    def test_file_like_sink_is_left_open(self):
+        sink = io.BytesIO()
+        stats = write_chunks([b'abc', b'def'], sink)
+        self.assertFalse(sink.closed)
+        self.assertEqual(sink.getvalue(), b'abcdef')
+        self.assertEqual(stats, DownloadStats(None, 6, None))
+
+    def test_partial_file_is_removed_when_the_stream_fails(self):
+        response = FakeResponse([b'abc'], error=ConnectionError('reset'))
+        with self.assertRaises(ConnectionError):
+            stream_response(response, self.path, chunk_size=3)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(response.closed)
+
+    def test_file_like_sink_is_not_closed_when_the_stream_fails(self):
+        sink = io.BytesIO()
+        with self.assertRaises(ConnectionError):
+            stream_response(FakeResponse([b'abc'], error=ConnectionError('reset')), sink)
+        self.assertFalse(sink.closed)
+        self.assertEqual(sink.getvalue(), b'abc')
+
+    def test_existing_file_is_kept_when_it_cannot_be_opened(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'yesterday')
+        with mock.patch('calpads.downloads.open', side_effect=PermissionError('read-only'), create=True):
+            with self.assertRaises(PermissionError):
+                with open_sink(self.path):
+                    pass
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'yesterday')
+
+    def test_open_sink(self):
+        with open_sink(self.path) as f:
+            f.write(b'abc')
+        self.assertTrue(f.closed)
+        sink = io.BytesIO()
+        with open_sink(sink) as f:
+            self.assertIs(f, sink)
+        self.assertFalse(sink.closed)
+
+    def test_stream_response(self):
+        response = FakeResponse([b'abc', b'def'])
+        stats = stream_response(response, self.path, chunk_size=3, checksum='sha256')
+        self.assertEqual(response.chunk_size, 3)
+        self.assertTrue(response.closed)
+        self.assertEqual(stats, DownloadStats(response.url, 6, hashlib.sha256(b'abcdef').hexdigest()))
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'abcdef')
+
+
+if __name__ == '__main__':
+    unittest.main()
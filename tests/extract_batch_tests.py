@@ -0,0 +1,109 @@
+import io
+import threading
+import time
+import unittest
+from calpads.downloads import DownloadStats
+from calpads.extract_batch import iter_extract_downloads, default_extract_file_name, ExtractFailed
+from calpads.extract_requests import ExtractRequest, ExtractIdRegistry
+
+
+class FakeClient:
+    """Serves a scripted extract listing; each poll advances every row one status"""
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.polls = 0
+        self.downloaded = []
+        self.selections = []
+        self._extract_ids = ExtractIdRegistry()
+        self._lock = threading.Lock()
+
+    def get_requested_extracts(self, lea_code):
+        rows = [{'ExtractRequestID': request_id, 'ExtractType': extract_type,
+                 'ExtractStatus': steps[min(self.polls, len(steps) - 1)]}
+                for request_id, (extract_type, steps) in sorted(self.statuses.items(), reverse=True)]
+        self.polls += 1
+        return {'Data': rows}
+
+    def _select_lea(self, lea_code):
+        self.selections.append(lea_code)
+
+    def _stream_extract(self, extract_request_id, sink, chunk_size, checksum):
+        with self._lock:
+            self.downloaded.append(extract_request_id)
+        sink.write(b'extract')
+        return DownloadStats(str(extract_request_id), 7, None)
+
+
+class MultiLEAFakeClient(FakeClient):
+    """Lists each LEA's extracts separately and records downloads made outside of their LEA"""
+
+    def __init__(self, statuses_by_lea):
+        super().__init__(dict())
+        self.listings = {lea_code: FakeClient(statuses) for lea_code, statuses in statuses_by_lea.items()}
+        self.lea_of = {request_id: lea_code for lea_code, statuses in statuses_by_lea.items()
+                       for request_id in statuses}
+        self.streaming = 0
+        self.misplaced = []
+
+    def get_requested_extracts(self, lea_code):
+        return self.listings[lea_code].get_requested_extracts(lea_code)
+
+    def _select_lea(self, lea_code):
+        if self.streaming:
+            self.misplaced.append(('switched during a download', lea_code))
+        super()._select_lea(lea_code)
+
+    def _stream_extract(self, extract_request_id, sink, chunk_size, checksum):
+        with self._lock:
+            self.streaming += 1
+            if self.lea_of[extract_request_id] != self.selections[-1]:
+                self.misplaced.append(extract_request_id)
+        time.sleep(0.02)
+        try:
+            return super()._stream_extract(extract_request_id, sink, chunk_size, checksum)
+        finally:
+            with self._lock:
+                self.streaming -= 1
+
+
+class IterExtractDownloadsTest(unittest.TestCase):
+
+    def test_polls_once_and_downloads_each_when_complete(self):
+        client = FakeClient({1: ('SENR', ['Pending', 'Complete']),
+                             2: ('SELA', ['Pending', 'Pending', 'Complete']),
+                             3: ('SPRG', ['Pending', 'Failed'])})
+        handles = [ExtractRequest('1234567', name, 0, frozenset()) for name in ('SENR', 'SELA', 'SPRG')]
+        results = list(iter_extract_downloads(client, handles + [False], lambda handle: io.BytesIO(),
+                                              poll=0.01, max_poll=0.01))
+        self.assertEqual(client.polls, 3)
+        self.assertEqual(sorted(client.downloaded), [1, 2])
+        by_name = {result.extract_request.extract_name: result for result in results}
+        self.assertIsNone(by_name['SENR'].error)
+        self.assertEqual(by_name['SELA'].stats.bytes_written, 7)
+        self.assertIsInstance(by_name['SPRG'].error, ExtractFailed)
+
+    def test_downloads_run_within_their_lea(self):
+        client = MultiLEAFakeClient({'1111111': {1: ('SENR', ['Complete']), 2: ('SELA', ['Pending', 'Complete'])},
+                                     '2222222': {3: ('SENR', ['Complete']), 4: ('SELA', ['Complete'])}})
+        handles = [ExtractRequest(lea_code, name, 0, frozenset()) for lea_code in ('1111111', '2222222')
+                   for name in ('SENR', 'SELA')]
+        results = list(iter_extract_downloads(client, handles, lambda handle: io.BytesIO(), poll=0.01,
+                                              max_poll=0.01))
+        self.assertEqual([result.error for result in results], [None] * 4)
+        self.assertEqual(sorted(client.downloaded), [1, 2, 3, 4])
+        self.assertEqual(client.misplaced, [])
+        self.assertEqual(client.selections[0], '1111111')
+        self.assertIn('2222222', client.selections)
+
+    def test_timeout_reports_pending(self):
+        client = FakeClient({1: ('SENR', ['Pending'])})
+        handle = ExtractRequest('1234567', 'SENR', 0, frozenset())
+        results = list(iter_extract_downloads(client, [handle], lambda handle: io.BytesIO(), timeout=0.05,
+                                              poll=0.01, max_poll=0.01))
+        self.assertEqual(len(results), 1)
+        self.assertIsInstance(results[0].error, TimeoutError)
+
+    def test_default_file_name(self):
+        handle = ExtractRequest('1234567', 'SENR', 0, frozenset(), request_id=42)
+        self.assertTrue(default_extract_file_name(handle, 'out').endswith('1234567_SENR_42.txt'))
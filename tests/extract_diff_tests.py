@@ -0,0 +1,76 @@
+import os
+import unittest
+from datetime import date
+from tempfile import TemporaryDirectory
+from calpads.extract_diff import ExtractDiff
+from calpads.extract_parser import ExtractLayout
+from tests.extract_parser_tests import senr_line
+
+
+def extract(*lines):
+    return [('RecordTypeCode^TransactionTypeCode\n' + '\n'.join(lines) + '\n').encode('utf8')]
+
+
+class ExtractDiffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.old = [senr_line('{:010d}'.format(i)) for i in range(50)]
+        self.new = list(self.old)
+        self.new[3] = senr_line('0000000003', exit_date='20200605')
+        self.new[7] = senr_line('0000000007', first_name='Joe')
+        del self.new[10]
+        self.new.append(senr_line('0000000099'))
+
+    def assert_changes(self, changes):
+        changes = sorted(changes, key=lambda change: change.key)
+        self.assertEqual([(change.change, change.key[0]) for change in changes],
+                         [('changed', '0000000003'), ('changed', '0000000007'), ('removed', '0000000010'),
+                          ('added', '0000000099')])
+        self.assertEqual(changes[0].key, ('0000000003', '0123456', date(2019, 8, 15)))
+        self.assertEqual(changes[0].deltas, {'enrollment_exit_date': (None, date(2020, 6, 5))})
+        self.assertEqual(changes[1].deltas, {'student_legal_first_name': ('José', 'Joe')})
+        self.assertIsNone(changes[2].new)
+        self.assertIsNone(changes[3].old)
+
+    def test_in_memory(self):
+        diff = ExtractDiff(extract(*self.old), extract(*self.new), partitions=1)
+        self.assert_changes(list(diff))
+        self.assertEqual(diff.counts, {'unchanged': 47, 'changed': 2, 'removed': 1, 'added': 1})
+
+    def test_bytes_size_the_partitions(self):
+        old, new = extract(*self.old)[0], extract(*self.new)[0]
+        diff = ExtractDiff(old, new, partition_bytes=1000)
+        self.assertEqual(diff.partitions, -(-len(old) // 1000))
+        self.assert_changes(list(diff))
+
+    def test_partitioned_files(self):
+        with TemporaryDirectory() as tmp_dir:
+            paths = []
+            for name, lines in (('old.txt', self.old), ('new.txt', self.new)):
+                paths.append(os.path.join(tmp_dir, name))
+                with open(paths[-1], 'wb') as f:
+                    f.write(extract(*lines)[0].replace(b'\n', b'\r\n'))
+            diff = ExtractDiff(*paths, partition_bytes=1000, tmp_dir=tmp_dir)
+            self.assertGreater(diff.partitions, 1)
+            self.assert_changes(list(diff))
+            # The partition files are cleaned up
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ['new.txt', 'old.txt'])
+
+    def test_ignored_fields_and_trailing_blanks(self):
+        old = [senr_line('0000000001'), senr_line('0000000002')]
+        new = [senr_line('0000000001').replace('^L1^', '^L2^'), senr_line('0000000002') + '^^']
+        diff = ExtractDiff(extract(*old), extract(*new), ignore_fields=['local_student_id'], partitions=3)
+        self.assertEqual(list(diff), [])
+        self.assertEqual(diff.counts['unchanged'], 2)
+
+    def test_duplicate_keys_pair_in_order(self):
+        layout = ExtractLayout('TEST', (('record_type_code', 'code'), ('ssid', 'code'), ('score', 'int')))
+        diff = ExtractDiff([b'TEST^1^1\nTEST^1^2\n'], [b'TEST^1^1\nTEST^1^3\nTEST^1^4\n'], layout,
+                           key_fields=['ssid'], partitions=2)
+        changes = list(diff)
+        self.assertEqual([(change.change, change.deltas) for change in changes],
+                         [('changed', {'score': (2, 3)}), ('added', {})])
+
+
+if __name__ == '__main__':
+    unittest.main()
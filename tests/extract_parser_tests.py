@@ -0,0 +1,93 @@
+import io
+import os
+import unittest
+from datetime import date
+from tempfile import TemporaryDirectory
+from calpads.extract_parser import (ExtractLayout, ExtractParseError, EXTRACT_LAYOUTS, iter_lines,
+                                    iter_extract_records, iter_extract_columns, get_layout)
+
+
+def senr_line(ssid, first_name='José', exit_date=''):
+    values = ['SENR', 'A', '', '1234567', '0123456', '', '2019-2020', ssid, 'L1', first_name, '', 'Doe', '', '', '',
+              '', '20100102', 'F', '', '', '', '20190815', '10', '04', exit_date, '', '', '', 'N', '', '', '', '', '',
+              '']
+    return '^'.join(values)
+
+
+class IterLinesTest(unittest.TestCase):
+
+    def test_lines_and_characters_split_across_chunks(self):
+        data = '{}\r\n{}\r\n'.format(senr_line('1'), senr_line('2')).encode('utf8')
+        split = data.index('é'.encode('utf8')) + 1
+        chunks = [data[:split], data[split:split + 7], data[split + 7:]]
+        self.assertEqual(list(iter_lines(chunks)), [senr_line('1'), senr_line('2')])
+
+    def test_last_line_without_a_newline(self):
+        self.assertEqual(list(iter_lines(io.BytesIO(b'a\nb'), chunk_size=1)), ['a', 'b'])
+
+    def test_bytes_are_content_not_a_path(self):
+        self.assertEqual(list(iter_lines(b'a\r\nb\n')), ['a', 'b'])
+        self.assertEqual(list(iter_lines(bytearray(b'a\nb'))), ['a', 'b'])
+
+
+class IterExtractRecordsTest(unittest.TestCase):
+
+    def test_typed_senr_records(self):
+        data = '\n'.join([senr_line('1000000001'), senr_line('1000000002', exit_date='20200605')]).encode('utf8')
+        first, second = iter_extract_records(io.BytesIO(data), chunk_size=16)
+        self.assertEqual(first.ssid, '1000000001')
+        self.assertEqual(first.school_of_attendance, '0123456')
+        self.assertEqual(first.student_legal_first_name, 'José')
+        self.assertEqual(first.student_birth_date, date(2010, 1, 2))
+        self.assertIsNone(first.enrollment_exit_date)
+        self.assertIsNone(first.student_legal_middle_name)
+        self.assertFalse(first.student_met_all_uc_csu_requirements_indicator)
+        self.assertEqual(second.enrollment_exit_date, date(2020, 6, 5))
+        # Codes are interned, so every record shares one string per distinct code
+        self.assertIs(first.reporting_lea, second.reporting_lea)
+
+    def test_header_line_is_skipped(self):
+        data = 'RecordTypeCode^TransactionTypeCode\n{}\n'.format(senr_line('1')).encode('utf8')
+        self.assertEqual([record.ssid for record in iter_extract_records([data])], ['1'])
+        self.assertEqual([record.ssid for record in iter_extract_records([data], 'senr')], ['1'])
+
+    def test_short_and_long_rows(self):
+        layout = ExtractLayout('TEST', (('record_type_code', 'code'), ('count', 'int'), ('note', 'str')))
+        records = list(iter_extract_records([b'TEST^1\nTEST^2^a^extra\n'], layout))
+        self.assertEqual(records, [layout.record('TEST', 1, None), layout.record('TEST', 2, 'a')])
+
+    def test_bad_values_report_the_line(self):
+        data = '{}\n{}\n'.format(senr_line('1'), senr_line('2').replace('20100102', '2010-01-02')).encode('utf8')
+        with self.assertRaisesRegex(ExtractParseError, 'Line 2'):
+            list(iter_extract_records([data]))
+
+    def test_unknown_record_type(self):
+        with self.assertRaises(ExtractParseError):
+            get_layout('NOPE')
+        with self.assertRaises(ExtractParseError):
+            list(iter_extract_records([b'HEADER\nNOPE^1\n']))
+
+    def test_reads_paths(self):
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'senr.txt')
+            with open(path, 'w', encoding='utf8') as f:
+                f.write(senr_line('1') + '\n')
+            self.assertEqual(len(list(iter_extract_records(path))), 1)
+
+    def test_every_layout_has_the_record_type_first(self):
+        for record_type, layout in EXTRACT_LAYOUTS.items():
+            self.assertEqual(layout.field_names[0], 'record_type_code', record_type)
+            self.assertEqual(len(set(layout.field_names)), len(layout.field_names), record_type)
+
+
+class IterExtractColumnsTest(unittest.TestCase):
+
+    def test_batches(self):
+        data = '\n'.join(senr_line(str(i)) for i in range(5)).encode('utf8')
+        batches = list(iter_extract_columns([data], batch_size=2))
+        self.assertEqual([len(batch['ssid']) for batch in batches], [2, 2, 1])
+        self.assertEqual(batches[-1]['ssid'], ['4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
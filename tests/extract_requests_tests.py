@@ -0,0 +1,46 @@
+import itertools
+import unittest
+from calpads.extract_requests import ExtractRequest, ExtractIdRegistry, backoff_delays
+
+
+def row(request_id, extract_type, status='Pending'):
+    return {'ExtractRequestID': request_id, 'ExtractType': extract_type, 'ExtractStatus': status}
+
+
+class ExtractIdRegistryTest(unittest.TestCase):
+
+    def test_ignores_prior_and_other_types(self):
+        registry = ExtractIdRegistry()
+        handle = ExtractRequest('1234567', 'SENR', 0, frozenset([10]))
+        rows = [row(12, 'SELA'), row(11, 'SENR'), row(10, 'SENR', 'Complete')]
+        self.assertEqual(registry.resolve(handle, rows)['ExtractRequestID'], 11)
+        self.assertEqual(handle.request_id, 11)
+
+    def test_concurrent_requests_get_distinct_ids(self):
+        registry = ExtractIdRegistry()
+        first = ExtractRequest('1234567', 'SENR', 0, frozenset([10]))
+        second = ExtractRequest('1234567', 'SENR', 0, frozenset([10]))
+        rows = [row(12, 'SENR'), row(11, 'SENR'), row(10, 'SENR')]
+        self.assertEqual(registry.resolve(first, rows)['ExtractRequestID'], 11)
+        self.assertEqual(registry.resolve(second, rows)['ExtractRequestID'], 12)
+        # Once resolved, a handle keeps following its own row
+        rows[1]['ExtractStatus'] = 'Complete'
+        self.assertEqual(registry.resolve(first, rows)['ExtractStatus'], 'Complete')
+
+    def test_unresolved_until_listed(self):
+        registry = ExtractIdRegistry()
+        handle = ExtractRequest('1234567', 'SENR', 0, frozenset([10]))
+        self.assertIsNone(registry.resolve(handle, [row(10, 'SENR')]))
+        self.assertIsNone(handle.request_id)
+
+    def test_handle_is_truthy(self):
+        self.assertTrue(ExtractRequest('1234567', 'SENR', 0, frozenset()))
+
+
+class BackoffTest(unittest.TestCase):
+
+    def test_delays_grow_and_cap(self):
+        delays = list(itertools.islice(backoff_delays(1, 8, jitter=0.25), 6))
+        for delay, ceiling in zip(delays, [1, 2, 4, 8, 8, 8]):
+            self.assertGreaterEqual(delay, 0.75 * ceiling)
+            self.assertLessEqual(delay, ceiling)
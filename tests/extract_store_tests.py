@@ -0,0 +1,70 @@
+import os
+import unittest
+from datetime import date
+from tempfile import TemporaryDirectory
+from calpads.extract_parser import ExtractLayout, ExtractParseError
+from calpads.extract_store import ExtractStore
+from tests.extract_parser_tests import senr_line
+
+
+def extract(*lines):
+    return [('\n'.join(lines) + '\n').encode('utf8')]
+
+
+class ExtractStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'extracts.db')
+        self.store = ExtractStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp_dir.cleanup()
+
+    def test_load_and_lookup(self):
+        loaded = self.store.load(extract(senr_line('1000000001'), senr_line('1000000002', exit_date='20200605'),
+                                         senr_line('1000000002')), batch_size=2)
+        self.assertEqual(loaded, 3)
+        self.assertEqual(self.store.record_types, ['SENR'])
+        found = self.store.lookup('1000000002')
+        self.assertEqual(list(found), ['SENR'])
+        first, second = found['SENR']
+        self.assertEqual(first.enrollment_exit_date, date(2020, 6, 5))
+        self.assertIsNone(second.enrollment_exit_date)
+        self.assertEqual(first.student_birth_date, date(2010, 1, 2))
+        self.assertIs(first.student_met_all_uc_csu_requirements_indicator, False)
+        self.assertEqual(self.store.lookup('1000000003'), {})
+        self.assertEqual(len(self.store.query('SENR', enrollment_exit_date=date(2020, 6, 5))), 1)
+        with self.assertRaises(ValueError):
+            self.store.query('SENR', nope=1)
+
+    def test_lookups_use_the_indexes(self):
+        self.store.load(extract(senr_line('1000000001')))
+        plan = self.store.connection.execute('EXPLAIN QUERY PLAN SELECT * FROM senr WHERE ssid = ?', ('1',)).fetchall()
+        self.assertIn('senr_ssid', ' '.join(str(step) for step in plan))
+
+    def test_reload_replaces_and_append_adds(self):
+        self.store.load(extract(senr_line('1000000001'), senr_line('1000000002')))
+        self.store.load(extract(senr_line('1000000003')))
+        self.assertEqual(self.store.count('SENR'), 1)
+        self.assertEqual(self.store.load(extract(senr_line('1000000004')), replace=False), 1)
+        self.assertEqual(self.store.count('SENR'), 2)
+        self.assertEqual(self.store.loads()['SENR']['row_count'], 2)
+
+    def test_failed_load_keeps_the_previous_extract(self):
+        self.store.load(extract(senr_line('1000000001')))
+        with self.assertRaises(ExtractParseError):
+            self.store.load(extract(senr_line('1000000002'), senr_line('3').replace('20100102', 'bad-date')))
+        self.assertEqual([record.ssid for record in self.store.query('SENR')], ['1000000001'])
+
+    def test_custom_layouts_survive_reopening(self):
+        layout = ExtractLayout('TEST', (('record_type_code', 'code'), ('ssid', 'code'), ('score', 'decimal')))
+        self.store.load(extract('TEST^1^1.5', 'TEST^2^'), layout)
+        self.store.close()
+        self.store = ExtractStore(self.path)
+        self.assertEqual([tuple(record) for record in self.store.lookup(1)['TEST']], [('TEST', '1', 1.5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
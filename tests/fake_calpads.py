@@ -0,0 +1,534 @@
+"""A stand-in for CALPADS shared by the offline tests and the benchmarks
+
+FakeCALPADS answers everything the clients walk through: the login dance, the homepage and
+UserOrgChange, the report listings, report page, SSRS iframe form, ExportUrlBase and export, the extract
+request pages, listing and download, file upload and posting, and the JSON lookups. The markup mirrors
+what CALPADS serves, trimmed to the elements the clients parse, with every name and identifier replaced
+by synthetic ones. The report form, report, and extract sizes are configurable, so client-side parsing
+and streaming costs can be measured.
+
+There are two ways to reach it:
+
+* FakeCALPADSAdapter is a requests transport adapter, mounted on a CALPADSClient's session with mount(),
+  so tests run in-process and can count the requests a client sends.
+* FakeCALPADSServer is an HTTP server on a local port, for the AsyncCALPADSClient and for benchmarks
+  that include simulated network time (see benchmarks/fake_calpads_server.py).
+"""
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+from http.client import HTTPMessage
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import urlsplit, parse_qsl, quote
+import requests
+from requests.adapters import BaseAdapter
+
+SESSION_COOKIE = '.AspNetCore.Cookies'
+
+LOGIN_PAGE = """<html><body><form method="post">
+<input name="Username"/><input name="Password" type="password"/>
+<input name="__RequestVerificationToken" value="login-token"/>
+<input id="ReturnUrl" name="ReturnUrl" value="{return_url}"/>
+</form></body></html>"""
+
+CALLBACK_PAGE = """<html><body><form method="post" action="/signin-oidc?ReturnUrl={return_url}">
+<input name="code" value="abc"/><input name="state" value="xyz"/>
+</form></body></html>"""
+
+HOMEPAGE = """<html><body><form action="/UserOrgChange" method="post">
+<select name="selectedItem">{options}</select>
+<input name="__RequestVerificationToken" value="{token}"/>
+</form></body></html>"""
+
+REPORT_LISTING = """<html><body>{items}</body></html>"""
+
+REPORT_LISTING_ITEM = """<div class="report-item"><a href="{href}">{code} {title}</a>
+<div class="num-wrap"><span class="num-wrap-in">{code}</span></div></div>"""
+
+REPORT_PAGE = """<html><body>
+<iframe src="{base}/ReportServer/Pages/ReportViewer.aspx?/CALPADSReports/{name}&amp;rs:Embed=True"></iframe>
+<iframe src="{base}/ReportServer/KeepAlive.aspx"></iframe>
+</body></html>"""
+
+REPORT_EXPORT_PAGE = """<html><body><script>
+Sys.Application.add_init(function() {{ $create(Microsoft.Reporting.WebFormsClient.ReportViewer,
+{{"ExportUrlBase":"/ReportServer/Reserved.ReportViewerWebControl.axd?ReportSession={session}\\u0026Culture=1033\
+\\u0026ControlID={control}\\u0026OpType=Export\\u0026FileName={name}\\u0026ContentDisposition=OnlyHtmlInline\
+\\u0026Format="}}); }});
+</script></body></html>"""
+
+EXTRACT_PAGE = """<html><body>
+<form action="{action}" method="post">
+<input name="RecordType" type="hidden" value="{record_type}"/>
+<input name="LEA" type="hidden" value="{lea}"/>
+<input name="EffectiveStartDate" type="text" data-val-required="required"/>
+<select name="SchoolID" multiple="multiple"><option value="All">All</option>{schools}</select>
+<input name="__RequestVerificationToken" type="hidden" value="extract-token"/>
+</form>
+<form action="{action}Date" method="post">
+<input name="RecordType" type="hidden" value="{record_type}"/>
+<input name="LEA" type="hidden" value="{lea}"/>
+<input name="EffectiveStartDate" type="text" data-val-required="required"/>
+<input name="EffectiveEndDate" type="text" data-val-required="required"/>
+<input name="__RequestVerificationToken" type="hidden" value="extract-token"/>
+</form></body></html>"""
+
+EXTRACT_REQUESTED_PAGE = """<html><body>
+<p>Extract request made successfully.  Please check back later for download.</p>
+</body></html>"""
+
+UPLOAD_PAGE = """<html><body><div id="fileUpload">
+<form action="/FileSubmission/FileUpload" method="post" enctype="multipart/form-data">
+<select name="FileType"><option value="SENR">SENR</option><option value="SINF">SINF</option></select>
+<input name="SubmissionDescription" type="text"/>
+<input name="__RequestVerificationToken" type="hidden" value="upload-token"/>
+</form></div></body></html>"""
+
+DETAIL_PAGE = """<html><body><form action="/FileSubmission/Post" method="post">
+<input name="JobID" type="hidden" value="{job_id}"/>
+<input name="__RequestVerificationToken" type="hidden" value="post-token"/>
+</form></body></html>"""
+
+SUCCESS_PAGE = """<html><body><div class="alert alert-success">{message}</div></body></html>"""
+
+REPORT_ROW = '1000001,0000001,{ssid},SYNTHETIC,STUDENT,04,Enrolled\r\n'
+
+SENR_ROW = '^'.join(['SENR', 'A', '', '1000001', '0000001', '', '2019-2020', '{ssid}', 'L{ssid}', 'SYNTHETIC', '',
+                     'STUDENT', '', '', '', '', '20100102', 'F', '', '', '', '20190815', '10', '04', '', '', '', '',
+                     'N', '', '', '', '', '', '']) + '\r\n'
+
+REPORTS = (('1.1', 'Enrollment Status Summary', 'ODS'),
+           ('1.17', 'FRPM/English Learner/Foster Youth - Count', 'ODS'),
+           ('8.1', 'Student Profile List', 'Snapshot'),
+           ('1.18', 'FRPM/English Learner/Foster Youth - Student List', 'Snapshot'))
+
+FakeResponse = namedtuple('FakeResponse', ['status_code', 'content', 'content_type', 'headers'])
+FakeResponse.__doc__ = """A FakeCALPADS answer, before either transport turns it into a response"""
+
+
+def build_report_form(n_schools):
+    """Returns the HTML of an SSRS report form with a School dropdown of n_schools options"""
+    years = ''.join('<option value="{0}">{0}</option>'.format('{}-{}'.format(y, y + 1)) for y in range(2010, 2025))
+    statuses = ''.join('<option value="{0}">{0}</option>'.format(s)
+                       for s in ('Certified', 'Revised Uncertified', 'Uncertified'))
+    labels = ['<span><input id="RV_ctl04_ctl07_divDropDown_ctl00" type="checkbox"/>'
+              '<label for="RV_ctl04_ctl07_divDropDown_ctl00">(Select All)</label></span>']
+    for i in range(n_schools):
+        labels.append('<span><input id="RV_ctl04_ctl07_divDropDown_ctl{0:02d}" type="checkbox"/>'
+                      '<label for="RV_ctl04_ctl07_divDropDown_ctl{0:02d}">School {0:04d} (19{0:05d})</label></span>'
+                      .format(i + 2))
+    return ('<html><body><form method="post">'
+            '<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="vs"/>'
+            '<input type="hidden" name="__VIEWSTATEGENERATOR" id="__VIEWSTATEGENERATOR" value="gen"/>'
+            '<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="ev"/>'
+            '<div id="RV_ctl04_ctl03" data-parametername="AcademicYear">'
+            '<select name="RV$ctl04$ctl03$ddValue"><option value="0">&lt;Select a Value&gt;</option>{years}</select>'
+            '</div>'
+            '<div id="RV_ctl04_ctl05" data-parametername="Status">'
+            '<select name="RV$ctl04$ctl05$ddValue"><option value="0">&lt;Select a Value&gt;</option>{statuses}</select>'
+            '</div>'
+            '<div id="RV_ctl04_ctl06" data-parametername="SSID"><div>'
+            '<input name="RV$ctl04$ctl06$txtValue" type="text"/></div></div>'
+            '<div id="RV_ctl04_ctl07" data-parametername="School"><div>'
+            '<input name="RV$ctl04$ctl07$txtValue" type="text" readonly="readonly"/>'
+            '<a href="#"><img src="select.gif"/></a></div></div>'
+            '<div id="RV_ctl04_ctl07_divDropDown">'
+            '<input type="hidden" name="RV$ctl04$ctl07$divDropDown$ctl01$HiddenIndices" '
+            'id="RV_ctl04_ctl07_divDropDown_ctl01_HiddenIndices" value=""/>'
+            '{labels}</div>'
+            '</form></body></html>').format(years=years, statuses=statuses, labels=''.join(labels))
+
+
+def selected_lea(leas):
+    """The code of the LEA marked Selected in a get_leas() response, or None before any was selected"""
+    selected = [lea['Value'] for lea in leas if lea['Selected']]
+    return selected[0] if selected else None
+
+
+class FakeRequest:
+
+    def __init__(self, method, path, query, content_type, body, cookie, base):
+        """One request to a FakeCALPADS, however it arrived
+
+        Args:
+            method (str): the HTTP method
+            path (str): the URL path
+            query (str): the URL query string, without the ?
+            content_type (str): the Content-Type header
+            body (bytes): the request body
+            cookie (str): the Cookie header
+            base (str): the scheme and host the request was sent to, e.g. http://127.0.0.1:8080
+        """
+        self.method = method
+        self.path = path
+        self.path_and_query = path + ('?' + query if query else '')
+        self.query = dict(parse_qsl(query))
+        is_form = content_type.startswith('application/x-www-form-urlencoded')
+        self.form = dict(parse_qsl(body.decode('utf8'))) if is_form else dict()
+        cookies = SimpleCookie(cookie)
+        self.session_id = cookies[SESSION_COOKIE].value if SESSION_COOKIE in cookies else None
+        self.base = base
+
+
+class FakeCALPADS:
+
+    def __init__(self, username='user', password='pass', lea_codes=('1111111', '2222222'), schools=50,
+                 report_bytes=1024 * 1024, extract_bytes=1024 * 1024, extract_delay=0.0):
+        """The state and pages of a fake CALPADS. Reach it through a FakeCALPADSAdapter or a FakeCALPADSServer.
+
+        Args:
+            username (str): the only username the login page accepts
+            password (str): the only password the login page accepts
+            lea_codes (iterable of str): the LEAs in the org change menu
+            schools (int): the number of schools in the report and extract forms and the school listing
+            report_bytes (int): the size of each exported report
+            extract_bytes (int): the size of each downloaded extract
+            extract_delay (float): seconds after a request until its extract is listed as Complete
+        """
+        self.username = username
+        self.password = password
+        self.lea_codes = list(lea_codes)
+        self.schools = schools
+        self.report_bytes = report_bytes
+        self.extract_bytes = extract_bytes
+        self.extract_delay = extract_delay
+        # The homepage's org change token; UserOrgChange rejects any other, like a stale one
+        self.org_token = 'org-token'
+        # {session id: selected LEA code, or None before one was selected}
+        self.sessions = dict()
+        # {LEA code: [extract request rows]}, oldest first
+        self.extracts = dict()
+        self.jobs = []
+        self._ids = itertools.count(1)
+        self._payloads = dict()
+        self.lock = threading.Lock()
+
+    def expire(self):
+        """Forget every session, like CALPADS does when they time out"""
+        with self.lock:
+            self.sessions = dict()
+
+    def next_id(self):
+        return next(self._ids)
+
+    def payload(self, kind, size):
+        """About size bytes of whole rows: CSV for 'REPORT', caret-delimited SENR records otherwise. Built once per
+        size and reused."""
+        key = (kind, size)
+        if key not in self._payloads:
+            row = REPORT_ROW if kind == 'REPORT' else SENR_ROW
+            count = max(1, size // len(row.format(ssid=0)))
+            self._payloads[key] = ''.join(row.format(ssid=1000000000 + i) for i in range(count)).encode('utf8')
+        return self._payloads[key]
+
+    def respond(self, request):
+        """Returns the FakeResponse to a FakeRequest"""
+        if request.path == '/Account/Login':
+            return self.login(request)
+        if request.path == '/connect/authorize/callback':
+            return _html(CALLBACK_PAGE.format(return_url=quote(request.query.get('ReturnUrl', '/'), safe='')))
+        if request.path == '/signin-oidc':
+            session_id = str(self.next_id())
+            with self.lock:
+                self.sessions[session_id] = None
+            return _redirect(request.query.get('ReturnUrl', '/'),
+                             {'Set-Cookie': '{}={}; Path=/; HttpOnly'.format(SESSION_COOKIE, session_id)})
+        if request.session_id not in self.sessions:
+            return _redirect('/Account/Login?ReturnUrl=' + quote(request.path_and_query, safe=''))
+        route = ROUTES.get((request.method, request.path))
+        if route is None:
+            for (route_method, pattern), handler in PATTERN_ROUTES:
+                if route_method == request.method and pattern.match(request.path):
+                    route = handler
+                    break
+        if route is None:
+            return FakeResponse(404, b'Not Found', 'text/plain', dict())
+        return route(self, request)
+
+    def login(self, request):
+        if request.method == 'POST' and (request.form.get('Username'),
+                                         request.form.get('Password')) == (self.username, self.password):
+            return _redirect('/connect/authorize/callback?ReturnUrl=' + quote(request.form.get('ReturnUrl', '/'),
+                                                                               safe=''))
+        return _html(LOGIN_PAGE.format(return_url=request.query.get('ReturnUrl', '/')))
+
+    def session_lea(self, request):
+        """The LEA the request's session is working within. Sessions start in the first LEA."""
+        return self.sessions.get(request.session_id) or self.lea_codes[0]
+
+    def homepage(self, request):
+        options = ''.join('<option value="{0}">{1} - Synthetic LEA {0}</option>'.format(i, code)
+                          for i, code in enumerate(self.lea_codes, start=1))
+        return _html(HOMEPAGE.format(options=options, token=self.org_token))
+
+    def org_change(self, request):
+        if request.form.get('__RequestVerificationToken') != self.org_token:
+            return FakeResponse(400, b'Bad Request', 'text/plain', dict())
+        index = int(request.form.get('selectedItem', 1)) - 1
+        with self.lock:
+            self.sessions[request.session_id] = self.lea_codes[index]
+        return _redirect('/')
+
+    def home_redirect(self, request):
+        return _redirect('/')
+
+    def leas(self, request):
+        selected = self.sessions.get(request.session_id)
+        return _json([{'Disabled': False, 'Group': None, 'Selected': code == selected,
+                       'Text': '{} - Synthetic LEA'.format(code), 'Value': code}
+                      for code in self.lea_codes])
+
+    def school_listing(self, request):
+        return _json([{'Disabled': False, 'Group': None, 'Selected': False,
+                       'Text': 'School {:04d}'.format(i), 'Value': '{:07d}'.format(i)}
+                      for i in range(1, self.schools + 1)])
+
+    def submitter_names(self, request):
+        return _json([{'Disabled': False, 'Group': None, 'Selected': False, 'Text': self.username, 'Value': '42'}])
+
+    def user_orgs(self, request):
+        return _json({'Data': [{'OrgName': 'Synthetic LEA', 'OrgCode': self.session_lea(request), 'UserOrgId': 42}],
+                      'Total Count': 1})
+
+    def homepage_json(self, request):
+        return _json({'Data': [], 'Total Count': 0})
+
+    def submissions(self, request):
+        with self.lock:
+            jobs = list(self.jobs) or [{'JobID': '1', 'FileTypeCode': 'SENR'}]
+        return _json({'Data': [dict(job, SubmissionStatus='Ready for Review', Rejected='0') for job in jobs],
+                      'Total Count': len(jobs)})
+
+    def history(self, request):
+        ssid, endpoint = request.path.split('/')[2:4]
+        return _json({'Data': [{'SSID': ssid, 'Endpoint': endpoint, 'SchoolCode': '0000001',
+                                'StartDate': '2019-08-15', 'EndDate': None}], 'Total Count': 1})
+
+    def report_listing(self, request):
+        listing = request.path.rsplit('/', 1)[-1]
+        items = ''.join(REPORT_LISTING_ITEM.format(href='/Report/{}/{}'.format(listing, code.replace('.', '_')),
+                                                   code=code, title=title)
+                        for code, title, kind in REPORTS if kind == listing)
+        return _html(REPORT_LISTING.format(items=items))
+
+    def report_page(self, request):
+        return _html(REPORT_PAGE.format(base=request.base, name=request.path.rsplit('/', 1)[-1]))
+
+    def report_form(self, request):
+        return _html(build_report_form(self.schools))
+
+    def report_export_page(self, request):
+        return _html(REPORT_EXPORT_PAGE.format(session=self.next_id(), control='ctl00', name='Report'))
+
+    def report_export(self, request):
+        return FakeResponse(200, self.payload('REPORT', self.report_bytes), 'text/csv', dict())
+
+    def extract_page(self, request):
+        record_type = request.query.get('RecordType', request.path.rsplit('/', 1)[-1].upper())
+        schools = ''.join('<option value="{0:07d}">School {0:04d}</option>'.format(i)
+                          for i in range(1, self.schools + 1))
+        return _html(EXTRACT_PAGE.format(action=request.path, record_type=record_type,
+                                         lea=self.session_lea(request), schools=schools))
+
+    def extract_request(self, request):
+        row = {'ExtractRequestID': self.next_id(),
+               'ExtractType': request.form.get('RecordType', request.path.rsplit('/', 1)[-1]),
+               'RequestedAt': time.time()}
+        with self.lock:
+            self.extracts.setdefault(self.session_lea(request), []).append(row)
+        return _html(EXTRACT_REQUESTED_PAGE)
+
+    def extract_listing(self, request):
+        now = time.time()
+        with self.lock:
+            rows = list(self.extracts.get(request.query.get('SelectedLEA', self.session_lea(request)), []))
+        data = [{'ExtractRequestID': row['ExtractRequestID'], 'ExtractType': row['ExtractType'],
+                 'ExtractStatus': 'Complete' if now - row['RequestedAt'] >= self.extract_delay else 'In Process'}
+                for row in reversed(rows)]
+        return _json({'Data': data, 'Total Count': len(data)})
+
+    def extract_download(self, request):
+        return FakeResponse(200, self.payload('SENR', self.extract_bytes), 'text/plain', dict())
+
+    def upload_page(self, request):
+        return _html(UPLOAD_PAGE)
+
+    def upload(self, request):
+        job = {'JobID': str(self.next_id()), 'FileTypeCode': 'SENR'}
+        with self.lock:
+            self.jobs.append(job)
+        return _html(SUCCESS_PAGE.format(message='File uploaded successfully.'))
+
+    def submission_detail(self, request):
+        return _html(DETAIL_PAGE.format(job_id=request.path.rsplit('/', 1)[-1]))
+
+    def post_submission(self, request):
+        return _html(SUCCESS_PAGE.format(message='The file was posted.'))
+
+
+def _html(text):
+    return FakeResponse(200, text.encode('utf8'), 'text/html; charset=utf-8', dict())
+
+
+def _json(data):
+    return FakeResponse(200, json.dumps(data).encode('utf8'), 'application/json; charset=utf-8', dict())
+
+
+def _redirect(location, headers=None):
+    return FakeResponse(302, b'', 'text/html', dict(headers or dict(), Location=location))
+
+
+ROUTES = {('GET', '/'): FakeCALPADS.homepage,
+          ('GET', '/UserOrgChange'): FakeCALPADS.home_redirect,
+          ('POST', '/UserOrgChange'): FakeCALPADS.org_change,
+          ('GET', '/Leas'): FakeCALPADS.leas,
+          ('GET', '/SchoolListingAll'): FakeCALPADS.school_listing,
+          ('GET', '/GetSubmitterNames'): FakeCALPADS.submitter_names,
+          ('GET', '/HomepageSubmissions'): FakeCALPADS.submissions,
+          ('GET', '/Report/ODS'): FakeCALPADS.report_listing,
+          ('GET', '/Report/Snapshot'): FakeCALPADS.report_listing,
+          ('GET', '/ReportServer/Pages/ReportViewer.aspx'): FakeCALPADS.report_form,
+          ('POST', '/ReportServer/Pages/ReportViewer.aspx'): FakeCALPADS.report_export_page,
+          ('GET', '/ReportServer/Reserved.ReportViewerWebControl.axd'): FakeCALPADS.report_export,
+          ('GET', '/Extract'): FakeCALPADS.extract_listing,
+          ('GET', '/Extract/DownloadLink'): FakeCALPADS.extract_download,
+          ('GET', '/FileSubmission/FileUpload'): FakeCALPADS.upload_page,
+          ('POST', '/FileSubmission/FileUpload'): FakeCALPADS.upload,
+          ('POST', '/FileSubmission/Post'): FakeCALPADS.post_submission}
+
+# Checked in order when no exact route matches
+PATTERN_ROUTES = ((('GET', re.compile(r'^/Homepage\w+$')), FakeCALPADS.homepage_json),
+                  (('GET', re.compile(r'^/GetUserOrgs/[^/]+$')), FakeCALPADS.user_orgs),
+                  (('GET', re.compile(r'^/(Student|Staff)/\d+/\w+$')), FakeCALPADS.history),
+                  (('GET', re.compile(r'^/Report/(ODS|Snapshot)/\w+$')), FakeCALPADS.report_page),
+                  (('GET', re.compile(r'^/Extract/\w+$')), FakeCALPADS.extract_page),
+                  (('POST', re.compile(r'^/Extract/\w+$')), FakeCALPADS.extract_request),
+                  (('GET', re.compile(r'^/FileSubmission/Detail/\d+$')), FakeCALPADS.submission_detail))
+
+
+class FakeCALPADSAdapter(FakeCALPADS, BaseAdapter):
+
+    def __init__(self, username='user', password='pass', **kwargs):
+        """A FakeCALPADS answering in-process as a requests transport adapter. Mount it with mount().
+
+        The (method, path) of every request it receives is appended to self.requests.
+
+        Args:
+            see FakeCALPADS
+        """
+        FakeCALPADS.__init__(self, username, password, **kwargs)
+        BaseAdapter.__init__(self)
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        scheme, netloc, path, query, _ = urlsplit(request.url)
+        self.requests.append((request.method, path))
+        body = request.body or b''
+        if isinstance(body, str):
+            body = body.encode('utf8')
+        answer = self.respond(FakeRequest(request.method, path, query, request.headers.get('Content-Type', ''), body,
+                                          request.headers.get('Cookie', ''), '{}://{}'.format(scheme, netloc)))
+        headers = dict(answer.headers, **{'Content-Type': answer.content_type})
+        response = requests.Response()
+        response.status_code = answer.status_code
+        response.headers.update(headers)
+        response.url = request.url
+        response.request = request
+        response.encoding = 'utf8'
+        response._content = answer.content
+        response.raw = _Raw(headers)
+        return response
+
+    def close(self):
+        pass
+
+
+class _Raw:
+    """Just enough of a urllib3 response for requests to pick up Set-Cookie headers"""
+
+    def __init__(self, headers):
+        msg = HTTPMessage()
+        for name, value in headers.items():
+            msg[name] = value
+        self._original_response = SimpleNamespace(msg=msg)
+
+    def release_conn(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def mount(client, adapter=None):
+    """Mount a FakeCALPADSAdapter, by default one accepting the client's credentials, at the client's host"""
+    adapter = adapter or FakeCALPADSAdapter(client.username, client.password)
+    client.session.mount(client.host.rstrip('/'), adapter)
+    return adapter
+
+
+class FakeCALPADSServer(FakeCALPADS, ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), username='user', password='pass', latency=0.0, jitter=0.0,
+                 **kwargs):
+        """A FakeCALPADS served over HTTP. Call serve_forever(), e.g. from a thread, and point a client at url.
+
+        Args:
+            address (tuple): the (host, port) to listen on. Port 0 picks a free port.
+            latency (float): seconds to wait before answering each request
+            jitter (float): up to this many more seconds, chosen at random, are added to each wait
+            others: see FakeCALPADS
+        """
+        FakeCALPADS.__init__(self, username, password, **kwargs)
+        ThreadingHTTPServer.__init__(self, address, FakeCALPADSHandler)
+        self.latency = latency
+        self.jitter = jitter
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}/'.format(host, port)
+
+
+class FakeCALPADSHandler(BaseHTTPRequestHandler):
+
+    # Keep connections alive, like CALPADS does, so the client's connection pool is exercised
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, which Nagle's algorithm would hold back for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self, method):
+        server = self.server
+        wait = server.latency + (random.uniform(0, server.jitter) if server.jitter else 0)
+        if wait:
+            time.sleep(wait)
+        path, _, query = self.path.partition('?')
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        answer = server.respond(FakeRequest(method, path, query, self.headers.get('Content-Type', ''), body,
+                                            self.headers.get('Cookie', ''), server.url.rstrip('/')))
+        self.send_response(answer.status_code)
+        self.send_header('Content-Type', answer.content_type)
+        self.send_header('Content-Length', str(len(answer.content)))
+        for name, value in answer.headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        # Write large payloads in chunks so streaming downloads see them arrive gradually
+        view = memoryview(answer.content)
+        for start in range(0, len(view), 256 * 1024):
+            self.wfile.write(view[start:start + 256 * 1024])
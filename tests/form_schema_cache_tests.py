@@ -0,0 +1,71 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from calpads.form_schema_cache import (FormSchemaCache, validate_extract_form_data, validate_report_form_data,
+                                       SCHEMA_VERSION)
+
+EXTRACT_SCHEMA = {'EnrollmentStartDate': {'Required': True,
+                                          'ValidValues': 'string with valid date formatting, MM/DD/YYYY e.g. 02/02/2020'},
+                  'SSID': {'Required': False, 'ValidValues': str},
+                  'IncludeExits': {'Required': False, 'ValidValues': bool},
+                  'School': {'Required': False,
+                             'ValidValues': {'_allows_multiple': True, 'Summit Prep': '0000001',
+                                             'Summit Tahoma': '0000002'}},
+                  'AcademicYear': {'Required': True,
+                                   'ValidValues': {'_allows_multiple': False, '2019-2020': '2019-2020'}}}
+
+REPORT_SCHEMA = {'AcademicYear': ('2018-2019', '2019-2020'),
+                 'SSID': ("You can insert any string here",),
+                 'School': {'Summit Prep': (True, False)}}
+
+
+class FormSchemaCacheTest(unittest.TestCase):
+
+    def test_round_trip_keeps_types(self):
+        cache = FormSchemaCache()
+        self.assertTrue(cache.put('extract', '1234567', 'SENR:default', EXTRACT_SCHEMA))
+        self.assertEqual(cache.get('extract', '1234567', 'SENR:default'), EXTRACT_SCHEMA)
+        self.assertIsNone(cache.get('extract', '7654321', 'SENR:default'))
+
+    def test_fingerprint_change_replaces_entry(self):
+        cache = FormSchemaCache()
+        cache.put('report', '1234567', '8.1:ods', REPORT_SCHEMA)
+        self.assertFalse(cache.put('report', '1234567', '8.1:ods', dict(REPORT_SCHEMA)))
+        changed = dict(REPORT_SCHEMA, Status=('Certified',))
+        self.assertTrue(cache.put('report', '1234567', '8.1:ods', changed))
+        self.assertEqual(cache.get('report', '1234567', '8.1:ods'), changed)
+
+    def test_invalidate(self):
+        cache = FormSchemaCache()
+        cache.put('report', '1', '8.1:ods', REPORT_SCHEMA)
+        cache.put('extract', '1', 'SENR:default', EXTRACT_SCHEMA)
+        cache.invalidate(kind='report')
+        self.assertIsNone(cache.get('report', '1', '8.1:ods'))
+        self.assertIsNotNone(cache.get('extract', '1', 'SENR:default'))
+
+    def test_disk_persistence_and_version(self):
+        with TemporaryDirectory() as td:
+            path = os.path.join(td, 'schemas.json')
+            FormSchemaCache(path).put('report', '1', '8.1:ods', REPORT_SCHEMA)
+            self.assertEqual(FormSchemaCache(path).get('report', '1', '8.1:ods'), REPORT_SCHEMA)
+            with open(path, 'w') as f:
+                f.write('{"version": %d, "entries": {}}' % (SCHEMA_VERSION + 1))
+            self.assertIsNone(FormSchemaCache(path).get('report', '1', '8.1:ods'))
+
+
+class FormValidationTest(unittest.TestCase):
+
+    def test_valid_extract_form_data(self):
+        form_data = [('EnrollmentStartDate', '02/02/2020'), ('AcademicYear', '2019-2020'),
+                     ('School', '0000001'), ('School', '0000002')]
+        self.assertEqual(validate_extract_form_data(EXTRACT_SCHEMA, form_data), [])
+
+    def test_invalid_extract_form_data(self):
+        problems = validate_extract_form_data(EXTRACT_SCHEMA, [('School', '9999999'), ('Bogus', 'x')])
+        self.assertEqual(len(problems), 4)
+
+    def test_report_form_data(self):
+        self.assertEqual(validate_report_form_data(REPORT_SCHEMA, {'AcademicYear': '2019-2020', 'SSID': 'x',
+                                                                   'School': {'summit prep': True}}), [])
+        self.assertEqual(len(validate_report_form_data(REPORT_SCHEMA, {'AcademicYear': '1999',
+                                                                       'School': {'Nope': True}})), 2)
@@ -0,0 +1,115 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from calpads.bulk import BulkHistoryFetcher, BulkResult, HistoryLookupFailed
+from calpads.extract_diff import ExtractDiff
+from calpads.history_sync import HistoryMirror, HistorySync, content_hash, endpoints_for_changes
+from tests.extract_parser_tests import senr_line
+
+
+class FakeClient:
+    """Serves histories from a dict and counts the lookups"""
+
+    def __init__(self, histories, calls):
+        self.histories = histories
+        self.calls = calls
+        self.session = self
+
+    def close(self):
+        pass
+
+    def _history(self, endpoint, ssid):
+        self.calls.append((ssid, endpoint))
+        if ssid == 'bad':
+            raise ValueError('bad ssid')
+        if (ssid, endpoint) in self.histories and self.histories[(ssid, endpoint)] is None:
+            # What the getters return for a response that isn't JSON, e.g. a login page
+            return {}
+        return {'Data': self.histories.get((ssid, endpoint), []), 'Total Count': 0}
+
+    def get_enrollment_history(self, ssid):
+        return self._history('enrollment', ssid)
+
+    def get_demographics_history(self, ssid):
+        return self._history('demographics', ssid)
+
+
+class HistorySyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.mirror = HistoryMirror(os.path.join(self.tmp_dir.name, 'histories.db'))
+        self.histories = dict()
+        self.calls = []
+        self.fetcher = BulkHistoryFetcher(lambda: FakeClient(self.histories, self.calls), max_workers=2)
+        self.sync = HistorySync(self.fetcher, self.mirror, endpoints=['enrollment', 'demographics'], commit_every=2)
+
+    def tearDown(self):
+        self.fetcher.close()
+        self.mirror.close()
+        self.tmp_dir.cleanup()
+
+    def test_roster_fetches_only_what_is_missing_or_stale(self):
+        report = self.sync.sync(roster=['1', '2'])
+        self.assertEqual(report.fetched, 4)
+        self.assertEqual(len(report.changed), 4)
+        self.assertEqual(len(self.mirror), 4)
+        del self.calls[:]
+        report = self.sync.sync(roster=['1', '2', '3'])
+        self.assertEqual(sorted(self.calls), [('3', 'demographics'), ('3', 'enrollment')])
+        self.assertEqual(report.skipped, 4)
+        del self.calls[:]
+        report = self.sync.sync(roster=['1', '2', '3'], max_age=0)
+        self.assertEqual(report.fetched, 6)
+        self.assertEqual(report.unchanged, 6)
+
+    def test_changed_ssids_and_failures(self):
+        self.sync.sync(roster=['1'])
+        self.histories[('1', 'enrollment')] = [{'SchoolCode': '0123456'}]
+        report = self.sync.sync(changed=['1', 'bad'])
+        self.assertEqual(report.changed, [('1', 'enrollment')])
+        self.assertEqual(len(report.failed), 2)
+        self.assertEqual(self.mirror.get('1', 'enrollment')['Data'], [{'SchoolCode': '0123456'}])
+        self.assertIsNone(self.mirror.get('bad', 'enrollment'))
+
+    def test_response_without_data_keeps_the_mirror(self):
+        self.histories[('1', 'enrollment')] = [{'SchoolCode': '0123456'}]
+        self.sync.sync(roster=['1'])
+        self.histories[('1', 'enrollment')] = None
+        report = self.sync.sync(changed=['1'])
+        self.assertEqual(report.changed, [])
+        self.assertEqual([(result.identifier, result.endpoint) for result in report.failed], [('1', 'enrollment')])
+        self.assertEqual(self.mirror.get('1', 'enrollment')['Data'], [{'SchoolCode': '0123456'}])
+
+    def test_sync_checks_the_data_itself(self):
+        self.sync.sync(roster=['1'])
+
+        class PassThroughFetcher:
+            def fetch(self, identifiers, endpoints):
+                return [BulkResult(identifier, endpoint, {}, None)
+                        for identifier in identifiers for endpoint in endpoints]
+        report = HistorySync(PassThroughFetcher(), self.mirror, endpoints=['enrollment']).sync(changed=['1'])
+        self.assertIsInstance(report.failed[0].error, HistoryLookupFailed)
+        self.assertEqual(self.mirror.get('1', 'enrollment'), {'Data': [], 'Total Count': 0})
+
+    def test_extract_changes_pick_the_endpoints(self):
+        old = [senr_line('1000000001'), senr_line('1000000002'), senr_line('1000000003')]
+        new = [senr_line('1000000001', exit_date='20200605'), senr_line('1000000002', first_name='Joe'),
+               senr_line('1000000003')]
+        diff = ExtractDiff([('\n'.join(old)).encode('utf8')], [('\n'.join(new)).encode('utf8')], partitions=1)
+        self.assertEqual(endpoints_for_changes(diff), {'1000000001': {'enrollment'},
+                                                       '1000000002': {'enrollment', 'demographics'}})
+        self.sync.sync(changes=diff)
+        self.assertEqual(sorted(self.calls), [('1000000001', 'enrollment'), ('1000000002', 'demographics'),
+                                              ('1000000002', 'enrollment')])
+
+
+class ContentHashTest(unittest.TestCase):
+
+    def test_key_order_is_ignored(self):
+        self.assertEqual(content_hash({'a': 1, 'b': [1, 2]}), content_hash({'b': [1, 2], 'a': 1}))
+        self.assertNotEqual(content_hash({'a': 1}), content_hash({'a': 2}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from calpads.client import CALPADSClient
+from calpads.metrics import MetricsRegistry, endpoint_template
+from tests.fake_calpads import mount
+
+
+class EndpointTemplateTest(unittest.TestCase):
+
+    def test_identifiers_are_replaced(self):
+        self.assertEqual(endpoint_template('https://www.calpads.org/Student/1234567890/Enrollment?format=JSON'),
+                         'www.calpads.org/Student/{id}/Enrollment')
+        self.assertEqual(endpoint_template('https://www.calpads.org/GetUserOrgs/someone@example.org?format=JSON'),
+                         'www.calpads.org/GetUserOrgs/{id}')
+        self.assertEqual(endpoint_template('https://www.calpads.org/Extract/DownloadLink?ExtractRequestID=5'),
+                         'www.calpads.org/Extract/DownloadLink')
+
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def test_requests_are_recorded_by_the_hook(self):
+        metrics = MetricsRegistry()
+        client = CALPADSClient('user', 'pass', metrics=metrics)
+        mount(client)
+        client.get_leas()
+        summary = {(row['method'], row['endpoint']): row for row in metrics.to_json()['requests']}
+        self.assertEqual(summary[('GET', 'www.calpads.org/Leas')]['statuses'], {'200': 1})
+        self.assertEqual(summary[('POST', 'www.calpads.org/Account/Login')]['count'], 1)
+
+    def test_flow_steps_and_outcomes(self):
+        metrics = MetricsRegistry()
+        with metrics.flow('download_report', report='8.1') as flow:
+            flow.mark('select_lea')
+            flow.mark('iframe')
+        with self.assertRaises(ValueError):
+            with metrics.flow('download_report'):
+                raise ValueError()
+        summary = metrics.to_json()
+        self.assertEqual(summary['flows'][0]['ok'], 1)
+        self.assertEqual(summary['flows'][0]['error'], 1)
+        self.assertEqual([row['step'] for row in summary['steps']], ['iframe', 'select_lea'])
+        self.assertEqual([step for step, seconds in flow.steps], ['select_lea', 'iframe'])
+
+    def test_prometheus_text(self):
+        metrics = MetricsRegistry()
+        metrics.observe_request('GET', 'https://www.calpads.org/Leas', 200, 0.3, 120)
+        metrics.observe_request('GET', 'https://www.calpads.org/Leas', 502, 3.0)
+        text = metrics.to_prometheus()
+        labels = 'endpoint="www.calpads.org/Leas"'
+        self.assertIn('calpads_request_seconds_bucket{method="GET",%s,le="0.5"} 1' % labels, text)
+        self.assertIn('calpads_request_seconds_bucket{method="GET",%s,le="+Inf"} 2' % labels, text)
+        self.assertIn('calpads_responses_total{method="GET",%s,status="502"} 1' % labels, text)
+        self.assertIn('calpads_response_bytes_total{method="GET",%s} 120' % labels, text)
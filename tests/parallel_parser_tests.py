@@ -0,0 +1,107 @@
+import os
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import TemporaryDirectory
+from calpads.extract_parser import ExtractParseError, iter_extract_records
+from calpads.parallel_parser import split_ranges, iter_parallel_batches
+from tests.extract_parser_tests import senr_line
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class SplitRangesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'extract.txt')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_ranges_cover_the_file_and_end_on_newlines(self):
+        with open(self.path, 'wb') as f:
+            f.write(b''.join(b'%d^' % i + b'x' * (i % 7) + b'\n' for i in range(200)) + b'last')
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for range_size in (1, 10, 64, 10 ** 6):
+            ranges = split_ranges(self.path, range_size)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], len(data))
+            for (start, end), (next_start, next_end) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, next_start)
+                self.assertEqual(data[end - 1:end], b'\n')
+
+    def test_empty_file(self):
+        open(self.path, 'wb').close()
+        self.assertEqual(split_ranges(self.path), [])
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class IterParallelBatchesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.executor = ProcessPoolExecutor(max_workers=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.shutdown()
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'senr.txt')
+        lines = ['RecordTypeCode^TransactionTypeCode']
+        lines.extend(senr_line('{:010d}'.format(i), exit_date='20200605' if i % 3 else '') for i in range(300))
+        with open(self.path, 'w', encoding='utf8') as f:
+            f.write('\r\n'.join(lines) + '\r\n')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_ordered_batches_match_the_streaming_parser(self):
+        expected = list(iter_extract_records(self.path))
+        batches = list(iter_parallel_batches(self.path, range_size=2048, executor=self.executor))
+        self.assertGreater(len(batches), 1)
+        ssids = [ssid for batch in batches for ssid in batch['ssid']]
+        self.assertEqual(ssids, [record.ssid for record in expected])
+        exit_dates = numpy.concatenate([batch['enrollment_exit_date'] for batch in batches])
+        self.assertTrue(numpy.isnat(exit_dates[0]))
+        self.assertEqual(exit_dates[1], numpy.datetime64('2020-06-05'))
+        self.assertEqual(batches[0]['student_legal_first_name'][0], 'José')
+
+    def test_unordered_batches_have_every_record(self):
+        batches = iter_parallel_batches(self.path, 'SENR', ordered=False, range_size=2048, executor=self.executor)
+        ssids = sorted(ssid for batch in batches for ssid in batch['ssid'])
+        self.assertEqual(ssids, ['{:010d}'.format(i) for i in range(300)])
+
+    def test_a_single_range_is_parsed_in_process(self):
+        batches = list(iter_parallel_batches(self.path, range_size=10 ** 6))
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(len(batches[0]['ssid']), 300)
+
+    def test_bad_values_report_the_range(self):
+        with open(self.path, 'a', encoding='utf8') as f:
+            f.write(senr_line('1').replace('20100102', '2010-01-02') + '\n')
+        with self.assertRaisesRegex(ExtractParseError, 'bytes'):
+            list(iter_parallel_batches(self.path, range_size=2048, executor=self.executor))
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_arrow_record_batches(self):
+        batches = list(iter_parallel_batches(self.path, output='arrow', range_size=2048, executor=self.executor))
+        table = pyarrow.Table.from_batches(batches)
+        self.assertEqual(table.num_rows, 300)
+        self.assertEqual(table.schema.field('student_birth_date').type, pyarrow.date32())
+        self.assertEqual(table.schema.field('student_met_all_uc_csu_requirements_indicator').type, pyarrow.bool_())
+        self.assertEqual(table.column('enrollment_exit_date').null_count, 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import threading
+import time
+import unittest
+from calpads.pool import CALPADSClientPool
+
+
+class FakeSession:
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClient:
+
+    def __init__(self, username, password):
+        self.username = username
+        self.session = FakeSession()
+        self._selected_lea = None
+        self.switches = 0
+
+    def _select_lea(self, lea_code):
+        if lea_code != self._selected_lea:
+            self.switches += 1
+            self._selected_lea = lea_code
+
+
+class CALPADSClientPoolTest(unittest.TestCase):
+
+    def test_prefers_client_pinned_to_lea(self):
+        pool = CALPADSClientPool([('a', 'x'), ('b', 'y')], client_factory=FakeClient)
+        with pool.lease('1111111') as first, pool.lease('2222222') as second:
+            self.assertEqual({first.username, second.username}, {'a', 'b'})
+        with pool.lease('2222222') as client:
+            self.assertIs(client, second)
+        self.assertEqual(second.switches, 1)
+        self.assertEqual(pool.stats, {'created': 2, 'idle': 2, 'leased': 0})
+
+    def test_waits_for_a_free_client(self):
+        pool = CALPADSClientPool([('a', 'x')], client_factory=FakeClient)
+        with pool.lease('1111111'):
+            with self.assertRaises(TimeoutError):
+                with pool.lease('2222222', timeout=0.01):
+                    pass
+
+    def test_run_is_exclusive_per_client(self):
+        pool = CALPADSClientPool([('a', 'x')], size=3, client_factory=FakeClient)
+        in_use = set()
+        lock = threading.Lock()
+
+        def work(client, lea_code):
+            with lock:
+                self.assertNotIn(id(client), in_use)
+                in_use.add(id(client))
+            time.sleep(0.01)
+            self.assertEqual(client._selected_lea, lea_code)
+            with lock:
+                in_use.discard(id(client))
+            if lea_code == 'bad':
+                raise ValueError(lea_code)
+            return lea_code
+
+        results = list(pool.run(work, ['1', '2', '3', '4', '5', 'bad']))
+        self.assertEqual(sorted(r.data for r in results if r.error is None), ['1', '2', '3', '4', '5'])
+        self.assertEqual([r.lea_code for r in results if r.error is not None], ['bad'])
+        self.assertLessEqual(pool.stats['created'], 3)
+        pool.close()
+        self.assertEqual(pool.stats['idle'], 0)
@@ -0,0 +1,61 @@
+import os
+import time
+import unittest
+from tempfile import TemporaryDirectory
+from calpads.reports_catalog import ReportCatalog, parse_report_listing
+
+HOST = 'https://www.calpads.org/'
+
+
+def listing_page(reports):
+    items = ''.join('<div class="report-item"><a href="{}">{}</a>'
+                    '<div class="num-wrap"><span class="num-wrap-in">{}</span></div></div>'
+                    .format(href, title, code)
+                    for code, title, href in reports)
+    return '<html><body>{}</body></html>'.format(items)
+
+
+ODS_PAGE = listing_page([('1.17', 'FRPM/EL/Foster Youth - Count', '/Report/ODS/1_17_FRPM_EL_Count'),
+                         ('8.1', 'Student Profile List', '/Report/ODS/8_1_StudentProfileList')])
+SNAPSHOT_PAGE = listing_page([('1.2', 'Enrollment - Count', '/Report/Snapshot/1_2_Enrollment'),
+                              ('8.1', 'Student Profile List', '/Report/Snapshot/8_1_StudentProfileList')])
+
+
+class ReportCatalogTest(unittest.TestCase):
+
+    def test_parse_listing(self):
+        entries = parse_report_listing(ODS_PAGE, HOST, False)
+        self.assertEqual([entry.code for entry in entries], ['1.17', '8.1'])
+        self.assertEqual(entries[0].url, 'https://www.calpads.org/Report/ODS/1_17_FRPM_EL_Count')
+        self.assertEqual(entries[0].title, 'FRPM/EL/Foster Youth - Count')
+        self.assertFalse(entries[0].is_snapshot)
+
+    def test_lookup_by_code_and_kind(self):
+        catalog = ReportCatalog()
+        self.assertTrue(catalog.is_stale)
+        catalog.load_listings(ODS_PAGE, SNAPSHOT_PAGE, HOST)
+        self.assertFalse(catalog.is_stale)
+        self.assertTrue(catalog.get('8.1', is_snapshot=True).url.endswith('/Snapshot/8_1_StudentProfileList'))
+        self.assertTrue(catalog.get('8.1', is_snapshot=False).url.endswith('/ODS/8_1_StudentProfileList'))
+        self.assertIsNone(catalog.get('1.2', is_snapshot=False))
+        # The EOY3 variant isn't on the listing pages but is always indexed
+        self.assertIsNotNone(catalog.get('8.1EOY3', is_snapshot=True))
+
+    def test_entries_are_sorted_naturally(self):
+        catalog = ReportCatalog()
+        catalog.load_listings(ODS_PAGE, SNAPSHOT_PAGE, HOST)
+        self.assertEqual([entry.code for entry in catalog.entries(is_snapshot=True)], ['1.2', '8.1', '8.1eoy3'])
+
+    def test_ttl(self):
+        catalog = ReportCatalog(ttl=60)
+        catalog.load_listings(ODS_PAGE, SNAPSHOT_PAGE, HOST)
+        catalog.fetched_at = time.time() - 61
+        self.assertTrue(catalog.is_stale)
+
+    def test_disk_cache(self):
+        with TemporaryDirectory() as td:
+            path = os.path.join(td, 'reports.json')
+            ReportCatalog(cache_path=path).load_listings(ODS_PAGE, SNAPSHOT_PAGE, HOST)
+            reloaded = ReportCatalog(cache_path=path)
+            self.assertFalse(reloaded.is_stale)
+            self.assertEqual(reloaded.get('1.17').title, 'FRPM/EL/Foster Youth - Count')
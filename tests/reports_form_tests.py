@@ -0,0 +1,61 @@
+import unittest
+from calpads.reports_form import ReportsForm
+
+FORM_HTML = """<html><body><form>
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="vs"/>
+<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="ev"/>
+<div id="RV_ctl04_ctl03" data-parametername="AcademicYear">
+  <select name="RV$ctl04$ctl03$ddValue">
+    <option value="0">&lt;Select a Value&gt;</option>
+    <option value="1">2018-2019</option>
+    <option value="2">2019-2020</option>
+  </select>
+</div>
+<div id="RV_ctl04_ctl05" data-parametername="SSID"><div><input name="RV$ctl04$ctl05$txtValue" type="text"/></div></div>
+<div id="RV_ctl04_ctl07" data-parametername="School"><div>
+  <input name="RV$ctl04$ctl07$txtValue" type="text" readonly="readonly"/><a href="#"><img src="s.gif"/></a>
+</div></div>
+<div id="RV_ctl04_ctl07_divDropDown">
+  <input type="hidden" name="RV$ctl04$ctl07$divDropDown$ctl01$HiddenIndices"
+         id="RV_ctl04_ctl07_divDropDown_ctl01_HiddenIndices" value=""/>
+  <span><input id="RV_ctl04_ctl07_divDropDown_ctl00" type="checkbox"/>
+        <label for="RV_ctl04_ctl07_divDropDown_ctl00">(Select All)</label></span>
+  <span><input id="RV_ctl04_ctl07_divDropDown_ctl02" type="checkbox"/>
+        <label for="RV_ctl04_ctl07_divDropDown_ctl02">Summit Prep</label></span>
+  <span><input id="RV_ctl04_ctl07_divDropDown_ctl03" type="checkbox"/>
+        <label for="RV_ctl04_ctl07_divDropDown_ctl03">Summit Tahoma</label></span>
+</div>
+</form></body></html>"""
+
+
+class ReportsFormTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.form = ReportsForm(FORM_HTML)
+
+    def test_filtered_parse(self):
+        self.assertEqual(self.form.filtered_parse,
+                         {'AcademicYear': ('2018-2019', '2019-2020'),
+                          'SSID': ("You can insert any string here",),
+                          'School': {'Summit Prep': (True, False), 'Summit Tahoma': (True, False)}})
+
+    def test_complete_parse_dropdown(self):
+        kind, options = self.form.complete_parse['School'][1]
+        self.assertEqual(kind, 'dropdown')
+        self.assertEqual(options['Summit Tahoma'],
+                         ((True, False), 'RV$ctl04$ctl07$divDropDown$ctl01$HiddenIndices', '1'))
+
+    def test_fill_select_case_insensitive(self):
+        self.assertEqual(self.form.fill_form({'AcademicYear': '2019-2020'}), {'RV$ctl04$ctl03$ddValue': '2'})
+        self.assertEqual(self.form.fill_form({'AcademicYear': 'nope'}), {})
+
+    def test_fill_dropdown(self):
+        filled = self.form.fill_form({'School': {'summit prep': True, 'Summit Tahoma': True, 'Other': True}})
+        self.assertEqual(filled, {'RV$ctl04$ctl07$divDropDown$ctl01$HiddenIndices': '0,1'})
+        self.assertEqual(self.form.fill_form({'School': {'Summit Prep': False}}), {})
+
+    def test_final_form_data_keeps_state_fields(self):
+        final = self.form.get_final_form_data({'AcademicYear': '2018-2019'})
+        self.assertEqual(final['__VIEWSTATE'], 'vs')
+        self.assertEqual(final['RV$ctl04$ctl03$ddValue'], '1')
@@ -0,0 +1,52 @@
+import unittest
+from calpads.client import CALPADSClient
+from calpads.extract_requests import ExtractRequest
+from tests.fake_calpads import mount, selected_lea
+
+
+class SelectLEATest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = CALPADSClient('user', 'pass')
+        self.server = mount(self.client)
+        self.client._select_lea('1111111')
+
+    def requests_for(self, *args):
+        del self.server.requests[:]
+        self.client._select_lea(*args)
+        return list(self.server.requests)
+
+    def test_repeat_selection_sends_nothing(self):
+        self.assertEqual(self.requests_for('1111111'), [])
+        self.assertEqual(selected_lea(self.client.get_leas()), '1111111')
+
+    def test_switch_reuses_the_cached_form(self):
+        self.assertEqual(self.requests_for('2222222'), [('POST', '/UserOrgChange'), ('GET', '/')])
+        self.assertEqual(selected_lea(self.client.get_leas()), '2222222')
+
+    def test_stale_cached_form_is_refetched(self):
+        self.server.org_token = 'rotated-token'
+        self.assertEqual(self.requests_for('2222222'), [('POST', '/UserOrgChange'), ('GET', '/'),
+                                                        ('POST', '/UserOrgChange'), ('GET', '/')])
+        self.assertEqual(self.client._org_change_form[2], 'rotated-token')
+        self.assertEqual(self.client._selected_lea, '2222222')
+        self.assertEqual(selected_lea(self.client.get_leas()), '2222222')
+
+    def test_unknown_lea(self):
+        with self.assertRaises(Exception):
+            self.client._select_lea('3333333')
+        # The cached form didn't list it, so the homepage was checked once before giving up
+        self.assertEqual(self.server.requests[-1], ('GET', '/'))
+        self.assertEqual(self.client._selected_lea, '1111111')
+
+    def test_extract_request_for_another_lea_is_refused(self):
+        del self.server.requests[:]
+        with self.assertRaises(ValueError):
+            self.client.download_extract('1111111',
+                                         extract_request=ExtractRequest('2222222', 'SENR', 0, frozenset(), 7))
+        self.assertEqual(self.server.requests, [])
+        self.assertEqual(self.client._selected_lea, '1111111')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import threading
+import unittest
+from calpads.client import CALPADSClient
+from calpads.exceptions import SessionExpired, AuthenticationError
+from calpads.session_store import MemorySessionStore
+from tests.fake_calpads import mount, selected_lea
+
+
+class LazyLoginTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = CALPADSClient('user', 'pass')
+        self.server = mount(self.client)
+
+    def test_first_request_logs_in(self):
+        self.assertEqual(self.server.requests, [])
+        self.assertIsNone(selected_lea(self.client.get_leas()))
+        self.assertTrue(self.client.is_connected)
+        self.assertEqual(self.client._auth_generation, 1)
+
+    def test_expired_get_is_replayed_within_the_lea(self):
+        self.client._select_lea('2222222')
+        self.server.expire()
+        self.assertEqual(selected_lea(self.client.get_leas()), '2222222')
+        self.assertEqual(self.client._auth_generation, 2)
+        self.assertEqual(self.client._selected_lea, '2222222')
+
+    def test_expired_post_is_not_replayed(self):
+        self.client.get_leas()
+        self.server.expire()
+        with self.assertRaises(SessionExpired):
+            self.client._post('https://www.calpads.org/UserOrgChange', data={'selectedItem': '1'})
+        self.assertEqual(self.server.requests[-1], ('GET', '/'))
+
+    def test_threads_expiring_together_log_in_once(self):
+        self.client._select_lea('2222222')
+        self.server.expire()
+        del self.server.requests[:]
+        threads = 4
+        # Hold every thread's login page until all of them were bounced, so they all wait on the login lock
+        barrier = threading.Barrier(threads, timeout=5)
+        respond = self.server.respond
+
+        def bounce_together(request):
+            response = respond(request)
+            if request.method == 'GET' and request.path == '/Account/Login':
+                barrier.wait()
+            return response
+        self.server.respond = bounce_together
+        results = []
+
+        def get_leas(thread):
+            # A distinct URL per thread, since get_leas() would share one lookup between them
+            response = self.client._get('https://www.calpads.org/Leas?format=JSON&thread={}'.format(thread))
+            results.append(selected_lea(response.json()))
+        workers = [threading.Thread(target=get_leas, args=(thread,)) for thread in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(results, ['2222222'] * threads)
+        self.assertEqual(self.server.requests.count(('POST', '/Account/Login')), 1)
+        self.assertEqual(self.client._auth_generation, 2)
+
+    def test_custom_host(self):
+        client = CALPADSClient('user', 'pass', host='https://calpads.test')
+        server = mount(client)
+        self.assertEqual(client.host, 'https://calpads.test/')
+        self.assertIsNone(selected_lea(client.get_leas()))
+        self.assertTrue(client.is_connected)
+        self.assertTrue(all(timing.url.startswith('https://calpads.test/') for timing in client.last_login.timings))
+        self.assertEqual(server.requests[-1], ('GET', '/Leas'))
+
+    def test_bad_credentials_fail_fast(self):
+        client = CALPADSClient('user', 'wrong')
+        server = mount(client)
+        server.password = 'pass'
+        with self.assertRaises(AuthenticationError):
+            client.get_leas()
+        self.assertFalse(client.is_connected)
+        # The homepage, its redirect to the login page, and a single credentials POST
+        self.assertEqual(len(server.requests), 3)
+
+    def test_login_step_timings(self):
+        self.client.get_leas()
+        self.assertEqual([timing.state for timing in self.client.last_login.timings], ['credentials', 'openid'])
+        self.assertGreaterEqual(self.client.last_login.total_seconds, 0)
+
+
+class SessionStoreLoginTest(unittest.TestCase):
+
+    def test_second_client_reuses_session(self):
+        store = MemorySessionStore()
+        first = CALPADSClient('user', 'pass', session_store=store)
+        server = mount(first)
+        first.get_leas()
+        logins = server.requests.count(('POST', '/Account/Login'))
+        second = CALPADSClient('user', 'pass', session_store=store)
+        mount(second, server)
+        second.get_leas()
+        self.assertEqual(server.requests.count(('POST', '/Account/Login')), logins)
+
+    def test_shared_session_lea_is_rechecked(self):
+        store = MemorySessionStore()
+        first = CALPADSClient('user', 'pass', session_store=store)
+        server = mount(first)
+        first._select_lea('1111111')
+        second = CALPADSClient('user', 'pass', session_store=store)
+        mount(second, server)
+        del server.requests[:]
+        # The restored session is known to be working within the first client's LEA
+        second._select_lea('1111111')
+        self.assertEqual(server.requests, [])
+        second._select_lea('2222222')
+        self.assertEqual(server.requests.count(('POST', '/UserOrgChange')), 1)
+        # The first client's record of its LEA is stale now that the shared session switched
+        first._select_lea('1111111')
+        self.assertEqual(server.requests.count(('POST', '/UserOrgChange')), 2)
+        self.assertEqual(selected_lea(first.get_leas()), '1111111')
@@ -0,0 +1,67 @@
+import os
+import stat
+import time
+import unittest
+from tempfile import TemporaryDirectory
+from requests.cookies import RequestsCookieJar
+from calpads.session_store import (FileSessionStore, MemorySessionStore, session_key, dump_cookies, load_cookies,
+                                   generate_key)
+
+
+def make_jar():
+    jar = RequestsCookieJar()
+    jar.set('.AspNet.Cookies', 'secret', domain='www.calpads.org', path='/', secure=True,
+            rest={'HttpOnly': None})
+    jar.set('expired', 'x', domain='www.calpads.org', path='/', expires=int(time.time()) - 10)
+    return jar
+
+
+class CookieSerializationTest(unittest.TestCase):
+
+    def test_round_trip_skips_expired(self):
+        jar = RequestsCookieJar()
+        load_cookies(jar, dump_cookies(make_jar()))
+        self.assertEqual(jar.get('.AspNet.Cookies', domain='www.calpads.org'), 'secret')
+        self.assertIsNone(jar.get('expired'))
+        self.assertTrue(next(iter(jar)).has_nonstandard_attr('HttpOnly'))
+
+    def test_key_does_not_contain_username(self):
+        key = session_key('https://www.calpads.org/', 'Someone@Example.org')
+        self.assertNotIn('someone', key)
+        self.assertEqual(key, session_key('https://www.calpads.org/', 'someone@example.org'))
+
+
+class FileSessionStoreTest(unittest.TestCase):
+
+    def test_save_and_load(self):
+        with TemporaryDirectory() as td:
+            store = FileSessionStore(td)
+            store.save('k', dump_cookies(make_jar()))
+            self.assertEqual(stat.S_IMODE(os.stat(os.path.join(td, 'k.session')).st_mode), 0o600)
+            self.assertEqual(FileSessionStore(td).load('k')['cookies'][0]['value'], 'secret')
+            store.clear('k')
+            self.assertIsNone(store.load('k'))
+
+    def test_ttl(self):
+        with TemporaryDirectory() as td:
+            FileSessionStore(td).save('k', [])
+            self.assertIsNone(FileSessionStore(td, ttl=-1).load('k'))
+
+    def test_encrypted(self):
+        try:
+            import cryptography  # noqa: F401
+        except ImportError:
+            self.skipTest("cryptography is not installed")
+        with TemporaryDirectory() as td:
+            key = generate_key()
+            FileSessionStore(td, encryption_key=key).save('k', dump_cookies(make_jar()))
+            with open(os.path.join(td, 'k.session'), 'rb') as f:
+                self.assertNotIn(b'secret', f.read())
+            self.assertIsNotNone(FileSessionStore(td, encryption_key=key).load('k'))
+            self.assertIsNone(FileSessionStore(td, encryption_key=generate_key()).load('k'))
+
+    def test_memory_store(self):
+        store = MemorySessionStore()
+        with store.lock('k'):
+            store.save('k', [])
+        self.assertEqual(store.load('k')['cookies'], [])
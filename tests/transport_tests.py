@@ -0,0 +1,92 @@
+import io
+import time
+import unittest
+import requests
+from requests.adapters import HTTPAdapter
+from calpads.transport import CALPADSTransport, TokenBucket, AdaptiveConcurrency, retry_after
+
+
+class ScriptedAdapter(HTTPAdapter):
+    """Answers with the next status code in self.statuses instead of touching the network"""
+
+    def send(self, request, **kwargs):
+        self.sent.append((request.method, kwargs.get('timeout')))
+        response = requests.Response()
+        response.status_code = self.statuses.pop(0)
+        response.url = request.url
+        response.request = request
+        response._content = b''
+        response.raw = io.BytesIO()
+        return response
+
+
+class ScriptedTransport(CALPADSTransport, ScriptedAdapter):
+
+    def __init__(self, statuses, **kwargs):
+        super().__init__(backoff=0.001, **kwargs)
+        self.statuses = list(statuses)
+        self.sent = []
+
+
+def send(transport, method):
+    session = requests.Session()
+    session.mount('https://', transport)
+    return session.request(method, 'https://www.calpads.org/Leas?format=JSON')
+
+
+class CALPADSTransportTest(unittest.TestCase):
+
+    def test_retries_idempotent_requests(self):
+        transport = ScriptedTransport([503, 502, 200])
+        self.assertEqual(send(transport, 'GET').status_code, 200)
+        self.assertEqual(len(transport.sent), 3)
+        self.assertEqual(transport.sent[0][1], transport.timeout)
+
+    def test_gives_up_after_retries(self):
+        transport = ScriptedTransport([503] * 3, retries=2)
+        self.assertEqual(send(transport, 'GET').status_code, 503)
+        self.assertEqual(len(transport.sent), 3)
+
+    def test_does_not_retry_posts(self):
+        transport = ScriptedTransport([503, 200])
+        self.assertEqual(send(transport, 'POST').status_code, 503)
+        self.assertEqual(len(transport.sent), 1)
+
+    def test_closing_a_session_keeps_the_shared_pools(self):
+        transport = CALPADSTransport()
+        transport.poolmanager.connection_from_url('https://www.calpads.org/')
+        with requests.Session() as session:
+            session.mount('https://', transport)
+        self.assertEqual(len(transport.poolmanager.pools), 1)
+        transport.shutdown()
+        self.assertEqual(len(transport.poolmanager.pools), 0)
+
+    def test_overload_shrinks_concurrency(self):
+        transport = ScriptedTransport([503, 200], initial_concurrency=8)
+        send(transport, 'GET')
+        self.assertLess(transport.limits('www.calpads.org').concurrency.limit, 8)
+
+
+class LimiterTest(unittest.TestCase):
+
+    def test_token_bucket_rate(self):
+        bucket = TokenBucket(rate=100, burst=1)
+        started = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.04)
+
+    def test_aimd(self):
+        concurrency = AdaptiveConcurrency(initial=4, maximum=5)
+        for _ in range(8):
+            concurrency.acquire()
+            concurrency.release(latency=0.1)
+        self.assertEqual(int(concurrency.limit), 5)
+        concurrency.acquire()
+        concurrency.release(overloaded=True)
+        self.assertAlmostEqual(concurrency.limit, 2.5)
+
+    def test_retry_after(self):
+        response = requests.Response()
+        response.headers['Retry-After'] = '7'
+        self.assertEqual(retry_after(response), 7)